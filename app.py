@@ -1,7 +1,23 @@
+import logging
+import time
+import uuid
+
+# Measure how long this script run takes, starting before the imports
+RUN_STARTED = time.perf_counter()
+
 import streamlit as st
+import config
+from exports import EXPORT_FORMATS, export, payload_digest
+from instrumentation import count_regeneration, start_metrics_server
+from jobs import JobRunner
 from youtube_summarizer import YouTubeSummarizer
-from quiz_generator import QuizGenerator
-from fpdf import FPDF
+from question_bank import BankFiller, QuestionBank
+from quiz_generator import QuizGenerator, QuizStream
+from reporting import StreamlitReporter
+
+IMPORTS_DONE = time.perf_counter()
+
+logger = logging.getLogger(__name__)
 
 # CSS for reducing button size and other custom styling
 def local_css():
@@ -25,7 +41,17 @@ def local_css():
 # Apply CSS to decrease button size
 local_css()
 
-def quiz_page(quiz_generator):
+NUM_QUESTIONS = 10
+
+@st.fragment(run_every=1)
+def watch_quiz_stream(stream, shown):
+    """Poll the background quiz generation and rerun the page when new questions arrive."""
+    if stream.done.is_set() or len(stream.questions) != shown:
+        st.rerun()
+    st.caption(f"⏳ {shown} of {stream.num_questions} questions ready, more are on the way...")
+
+
+def quiz_page(quiz_generator, bank_filler):
     """Displays the quiz page with a cleaner UI and real-time feedback."""
     st.title("🎓 YouTube Video Quiz")
 
@@ -35,27 +61,47 @@ def quiz_page(quiz_generator):
         st.error("Not enough summary available to generate the quiz. Try different Video.")
         return
 
-    # Generate questions if not already in session_state or fewer than 10 questions are generated
-    if 'quiz_questions' not in st.session_state or len(st.session_state.quiz_questions) < 10:
+    # Generate questions in the background; each one is shown as soon as it is parsed and verified
+    if 'quiz_stream' not in st.session_state:
+        # Kept in the URL like the job, so a reload still skips the questions this user has seen
+        user = st.query_params.get("user") or uuid.uuid4().hex
+        st.query_params["user"] = user
+        stream = QuizStream(quiz_generator, summary, NUM_QUESTIONS, filler=bank_filler,
+                            video_id=st.session_state.get("video_id", ""), user=user)
+        st.session_state.quiz_stream = stream
+        st.session_state.quiz_questions = stream.questions  # grows in place as questions arrive
+        st.session_state.current_question_idx = 0
+        st.session_state.selected_answers = []
+    stream = st.session_state.quiz_stream
+
+    if not stream.questions:
         with st.spinner("Generating quiz, please wait..."):
-            raw_quiz_text = quiz_generator.generate_quiz(summary)
-            parsed_questions = quiz_generator.parse_quiz(raw_quiz_text) if raw_quiz_text else []
-
-            # Check if there are at least 10 questions
-            if len(parsed_questions) >= 10:
-                st.session_state.quiz_questions = parsed_questions[:10]
-                st.session_state.current_question_idx = 0
-                st.session_state.selected_answers = [None] * len(st.session_state.quiz_questions)
-            else:
-                # If not enough questions, display an error message
-                st.error("Not enough questions could be generated. Try again or select a different video with subtitles.")
-                return
+            stream.wait_for(1)
 
     questions = st.session_state.quiz_questions
+    show_messages(stream.messages)
     if not questions:
-        st.error("No questions parsed from the quiz.")
+        if stream.error:
+            st.error(f"Error generating the quiz: {stream.error}")
+        st.error("Not enough questions could be generated. Try again or select a different video with subtitles.")
+        del st.session_state.quiz_stream  # Start over on the next run
+        count_regeneration(quiz_generator.output_mode)
+        if st.button("Try again"):
+            st.rerun()
         return
 
+    # Keep one answer slot per question that has arrived so far
+    st.session_state.selected_answers.extend([None] * (len(questions) - len(st.session_state.selected_answers)))
+
+    generating = not stream.done.is_set()
+    if stream.error:
+        # Questions that arrived before the failure are still shown below
+        st.error(f"Error generating the rest of the quiz: {stream.error}")
+    if generating:
+        watch_quiz_stream(stream, len(questions))
+    elif len(questions) < NUM_QUESTIONS:
+        st.warning(f"Only {len(questions)} questions could be generated for this video.")
+
     # Track current question index
     current_idx = st.session_state.current_question_idx
     if current_idx < len(questions):
@@ -71,7 +117,7 @@ def quiz_page(quiz_generator):
 
         # Main page layout for quiz content
         st.markdown(f"### Question {current_idx + 1}")
-        question_text = current_question.get("question", "No question text found")
+        question_text = current_question.question or "No question text found"
         st.write(f"**{question_text}**")
 
         # Ensure selected_answer is initialized to None if not already set
@@ -80,8 +126,8 @@ def quiz_page(quiz_generator):
         # Radio buttons for options, no index set if no selection has been made yet
         selected_option = st.radio(
             "Select your answer:",
-            options=current_question["options"],
-            index=current_question["options"].index(selected_answer) if selected_answer else None,  
+            options=current_question.options,
+            index=current_question.options.index(selected_answer) if selected_answer else None,  
             key=f"temp_option_{current_idx}",
         )
 
@@ -99,30 +145,32 @@ def quiz_page(quiz_generator):
                 st.session_state.current_question_idx += 1
                 st.rerun()
 
+        if generating and current_idx == len(questions) - 1:
+            st.caption("The next question is on its way...")
+
         # Submit button
-        if current_idx == len(questions) - 1 and st.button("Submit Answers", key="submit_quiz"):
+        if not generating and current_idx == len(questions) - 1 and st.button("Submit Answers", key="submit_quiz"):
             st.session_state.selected_answers[current_idx] = selected_option
-            grade_quiz(quiz_generator)
+            # Kept in the session so the results (and their downloads) survive reruns
+            st.session_state.quiz_results = grade_quiz(questions, st.session_state.selected_answers)
 
+    if 'quiz_results' in st.session_state:
+        show_results(st.session_state.quiz_results)
 
 
-def grade_quiz(quiz_generator):
-    st.title("Quiz Results 🎉")
-    
-    # Fetch the dynamically generated questions and correct answers
-    questions = st.session_state.quiz_questions
+
+def grade_quiz(questions, selected_answers):
+    """Grade the answers and return the results shown on the results page and used by the exports."""
     total_questions = len(questions)
-    selected_answers = st.session_state.selected_answers
-    
     correct_count = 0
     feedback_list = []
 
     for i in range(total_questions):
         user_answer = selected_answers[i]
-        correct_answer = questions[i].get("correct_answer")
-        question_text = f"Question {i+1}: {questions[i]['question']}"
-        feedback_text = questions[i].get("feedback", "No feedback available")
-        options = questions[i].get("options", [])
+        correct_answer = questions[i].correct_answer
+        question_text = f"Question {i+1}: {questions[i].question}"
+        feedback_text = questions[i].feedback or "No feedback available"
+        options = questions[i].options
         
         # Initialize flags for correct answer and user-selected answer
         correct_answer_letter = None
@@ -150,9 +198,11 @@ def grade_quiz(quiz_generator):
                 options_feedback.append(option_text)  # No marks for unselected options
         
         # Determine if the user's answer was correct or incorrect
+        is_correct = False
         if user_selected_letter and correct_answer_letter:
             if user_selected_letter == correct_answer_letter:
                 correct_count += 1
+                is_correct = True
                 result = "Correct! ✅"
             else:
                 result = f"Incorrect ❌. The correct answer is {correct_answer}"
@@ -164,132 +214,231 @@ def grade_quiz(quiz_generator):
             "question": question_text,
             "user_answer": user_answer,
             "correct_answer": correct_answer,
+            "is_correct": is_correct,
             "result": result,
-            "options_feedback": "<br>".join(options_feedback),  # Joining all options with <br> for vertical order
+            "options": options_feedback,
             "feedback": feedback_text  # Always include feedback now
         })
 
-    # Calculate score and display it
-    score = correct_count / total_questions * 100
-    st.markdown(f"### You got {correct_count} out of {total_questions} questions correct.")
-    st.markdown(f"### Your score: {score:.2f}%")
+    return {
+        "correct_count": correct_count,
+        "total_questions": total_questions,
+        "score": correct_count / total_questions * 100,
+        "feedback": feedback_list,
+    }
+
+
+def export_button(fmt, payload, label, file_name, lazy=False):
+    """Download button for an export. Lazy exports are only rendered once the user asks for them."""
+    if lazy:
+        prepared = st.session_state.setdefault("prepared_exports", set())
+        key = (fmt, payload_digest(payload))
+        if key not in prepared:
+            if not st.button(f"Prepare {fmt.upper()} download", key=f"prepare_{fmt}"):
+                return
+            prepared.add(key)
+
+    st.download_button(
+        label=label,
+        data=export(fmt, payload),
+        file_name=file_name,
+        mime=EXPORT_FORMATS[fmt].mime,
+        key=f"download_{fmt}",
+    )
+
+
+def show_results(results):
+    st.title("Quiz Results 🎉")
+    st.markdown(f"### You got {results['correct_count']} out of {results['total_questions']} questions correct.")
+    st.markdown(f"### Your score: {results['score']:.2f}%")
     
     # Display feedback in a structured format for each question
-    for i, fb in enumerate(feedback_list):
+    for fb in results["feedback"]:
         st.markdown(f"**{fb['question']}**")
         st.markdown(f"Your answer: {fb['user_answer'] if fb['user_answer'] else 'No answer'}")
         st.markdown(f"Result: {fb['result']}")
-        st.markdown(f"**Options:**<br>{fb['options_feedback']}", unsafe_allow_html=True)  # Display options in vertical order
+        options_feedback = "<br>".join(fb['options'])  # <br> keeps the options in vertical order
+        st.markdown(f"**Options:**<br>{options_feedback}", unsafe_allow_html=True)
         if fb['feedback']:
             st.markdown(f"**Feedback:** {fb['feedback']}")
         st.markdown("---")
     
-    # Optionally generate and download the feedback in a PDF
-    pdf_filename = generate_pdf(feedback_list, correct_count, total_questions, score)
-
-    with open(pdf_filename, "rb") as pdf_file:
-        st.download_button(
-            label="📄 Download Results as PDF",
-            data=pdf_file,
-            file_name=pdf_filename,
-            mime="application/pdf"
-        )
-
-
-def generate_pdf(feedback_list, correct_count, total_questions, score):
-    """Generate a PDF from the feedback and save it to a file."""
-
-    # Initialize PDF
-    pdf = FPDF()
-    pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.add_page()
-
-    # Title
-    pdf.set_font("Arial", 'B', 16)
-    pdf.cell(200, 10, txt="Quiz Results", ln=True, align='C')
-
-    # Score
-    pdf.ln(10)
-    pdf.set_font("Arial", 'B', 12)
-    pdf.cell(200, 10, txt=f"Total Correct: {correct_count} out of {total_questions}", ln=True)
-    pdf.cell(200, 10, txt=f"Score: {score:.2f}%", ln=True)
-
-    # Add feedback for each question
-    pdf.ln(10)
-    pdf.set_font("Arial", size=12)
-    for fb in feedback_list:
-        # Handle the correct/incorrect markers with text-based symbols
-        result_text = fb['result'].replace('✅', '[~]').replace('❌', '')
-        feedback_text = fb['feedback'].replace('✅', '[~]').replace('❌', '')
-
-        # Adding feedback to the PDF, including options
-        pdf.multi_cell(0, 10, f"{fb['question']}\nYour answer: {fb['user_answer'] if fb['user_answer'] else 'No answer'}\nResult: {result_text}")
-        
-        # Adding the options and marking correct/incorrect
-        options_text = fb['options_feedback'].replace('<br>', '\n').replace('✅', '[~]').replace('❌', '')
-        pdf.multi_cell(0, 10, f"Options:\n{options_text}")
+    # Downloads are rendered in memory and cached by the results they contain
+    col_pdf, col_csv, col_json = st.columns(3)
+    with col_pdf:
+        export_button("pdf", results, "📄 Download Results as PDF", "quiz_results.pdf", lazy=True)
+    with col_csv:
+        export_button("csv", results, "Download Results as CSV", "quiz_results.csv")
+    with col_json:
+        export_button("json", results, "Download Results as JSON", "quiz_results.json")
+
+
+def show_summary_levels(levels):
+    """Let the user drill down from the condensed summary into the more detailed levels below it."""
+    # The last level is the summary shown above; level 0 holds the per-part summaries
+    for depth in range(len(levels) - 2, -1, -1):
+        title = "Summary of each part of the video" if depth == 0 else f"Intermediate summaries (level {depth})"
+        with st.expander(f"🔎 {title}"):
+            for i, text in enumerate(levels[depth]):
+                st.markdown(f"**Part {i + 1}**")
+                st.write(text)
+
+
+@st.fragment(run_every=1)
+def watch_summary_job(job_runner, job_id):
+    """Poll a running summary job, showing its progress and text so far, and rerun the page once it ends."""
+    job = job_runner.get(job_id)
+    if job is None or not job.active:
+        st.rerun()
+    if job.status == "queued":
+        st.caption("⏳ Waiting for a free worker...")
+    elif job.chunks_total:
+        st.progress(job.chunks_done / job.chunks_total,
+                    text=f"Summarized {job.chunks_done} of {job.chunks_total} parts of the video")
+    else:
+        st.caption("⏳ Fetching the transcript...")
+    st.write(job.partial)
 
-        # Adding feedback
-        pdf.multi_cell(0, 10, f"Feedback: {feedback_text}\n")
-        pdf.ln(5)  # Add some space between questions
 
-    # Save PDF locally
-    pdf_filename = "quiz_results.pdf"
-    pdf.output(pdf_filename)
+def forget_summary_job():
+    st.session_state.pop("summary_job", None)
+    st.query_params.pop("job", None)
 
-    return pdf_filename
 
+def show_messages(messages):
+    """Show the warnings and errors recorded by work done in the background (summary jobs, quiz streams)."""
+    for level, message in list(messages):
+        (st.error if level == "error" else st.warning)(message)
 
 
-def summary_page(summarizer):
+def summary_page(job_runner):
     """Displays the YouTube summary page."""
     st.title("🎥 YouTube Video Summarizer")
     
     # Check if the summary is already present to avoid rerunning the summary logic
     if 'summary' not in st.session_state:
-        youtube_url = st.text_input("Enter YouTube Video URL", key="youtube_url")
-
-        if youtube_url:
-            # Only display spinner for summary generation
-            with st.spinner("Generating summary, please wait..."):
-                summary = summarizer.generate_summary(youtube_url)
-
-            if summary:
-                st.session_state.summary = summary  # Save summary to session state
-                st.subheader("📑 Video Summary:")
-                st.write(summary)
-
-                if summary.strip():
-                    st.download_button(
-                        label="Download Summary",
-                        data=summary,
-                        file_name='youtube_summary.txt',
-                        mime='text/plain'
-                    )
-
-                if st.button("Ready for Quiz"):
-                    st.session_state.page = 'quiz_page'
-                    st.rerun()  # Move to quiz page after quiz generation
+        # The job ID is also kept in the URL, so a page reload reattaches to the job
+        job_id = st.session_state.get("summary_job") or st.query_params.get("job")
+        job = job_runner.get(job_id) if job_id else None
+        if job is None:
+            if job_id:
+                forget_summary_job()  # e.g. an old link to a job that has been purged
+            youtube_url = st.text_input("Enter YouTube Video URL", key="youtube_url")
+            if not youtube_url:
+                return
+            job_id = job_runner.submit(youtube_url)
+            job = job_runner.get(job_id)
+        st.session_state.summary_job = job_id
+        st.query_params["job"] = job_id
+
+        st.subheader("📑 Video Summary:")
+        if job.active:
+            # The summary is generated by a background worker; this only polls its progress
+            watch_summary_job(job_runner, job_id)
+            return
+
+        show_messages(job.messages)
+        if job.status == "failed":
+            st.error(job.error)
+            if st.button("Try another video"):
+                forget_summary_job()
+                # Otherwise the input still holds the failed URL and the next run submits it again
+                st.session_state.pop("youtube_url", None)
+                st.rerun()
+            return
+
+        result = job.result
+        summary = result["summary"]
+        st.write(job.partial)
+        st.session_state.summary = summary  # Save summary to session state
+        st.session_state.summary_levels = result["levels"]
+        st.session_state.video_id = job.video_id
+        if len(result["levels"]) > 1:
+            # Long videos are condensed further; that condensed text is what the quiz is built from
+            st.subheader("📝 Condensed Summary:")
+            st.write(summary)
+        show_summary_levels(result["levels"])
+        if result["time_to_first_token"] is not None:
+            st.caption(f"First text after {result['time_to_first_token']:.1f}s · finished in {result['total_time']:.1f}s")
+        if (result.get("cleaned_tokens") or 0) < (result.get("transcript_tokens") or 0):
+            st.caption(f"Transcript cleaned up from ~{result['transcript_tokens']} to ~{result['cleaned_tokens']} tokens")
+        if result.get("calls_avoided"):
+            st.caption(f"{result['calls_avoided']} repeated part(s) of the video did not need a model call")
+
+        if summary.strip():
+            export_button("txt", summary, "Download Summary", "youtube_summary.txt")
+
+        if st.button("Ready for Quiz"):
+            st.session_state.page = 'quiz_page'
+            st.rerun()  # Move to quiz page after quiz generation
     else:
         # If the summary is already generated, display it and the button to move to quiz page
         st.subheader("📑 Video Summary:")
         st.write(st.session_state.summary)
+        show_summary_levels(st.session_state.get('summary_levels', []))
 
         if st.button("Ready for Quiz"):
             st.session_state.page = 'quiz_page'
             st.rerun()  # Move to quiz page after quiz generation
 
+@st.cache_resource
+def get_job_runner():
+    """One summary job runner (worker threads and model client) per process; it resumes unfinished jobs on start."""
+    return JobRunner(YouTubeSummarizer())
+
+
+@st.cache_resource
+def get_quiz_generator():
+    """One QuizGenerator (and model client) per process, shared by all sessions and reruns."""
+    return QuizGenerator(reporter=StreamlitReporter())
+
+
+@st.cache_resource
+def get_bank_filler():
+    """The question bank and its background filler, shared by all sessions; None when the bank is disabled."""
+    if not config.QUESTION_BANK_TARGET:
+        return None
+    # A generator of its own: the filler runs on a background thread, outside any page
+    quiz_generator = get_quiz_generator()
+    return BankFiller(QuestionBank(), QuizGenerator(model=quiz_generator.model, contexts=quiz_generator.contexts))
+
+
+def show_timings(timings):
+    """Show how long each phase of this script run took (enable with SHOW_TIMINGS=1)."""
+    with st.sidebar.expander("⏱️ Run timings"):
+        for name, seconds in timings.items():
+            st.caption(f"{name}: {seconds * 1000:.1f} ms")
+
+
 def main():
-    summarizer = YouTubeSummarizer()
-    quiz_generator = QuizGenerator()
+    if not config.GEMINI_API_KEY and config.LLM_BACKEND != "fake":
+        st.error("Gemini API key is missing. Please set the GEMINI_API_KEY in your environment variables.")
+
+    start_metrics_server()
+
+    clients_started = time.perf_counter()
+    job_runner = get_job_runner()
+    quiz_generator = get_quiz_generator()
+    bank_filler = get_bank_filler()
+    clients_done = time.perf_counter()
 
     if 'page' not in st.session_state:
         st.session_state.page = 'summary_page'
 
     if st.session_state.page == 'summary_page':
-        summary_page(summarizer)
+        summary_page(job_runner)
     elif st.session_state.page == 'quiz_page':
-        quiz_page(quiz_generator)
+        quiz_page(quiz_generator, bank_filler)
+
+    timings = {
+        "imports": IMPORTS_DONE - RUN_STARTED,
+        "clients": clients_done - clients_started,
+        "page": time.perf_counter() - clients_done,
+        "total": time.perf_counter() - RUN_STARTED,
+    }
+    logger.debug("rerun timings: %s", {name: round(seconds * 1000, 1) for name, seconds in timings.items()})
+    if config.SHOW_TIMINGS:
+        show_timings(timings)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,228 @@
+"""Headless batch summarize + quiz over a list of YouTube URLs, video IDs or playlists.
+
+Usage:
+    python batch.py videos.txt --output results.jsonl --workers 4
+
+The input file has one URL, video ID or playlist (URL or ID) per line; blank
+lines and lines starting with '#' are ignored. One JSON record per video is
+appended to the output file as soon as it finishes, and the output doubles as
+the checkpoint: re-running the same command after a crash skips every video
+that already has a successful record and retries the rest.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+
+import config
+from instrumentation import count_regeneration, render_metrics, start_metrics_server
+from quiz_generator import QuizGenerator
+from reporting import LoggingReporter
+from youtube_summarizer import YouTubeSummarizer
+
+logger = logging.getLogger("batch")
+
+# Playlist IDs: a known prefix followed by at least 10 more characters (video IDs have exactly 11 in all)
+PLAYLIST_ID_REGEX = re.compile(r"(PL|UU|OL|FL|RD|LL)[\w-]{10,}")
+
+
+def is_playlist(entry):
+    """Return True if the entry is a playlist URL (`playlist?list=...`) or a playlist ID.
+
+    Watch links are single videos even with a `list=` parameter, as are bare 11-character video IDs.
+    """
+    if "v=" in entry or "youtu.be/" in entry:
+        return False
+    if "list=" in entry:
+        return urlparse(entry if "://" in entry else f"https://{entry}").path.rstrip("/").endswith("/playlist")
+    return len(entry) != 11 and PLAYLIST_ID_REGEX.fullmatch(entry) is not None
+
+
+def expand_playlist(entry):
+    """Return the video IDs of a playlist, using yt_dlp without downloading anything."""
+    import yt_dlp
+
+    url = entry if entry.startswith("http") else f"https://www.youtube.com/playlist?list={entry}"
+    with yt_dlp.YoutubeDL({"extract_flat": True, "quiet": True, "skip_download": True}) as ydl:
+        info = ydl.extract_info(url, download=False)
+    return [item["id"] for item in info.get("entries") or [] if item and item.get("id")]
+
+
+def read_video_ids(path, summarizer):
+    """Read the input file and return the unique video IDs in order, expanding playlists."""
+    video_ids = []
+    seen = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            entry = line.strip()
+            if not entry or entry.startswith("#"):
+                continue
+            if is_playlist(entry):
+                try:
+                    ids = expand_playlist(entry)
+                except Exception as e:
+                    logger.error("Could not expand playlist %s: %s", entry, e)
+                    continue
+            else:
+                ids = [summarizer.get_video_id(entry)]
+            for video_id in ids:
+                if video_id not in seen:
+                    seen.add(video_id)
+                    video_ids.append(video_id)
+    return video_ids
+
+
+def load_checkpoint(path):
+    """Return the IDs of videos that already have a successful record in the output file."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash; the video is simply processed again
+                continue
+            if record.get("status") == "ok":
+                done.add(record["video_id"])
+    return done
+
+
+class JsonlWriter:
+    """Append records to a JSONL file from several threads, flushing each one to disk."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class BatchRunner:
+    """Fetch transcripts concurrently, then summarize and build a quiz for each video on a worker pool."""
+
+    def __init__(self, summarizer, quiz_generator, workers=4, fetch_workers=8, num_questions=10):
+        self.summarizer = summarizer
+        self.quiz_generator = quiz_generator
+        self.workers = workers
+        self.fetch_workers = fetch_workers
+        self.num_questions = num_questions
+        self._local = threading.local()
+
+    def _http_client(self):
+        # One pooled session per fetch thread: requests.Session is not thread-safe
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def fetch(self, video_id):
+        return self.summarizer.get_transcript_segments(video_id, http_client=self._http_client())
+
+    def process(self, video_id, transcript_future):
+        """Summarize one video and generate its quiz, returning the output record."""
+        started = time.perf_counter()
+        record = {"video_id": video_id, "url": f"https://www.youtube.com/watch?v={video_id}"}
+        try:
+            segments = transcript_future.result()
+            if not segments:
+                raise RuntimeError("No transcript available")
+
+            result = self.summarizer.summarize_transcript(segments, video_id)
+            if not result.summary:
+                raise RuntimeError("No summary could be generated")
+            record.update(summary=result.summary, summary_levels=result.levels, failed_chunks=result.failed_chunks,
+                          transcript_tokens=result.transcript_tokens, cleaned_tokens=result.cleaned_tokens,
+                          calls_avoided=result.calls_avoided, single_shot=result.single_shot)
+
+            if self.num_questions:
+                context = self.quiz_generator.transcript_context(video_id)
+                questions = self.quiz_generator.generate_quiz(result.summary, self.num_questions,
+                                                              context=context) or []
+                # Top up a short quiz with only the missing questions
+                for _ in range(config.QUIZ_TOP_UP_ATTEMPTS):
+                    missing = self.num_questions - len(questions)
+                    if missing <= 0:
+                        break
+                    count_regeneration(self.quiz_generator.output_mode)
+                    questions += self.quiz_generator.generate_quiz(result.summary, missing, existing=questions,
+                                                                   context=context) or []
+                record["quiz"] = [question.to_dict() for question in questions]
+
+            record["status"] = "ok"
+        except Exception as e:
+            record.update(status="error", error=str(e))
+        record["elapsed"] = round(time.perf_counter() - started, 3)
+        return record
+
+    def run(self, video_ids, output_path):
+        """Process every video without a successful record in `output_path`; return (ok, failed) counts."""
+        done = load_checkpoint(output_path)
+        pending = [video_id for video_id in video_ids if video_id not in done]
+        logger.info("%d videos, %d already done, %d to process", len(video_ids), len(done), len(pending))
+
+        writer = JsonlWriter(output_path)
+        ok = failed = 0
+        with ThreadPoolExecutor(self.fetch_workers) as fetch_pool, ThreadPoolExecutor(self.workers) as work_pool:
+            # Transcripts are fetched ahead of the workers, which pick them up as they arrive
+            futures = [
+                work_pool.submit(self.process, video_id, fetch_pool.submit(self.fetch, video_id))
+                for video_id in pending
+            ]
+            for future in as_completed(futures):
+                record = future.result()
+                writer.write(record)
+                if record["status"] == "ok":
+                    ok += 1
+                else:
+                    failed += 1
+                    logger.warning("%s failed: %s", record["video_id"], record["error"])
+                logger.info("[%d/%d] %s %s", ok + failed, len(pending), record["video_id"], record["status"])
+        return ok, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize YouTube videos and generate quizzes without the UI.")
+    parser.add_argument("input", help="File with one YouTube URL, video ID or playlist per line")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSONL output file, also used as checkpoint")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="Videos summarized in parallel")
+    parser.add_argument("--fetch-workers", type=int, default=8, help="Transcripts fetched in parallel")
+    parser.add_argument("-n", "--num-questions", type=int, default=10, help="Quiz questions per video (0 to skip)")
+    parser.add_argument("--metrics", help="Write the run's Prometheus metrics to this file when done")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log debug output")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+    start_metrics_server()
+    reporter = LoggingReporter()
+    summarizer = YouTubeSummarizer(reporter=reporter)
+    quiz_generator = QuizGenerator(reporter=reporter, contexts=summarizer.contexts)
+    runner = BatchRunner(summarizer, quiz_generator, args.workers, args.fetch_workers, args.num_questions)
+
+    video_ids = read_video_ids(args.input, summarizer)
+    ok, failed = runner.run(video_ids, args.output)
+    logger.info("Finished: %d succeeded, %d failed", ok, failed)
+    if args.metrics:
+        with open(args.metrics, "w", encoding="utf-8") as f:
+            f.write(render_metrics())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,211 @@
+"""Micro-benchmarks for the text-processing hot paths, fully offline.
+
+Usage (from the repository root):
+    python benchmarks/bench_hotpaths.py                  # run and compare with the stored baseline
+    python benchmarks/bench_hotpaths.py --save-baseline  # record a new baseline on this machine
+    python benchmarks/bench_hotpaths.py --threshold 0.25 --filter parse_quiz
+
+Each case reports its best time, throughput and peak traced memory. The run
+fails (exit code 1) if a case is slower than the baseline by more than the
+threshold. Baselines are machine-specific, so record one on the machine that
+runs the comparison.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The hot paths don't read the transcript store; without this the quiz generator would create it under the repository
+os.environ["CONTEXT_REUSE"] = "0"
+
+from chunker import iter_transcript_chunks  # noqa: E402
+from llm_backends import FakeBackend  # noqa: E402
+from quiz_generator import QuizGenerator  # noqa: E402
+from quiz_parser import Question, QuizParser  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# The math questions of make_quiz_text
+EQUATION_REGEX = re.compile(r'^Solve for x: (\d+)x\+(\d+)=(\d+)$')
+
+WORDS = (
+    "the a function derivative equation value we so now limit integral area curve point slope "
+    "because therefore let's see this is what you get when take both sides divide multiply"
+).split()
+
+
+def make_transcript(minutes, seed=0):
+    """Synthetic auto-caption segments: ~150 spoken words per minute, one short line every ~2.5s."""
+    rng = random.Random(seed)
+    segments = []
+    start = 0.0
+    while start < minutes * 60:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(4, 9))]
+        text = " ".join(words) + ("." if rng.random() < 0.25 else "")
+        duration = rng.uniform(1.8, 3.2)
+        segments.append({"text": text, "start": round(start, 2), "duration": round(duration, 2)})
+        start += duration + (1.6 if rng.random() < 0.04 else 0.0)
+    return segments
+
+
+def make_quiz_text(num_questions, seed=0):
+    """Synthetic model output in the quiz format, with some markdown noise and math questions."""
+    rng = random.Random(seed)
+    blocks = []
+    for i in range(1, num_questions + 1):
+        if i % 5 == 0:
+            a, b = rng.randint(2, 9), rng.randint(1, 20)
+            question = f"Solve for x: {a}x+{b}={a * 3 + b}"
+            options = ["x = 3", "x = 4", "x = 5", "x = 6"]
+        else:
+            question = f"**Which statement about {rng.choice(WORDS)} {i} is correct?**"
+            options = [f"Statement {i}{letter} " + " ".join(rng.choice(WORDS) for _ in range(6)) for letter in "abcd"]
+        blocks.append(
+            f"Question {i}: {question}\n"
+            "Options:\n"
+            + "".join(f"({letter}) {option}\n" for letter, option in zip("ABCD", options))
+            + "\n"
+            f"**Correct Answer:** (A) {options[0]}\n"
+            f"Explanation: " + " ".join(rng.choice(WORDS) for _ in range(30)) + "\n"
+        )
+    return "\n".join(blocks)
+
+
+def parse_streamed(pieces):
+    """Feed quiz text to the incremental parser the way a streamed model response arrives."""
+    parser = QuizParser()
+    questions = []
+    for piece in pieces:
+        questions.extend(parser.feed(piece))
+    return questions + parser.close()
+
+
+def with_fresh_math(questions, counter):
+    """Copies of `questions` whose equations were never solved before, so math verification can't use its memo."""
+    fresh = []
+    for question in questions:
+        text = question.question
+        match = EQUATION_REGEX.match(text)
+        if match:
+            a, b, c = map(int, match.groups())
+            offset = next(counter)
+            text = f"Solve for x: {a}x+{b + offset}={c + offset}"
+        fresh.append(Question(text, list(question.options), question.correct_answer, question.feedback))
+    return fresh
+
+
+def build_cases():
+    """Return (name, function, work units, unit label) for every benchmark case."""
+    quiz_generator = QuizGenerator(model=FakeBackend(), contexts=None)
+    offsets = itertools.count(1)
+    cases = []
+
+    for minutes in (10, 60, 600):
+        segments = make_transcript(minutes)
+        size = sum(len(s["text"]) + 1 for s in segments) / 1e6
+        cases.append((
+            f"chunk_transcript[{minutes}min]",
+            lambda segments=segments: sum(1 for _ in iter_transcript_chunks(segments)),
+            size, "MB",
+        ))
+
+    for num_questions in (10, 100, 500):
+        quiz_text = make_quiz_text(num_questions)
+        questions = quiz_generator.parse_quiz(quiz_text)
+        lines = quiz_text.split("\n")
+        pieces = [quiz_text[i:i + 64] for i in range(0, len(quiz_text), 64)]
+        cases.extend([
+            (f"parse_quiz[{num_questions}q]", lambda t=quiz_text: quiz_generator.parse_quiz(t), num_questions, "questions"),
+            (f"parse_quiz_streamed[{num_questions}q]", lambda p=pieces: parse_streamed(p), num_questions, "questions"),
+            (f"clean_text[{num_questions}q]", lambda ls=lines: [quiz_generator.clean_text(l) for l in ls], len(lines), "lines"),
+            # Cold: every call solves new equations; memo: the same questions again, answered from the memo
+            (f"verify_math_answers_cold[{num_questions}q]",
+             lambda q=questions: quiz_generator.verify_math_answers(with_fresh_math(q, offsets)), num_questions, "questions"),
+            (f"verify_math_answers_memo[{num_questions}q]", lambda q=questions: quiz_generator.verify_math_answers(q), num_questions, "questions"),
+            (f"format_quiz[{num_questions}q]", lambda q=questions: quiz_generator.format_quiz(q), num_questions, "questions"),
+        ])
+    return cases
+
+
+def measure(func, min_time=0.2, repeat=5):
+    """Best seconds per call over `repeat` rounds, each looping for at least `min_time`."""
+    func()  # warm-up (imports, regex caches)
+    best = float("inf")
+    for _ in range(repeat):
+        loops = 0
+        started = time.perf_counter()
+        while True:
+            func()
+            loops += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_time:
+                break
+        best = min(best, elapsed / loops)
+    return best
+
+
+def peak_memory(func):
+    """Peak memory in bytes allocated by Python during a single call."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store this run as the new baseline (with --filter, only the cases that ran are replaced)")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown vs baseline (0.2 = 20%%)")
+    parser.add_argument("--filter", default="", help="Only run cases whose name contains this text")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per measurement round")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    print(f"{'case':34} {'time/call':>12} {'throughput':>24} {'peak mem':>10} {'vs base':>8}")
+    for name, func, units, unit in build_cases():
+        if args.filter not in name:
+            continue
+        seconds = measure(func, args.min_time)
+        peak = peak_memory(func)
+        results[name] = {"seconds": seconds, "peak_bytes": peak}
+
+        change = ""
+        if name in baseline:
+            ratio = seconds / baseline[name]["seconds"] - 1
+            change = f"{ratio:+.0%}"
+            if ratio > args.threshold:
+                regressions.append((name, ratio))
+        print(f"{name:34} {seconds * 1e3:10.3f}ms {units / seconds:12.1f} {unit + '/s':11} "
+              f"{peak / 1024:8.0f}KB {change:>8}")
+
+    if args.save_baseline:
+        # A filtered run only re-records its own cases; a full run also drops cases that no longer exist
+        saved = {**baseline, **results} if args.filter else results
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(saved, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    for name, ratio in regressions:
+        print(f"REGRESSION: {name} is {ratio:.0%} slower than the baseline (threshold {args.threshold:.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
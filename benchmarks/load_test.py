@@ -0,0 +1,611 @@
+"""Concurrent-session load test of the Streamlit app, fully offline.
+
+Usage (from the repository root):
+    python benchmarks/load_test.py --sessions 20                    # 20 concurrent sessions
+    python benchmarks/load_test.py --sessions 50 --concurrency 10 --gemini-latency 0.5,2 --gemini-error-rate 0.05
+    python benchmarks/load_test.py --sessions 20 --videos 3 --json load.json
+
+Stand-in servers for the YouTube watch/timedtext endpoints and the Gemini
+REST API run in a child process on localhost, with configurable latency,
+error rates and payload sizes. The app reaches them through its normal code
+paths: youtube_transcript_api fetches the stand-in watch page and captions,
+and the Gemini SDK is pointed at the stand-in with GEMINI_API_ENDPOINT.
+
+The app itself runs under `streamlit run` in a separate process, as in one
+container of the Dockerfile, and each simulated session is a headless client
+speaking Streamlit's websocket protocol to it, through summary -> quiz ->
+grade -> PDF download. The report gives p50/p95/p99 latency of each stage and
+of single script reruns, throughput, and the resident memory of the server per
+session. Caches and stores live in a new temporary directory, so every run
+starts cold, unless --cache-dir reuses one.
+"""
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from urllib.request import urlopen
+from xml.sax.saxutils import escape
+
+from streamlit.proto.Alert_pb2 import Alert
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from tornado.httpclient import AsyncHTTPClient
+from tornado.websocket import websocket_connect
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+APP_PATH = os.path.join(ROOT, "app.py")
+STAGES = ("summary", "quiz", "grade", "pdf", "session", "rerun")
+
+
+def parse_latency(text):
+    """"0.5" -> 0.5 seconds; "0.2,1.5" -> a (min, max) range drawn from uniformly."""
+    parts = [float(part) for part in text.split(",")]
+    return parts[0] if len(parts) == 1 else (parts[0], parts[1])
+
+
+def draw(latency, rng):
+    return rng.uniform(*latency) if isinstance(latency, tuple) else latency
+
+
+# --- Stand-in servers (run in a child process of their own) ---
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """YouTube watch page and captions (GET) and Gemini generateContent/streamGenerateContent (POST)."""
+
+    protocol_version = "HTTP/1.1"
+    settings = None
+    counters = None
+    rng = random.Random(0)
+    rng_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _roll(self):
+        with self.rng_lock:
+            return self.rng.random(), self.rng.random()
+
+    def _sleep(self, latency):
+        with self.rng_lock:
+            seconds = draw(latency, self.rng)
+        if seconds:
+            time.sleep(seconds)
+
+    def _count(self, name):
+        with self.counters[name].get_lock():
+            self.counters[name].value += 1
+
+    def _send(self, status, body, content_type="application/json"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        video_id = parse_qs(url.query).get("v", [""])[0]
+        self._count("transcript_requests")
+        self._sleep(self.settings["transcript_latency"])
+        if self._roll()[0] < self.settings["transcript_error_rate"]:
+            self._count("transcript_errors")
+            self._send(500, "stand-in transcript failure", "text/plain")
+        elif url.path == "/watch":
+            self._send(200, self.watch_page(video_id), "text/html")
+        elif url.path == "/timedtext":
+            self._send(200, self.captions(video_id), "text/xml")
+        else:
+            self._send(404, "not found", "text/plain")
+
+    def watch_page(self, video_id):
+        host, port = self.server.server_address[:2]
+        captions = {"playerCaptionsTracklistRenderer": {"captionTracks": [{
+            "baseUrl": f"http://{host}:{port}/timedtext?v={video_id}",
+            "name": {"simpleText": "English (auto-generated)"},
+            "languageCode": "en",
+            "kind": "asr",
+            "isTranslatable": False,
+        }]}}
+        return (f'<html><script>var ytInitialPlayerResponse = {{"playabilityStatus": {{"status": "OK"}},'
+                f'"captions":{json.dumps(captions)},"videoDetails":{{"videoId": "{video_id}"}}}};</script></html>')
+
+    def captions(self, video_id):
+        # Imported here: only the stand-in process renders transcripts
+        from bench_hotpaths import make_transcript
+
+        segments = make_transcript(self.settings["video_minutes"], seed=video_id)
+        return "<transcript>" + "".join(
+            f'<text start="{s["start"]}" dur="{s["duration"]}">{escape(s["text"])}</text>' for s in segments
+        ) + "</transcript>"
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        self._count("gemini_requests")
+        error_roll, block_roll = self._roll()
+        self._sleep(self.settings["gemini_latency"])
+        if error_roll < self.settings["gemini_error_rate"]:
+            self._count("gemini_errors")
+            status, name = random.choice(((429, "RESOURCE_EXHAUSTED"), (503, "UNAVAILABLE")))
+            self._send(status, json.dumps({"error": {"code": status, "message": "stand-in failure", "status": name}}))
+            return
+
+        prompt = "".join(part.get("text", "") for content in request.get("contents", [])
+                         for part in content.get("parts", []))
+        generation_config = request.get("generationConfig", {})
+        if block_roll < self.settings["gemini_block_rate"]:
+            text, finish_reason = "", 3  # SAFETY
+        else:
+            text, finish_reason = self.respond(prompt, generation_config), 1  # STOP
+        if ":streamGenerateContent" in urlparse(self.path).path:
+            self.stream(prompt, text, finish_reason)
+        else:
+            self._send(200, json.dumps(self.response(prompt, text, finish_reason)))
+
+    def respond(self, prompt, generation_config):
+        # Imported here: keeps the stand-in's quiz output in step with the offline FakeBackend
+        from llm_backends import fake_response
+
+        if "multiple-choice questions" in prompt:
+            mime_type = generation_config.get("responseMimeType") or generation_config.get("response_mime_type")
+            return fake_response(prompt, {"response_mime_type": mime_type} if mime_type else None)
+        words = prompt.split()[-200:] or ["summary"]
+        return " ".join(words[i % len(words)] for i in range(self.settings["summary_words"])) + "."
+
+    def response(self, prompt, text, finish_reason):
+        from chunker import estimate_tokens
+
+        return {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"},
+                            "finishReason": finish_reason, "index": 0}],
+            "usageMetadata": {"promptTokenCount": estimate_tokens(prompt), "candidatesTokenCount": estimate_tokens(text),
+                              "totalTokenCount": estimate_tokens(prompt) + estimate_tokens(text)},
+        }
+
+    def stream(self, prompt, text, finish_reason):
+        """Send the response as a chunked JSON array of partial responses, in `stream_pieces` pieces."""
+        pieces = self.settings["stream_pieces"]
+        step = max(1, len(text) // pieces)
+        parts = [text[i:i + step] for i in range(0, len(text), step)] or [""]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, part in enumerate(parts):
+            last = i == len(parts) - 1
+            body = self.response(prompt, part, finish_reason if last else 0)
+            data = (("[" if i == 0 else ",") + json.dumps(body) + ("]" if last else "")).encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+            if not last:
+                self._sleep(self.settings["stream_interval"])
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def serve_stand_ins(settings, counters, ready):
+    StandInHandler.settings = settings
+    StandInHandler.counters = counters
+    StandInHandler.rng = random.Random(settings["seed"])
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.daemon_threads = True
+    ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+# --- The app server and its sessions ---
+
+# Runs `streamlit run` with the transcript library's watch-page requests sent to the stand-in (it has no setting
+# for its host); everything else reaches the stand-ins through the app's own settings
+SERVER_BOOTSTRAP = (
+    "import os, sys\n"
+    "from youtube_transcript_api import _transcripts\n"
+    "_transcripts.WATCH_URL = os.environ['LOAD_TEST_WATCH_URL']\n"
+    "from streamlit.web.cli import main\n"
+    "sys.exit(main())\n"
+)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_app_server(port, env, log_path, timeout=120):
+    """Start the app under `streamlit run` on localhost and wait until it is healthy."""
+    command = [sys.executable, "-c", SERVER_BOOTSTRAP, "run", APP_PATH, f"--server.port={port}",
+               "--server.address=127.0.0.1", "--server.headless=true", "--server.fileWatcherType=none",
+               "--browser.gatherUsageStats=false", "--global.developmentMode=false"]
+    log = open(log_path, "wb")
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The app server exited with code {process.returncode}, see {log_path}")
+        try:
+            with urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as response:
+                if response.status == 200:
+                    return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"The app server did not become healthy within {timeout}s, see {log_path}")
+
+
+def process_memory(pid):
+    """Resident memory in bytes of a process and its direct children (the math verifier workers), or None."""
+    page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+    total = 0
+    try:
+        pids = [pid] + [int(child) for task in os.listdir(f"/proc/{pid}/task")
+                        for child in open(f"/proc/{pid}/task/{task}/children").read().split()]
+    except OSError:
+        return None  # Not Linux, or the server has gone
+    for process_id in pids:
+        try:
+            with open(f"/proc/{process_id}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+        except OSError:
+            pass
+    return total
+
+
+class SessionError(RuntimeError):
+    """A simulated session could not get through the app."""
+
+
+class Session:
+    """One browser tab going through the app: submit a video, take the quiz, grade it, download the PDF.
+
+    Speaks Streamlit's websocket protocol like the frontend does: every rerun
+    request carries the query string and the current value of the widgets it
+    has set, buttons are one-off triggers, and fragments that poll on a timer
+    (the summary job and quiz progress) are rerun on their own.
+    """
+
+    def __init__(self, index, video_id, args, port):
+        self.index = index
+        self.video_id = video_id
+        self.args = args
+        self.port = port
+        self.timings = {}
+        self.reruns = []
+        self.rng = random.Random(index)
+        self.widgets = {}  # widget ID -> (WidgetState field, value) sent with every rerun
+        self.query_string = ""
+        self.elements = []  # elements of the last full script run
+        self.fragments = []  # (fragment ID, seconds) of the fragments rerunning on a timer
+        self.cache = {}  # cacheable messages by hash, which the server may later send by reference only
+        self.connection = None
+
+    async def rerun(self, triggers=(), fragment_id=""):
+        """Request a script run and read its messages until it ends; return its status."""
+        message = BackMsg()
+        state = message.rerun_script
+        state.query_string = self.query_string
+        if fragment_id:
+            state.fragment_id = fragment_id
+            state.is_auto_rerun = True
+        for widget_id, (field, value) in self.widgets.items():
+            widget = state.widget_states.widgets.add(id=widget_id)
+            setattr(widget, field, value)
+        for widget_id in triggers:
+            state.widget_states.widgets.add(id=widget_id, trigger_value=True)
+
+        started = time.perf_counter()
+        await self.connection.write_message(message.SerializeToString(), binary=True)
+        elements, fragments = [], []
+        while True:
+            payload = await asyncio.wait_for(self.connection.read_message(), self.args.stage_timeout)
+            if payload is None:
+                raise SessionError("the server closed the connection")
+            forward = ForwardMsg()
+            forward.ParseFromString(payload)
+            if forward.WhichOneof("type") == "ref_hash":
+                forward = self.cache[forward.ref_hash]
+            elif forward.metadata.cacheable:
+                self.cache[forward.hash] = forward
+
+            kind = forward.WhichOneof("type")
+            if kind == "new_session":
+                elements, fragments = [], []
+            elif kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                element = forward.delta.new_element
+                if element.WhichOneof("type") == "exception":
+                    raise SessionError(f"app raised {element.exception.type}: {element.exception.message}")
+                elements.append(element)
+            elif kind == "auto_rerun":
+                fragments.append((forward.auto_rerun.fragment_id, forward.auto_rerun.interval))
+            elif kind == "page_info_changed":
+                self.query_string = forward.page_info_changed.query_string
+            elif kind == "script_finished":
+                status = forward.script_finished
+                if status == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    continue  # st.rerun(): the next run follows on the same connection
+                if status != ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY:
+                    self.elements, self.fragments = elements, fragments
+                self.reruns.append(time.perf_counter() - started)
+                return status
+
+    def find(self, kind, label=None, key=None):
+        """The last full run's first element of this kind with the label or widget key given, or None."""
+        for element in self.elements:
+            if element.WhichOneof("type") != kind:
+                continue
+            widget = getattr(element, kind)
+            if (label is None or widget.label == label) and (key is None or widget.id.endswith(f"-{key}")):
+                return widget
+        return None
+
+    def errors(self):
+        return [element.alert.body for element in self.elements
+                if element.WhichOneof("type") == "alert" and element.alert.format == Alert.ERROR]
+
+    async def wait_for(self, condition, stage):
+        """Let the page poll, as a browser would, until `condition()` returns something."""
+        deadline = time.perf_counter() + self.args.stage_timeout
+        while True:
+            found = condition()
+            if found:
+                return found
+            if self.errors():
+                raise SessionError(f"{stage}: {self.errors()[0]}")
+            if time.perf_counter() > deadline:
+                raise SessionError(f"{stage}: timed out after {self.args.stage_timeout:.0f}s")
+            if self.fragments:
+                fragment_id, interval = self.fragments[0]
+                await asyncio.sleep(interval)
+                await self.rerun(fragment_id=fragment_id)
+            else:
+                await asyncio.sleep(self.args.poll_interval)
+                await self.rerun()
+
+    async def run(self):
+        started = time.perf_counter()
+        self.connection = await websocket_connect(f"ws://127.0.0.1:{self.port}/_stcore/stream",
+                                                  subprotocols=["streamlit"], max_message_size=2 ** 30)
+        try:
+            await self.rerun()
+            url_input = await self.wait_for(lambda: self.find("text_input", key="youtube_url"), "start")
+            self.widgets[url_input.id] = ("string_value", f"https://www.youtube.com/watch?v={self.video_id}")
+            await self.rerun()
+            ready = await self.wait_for(lambda: self.find("button", label="Ready for Quiz"), "summary")
+            self.timings["summary"] = time.perf_counter() - started
+
+            quiz_started = time.perf_counter()
+            await self.rerun(triggers=[ready.id])
+            index = 0
+            while True:
+                radio = await self.wait_for(lambda: self.find("radio", key=f"temp_option_{index}"), "quiz")
+                self.widgets[radio.id] = ("int_value", self.rng.randrange(len(radio.options)))
+                await self.rerun()
+                button = await self.wait_for(
+                    lambda: self.find("button", key="submit_quiz") or self.find("button", label="Next"), "quiz")
+                if button.label == "Next":
+                    await self.rerun(triggers=[button.id])
+                    index += 1
+                    continue
+                self.timings["quiz"] = time.perf_counter() - quiz_started
+                grade_started = time.perf_counter()
+                await self.rerun(triggers=[button.id])
+                await self.wait_for(lambda: self.find("button", key="prepare_pdf"), "grade")
+                self.timings["grade"] = time.perf_counter() - grade_started
+                break
+
+            pdf_started = time.perf_counter()
+            await self.rerun(triggers=[self.find("button", key="prepare_pdf").id])
+            download = await self.wait_for(lambda: self.find("download_button", key="download_pdf"), "pdf")
+            response = await AsyncHTTPClient().fetch(f"http://127.0.0.1:{self.port}{download.url}",
+                                                     request_timeout=self.args.stage_timeout)
+            if not response.body.startswith(b"%PDF"):
+                raise SessionError("pdf: the download is not a PDF")
+            self.timings["pdf"] = time.perf_counter() - pdf_started
+            self.timings["session"] = time.perf_counter() - started
+        finally:
+            self.connection.close()
+        return self
+
+
+async def run_sessions(sessions, args):
+    """Run the sessions, at most `concurrency` at once, starts spread over the ramp-up; return (session, error)."""
+    limit = asyncio.Semaphore(args.concurrency or len(sessions))
+    spacing = args.ramp_up / max(1, len(sessions) - 1)
+
+    async def run_one(session):
+        await asyncio.sleep(session.index * spacing)
+        async with limit:
+            try:
+                return await session.run(), None
+            except Exception as e:
+                if args.verbose:
+                    traceback.print_exc()
+                # One line, so failures with the same cause are counted together
+                return session, f"{type(e).__name__}: {' '.join(str(e).split())[:160]}"
+
+    return await asyncio.gather(*(run_one(session) for session in sessions))
+
+
+async def sample_memory(pid, samples, interval=0.1):
+    while True:
+        memory = process_memory(pid)
+        if memory is not None:
+            samples.append(memory)
+        await asyncio.sleep(interval)
+
+
+async def measure(sessions, args, server_pid):
+    """Run the sessions while sampling the memory of the app server; return (results, wall time, peak memory)."""
+    samples = []
+    sampler = asyncio.ensure_future(sample_memory(server_pid, samples))
+    started = time.perf_counter()
+    results = await run_sessions(sessions, args)
+    wall_time = time.perf_counter() - started
+    sampler.cancel()
+    return results, wall_time, max(samples, default=None)
+
+
+# --- Report ---
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+def summarize(results, wall_time, memory, counters):
+    completed = [session for session, error in results if error is None]
+    failures = {}
+    for _, error in results:
+        if error is not None:
+            failures[error] = failures.get(error, 0) + 1
+    stages = {}
+    for stage in STAGES:
+        if stage == "rerun":
+            values = [seconds for session, _ in results for seconds in session.reruns]
+        else:
+            values = [session.timings[stage] for session in completed if stage in session.timings]
+        if values:
+            stages[stage] = {"count": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95),
+                             "p99": percentile(values, 99), "max": max(values)}
+    return {
+        "sessions": len(results),
+        "completed": len(completed),
+        "failures": failures,
+        "wall_time": wall_time,
+        "throughput_per_minute": len(completed) / wall_time * 60 if wall_time else 0.0,
+        "stages": stages,
+        "memory": memory,
+        "stand_ins": counters,
+    }
+
+
+def print_report(report):
+    print(f"\n{report['completed']} of {report['sessions']} sessions completed in {report['wall_time']:.1f}s "
+          f"({report['throughput_per_minute']:.1f} sessions/min)")
+    print(f"{'stage':10} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for stage, stats in report["stages"].items():
+        print(f"{stage:10} {stats['count']:6d} " + " ".join(f"{stats[k]:8.2f}s" for k in ("p50", "p95", "p99", "max")))
+    memory = report["memory"]
+    if memory["peak"] is not None:
+        print(f"server memory: {memory['baseline'] / 2 ** 20:.0f}MB before, {memory['peak'] / 2 ** 20:.0f}MB peak, "
+              f"{memory['per_session'] / 2 ** 20:.2f}MB per session")
+    counters = report["stand_ins"]
+    print(f"stand-ins: {counters['gemini_requests']} Gemini requests ({counters['gemini_errors']} failed), "
+          f"{counters['transcript_requests']} transcript requests ({counters['transcript_errors']} failed)")
+    for error, count in sorted(report["failures"].items(), key=lambda item: -item[1]):
+        print(f"FAILED x{count}: {error}")
+
+
+def app_environment(cache_dir, stand_in_port):
+    """Environment of the app server: the stand-ins and empty stores; explicit environment settings still win."""
+    env = dict(os.environ)
+    env.update({
+        "LLM_BACKEND": "gemini",
+        "GEMINI_API_ENDPOINT": f"http://127.0.0.1:{stand_in_port}",
+        "LOAD_TEST_WATCH_URL": f"http://127.0.0.1:{stand_in_port}/watch?v={{video_id}}",
+    })
+    env.setdefault("GEMINI_API_KEY", "offline-load-test")
+    env.setdefault("METRICS_JSON_LOGS", "0")
+    for name, file_name in (("TRANSCRIPT_CACHE_PATH", "transcripts.sqlite3"), ("SUMMARY_CACHE_PATH", "summaries.sqlite3"),
+                            ("NEAR_DUPLICATE_INDEX_PATH", "chunk_index.sqlite3"), ("JOB_STORE_PATH", "jobs.sqlite3"),
+                            ("QUESTION_BANK_PATH", "question_bank.sqlite3"), ("CONTEXT_STORE_PATH", "contexts.sqlite3")):
+        env[name] = os.path.join(cache_dir, file_name)
+    return env
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=10, help="Number of simulated sessions")
+    parser.add_argument("--concurrency", type=int, default=0, help="Sessions running at once (default: all)")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Seconds over which session starts are spread")
+    parser.add_argument("--videos", type=int, default=0, help="Distinct videos shared by the sessions (default: one each)")
+    parser.add_argument("--video-minutes", type=float, default=10, help="Length of each stand-in transcript")
+    parser.add_argument("--transcript-latency", type=parse_latency, default=0.1, help="Seconds per transcript request")
+    parser.add_argument("--transcript-error-rate", type=float, default=0.0, help="Share of transcript requests failing")
+    parser.add_argument("--gemini-latency", type=parse_latency, default=(0.3, 1.0), help="Seconds before a response")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0, help="Share of Gemini requests failing (429/503)")
+    parser.add_argument("--gemini-block-rate", type=float, default=0.0, help="Share of responses blocked for safety")
+    parser.add_argument("--summary-words", type=int, default=150, help="Words in each stand-in summary response")
+    parser.add_argument("--stream-pieces", type=int, default=8, help="Pieces a streamed response is sent in")
+    parser.add_argument("--stream-interval", type=parse_latency, default=0.05, help="Seconds between streamed pieces")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between reruns while waiting")
+    parser.add_argument("--stage-timeout", type=float, default=300, help="Seconds before a stage counts as failed")
+    parser.add_argument("--warm-up", type=int, default=1, help="Sessions run before measuring (loads the app)")
+    parser.add_argument("--cache-dir", help="Keep the app's caches and stores here (default: a new temporary directory)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    parser.add_argument("--max-p95", type=float, help="Exit with an error if the session p95 exceeds these seconds")
+    parser.add_argument("--verbose", action="store_true", help="Print the traceback of failed sessions")
+    args = parser.parse_args(argv)
+
+    settings = {name: getattr(args, name) for name in (
+        "video_minutes", "transcript_latency", "transcript_error_rate", "gemini_latency", "gemini_error_rate",
+        "gemini_block_rate", "summary_words", "stream_pieces", "stream_interval", "seed")}
+    context = multiprocessing.get_context("spawn")
+    counters = {name: context.Value("i", 0) for name in (
+        "gemini_requests", "gemini_errors", "transcript_requests", "transcript_errors")}
+    ready = context.Queue()
+    stand_ins = context.Process(target=serve_stand_ins, args=(settings, counters, ready), daemon=True)
+    stand_ins.start()
+    stand_in_port = ready.get(timeout=30)
+
+    cache_dir = args.cache_dir or tempfile.mkdtemp(prefix="load-test-")
+    os.makedirs(cache_dir, exist_ok=True)
+    port = free_port()
+    log_path = os.path.join(cache_dir, "server.log")
+    server = start_app_server(port, app_environment(cache_dir, stand_in_port), log_path)
+    try:
+        loop = asyncio.new_event_loop()
+        warm_up = [Session(i, f"warmup{args.seed}x{i:04d}", args, port) for i in range(args.warm_up)]
+        for session, error in loop.run_until_complete(run_sessions(warm_up, args)):
+            if error is not None:
+                raise RuntimeError(f"Warm-up session failed ({error}), see {log_path}")
+
+        before = {name: value.value for name, value in counters.items()}
+        baseline = process_memory(server.pid)
+        videos = [f"load{args.seed}x{i:04d}" for i in range(args.videos or args.sessions)]
+        sessions = [Session(i, videos[i % len(videos)], args, port) for i in range(args.sessions)]
+        results, wall_time, peak = loop.run_until_complete(measure(sessions, args, server.pid))
+        loop.close()
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        stand_ins.terminate()
+
+    memory = {"baseline": baseline, "peak": peak,
+              "per_session": (peak - baseline) / len(sessions) if peak is not None and baseline else None}
+    report = summarize(results, wall_time, memory,
+                       {name: value.value - before[name] for name, value in counters.items()})
+    report["settings"] = {**settings, "sessions": args.sessions, "concurrency": args.concurrency or args.sessions,
+                          "videos": len(videos), "cache_dir": cache_dir}
+    print_report(report)
+    print(f"server log: {log_path}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if not report["completed"]:
+        return 1
+    session_p95 = report["stages"]["session"]["p95"]
+    if args.max_p95 is not None and session_p95 > args.max_p95:
+        print(f"FAILED: session p95 {session_p95:.1f}s is above {args.max_p95:.1f}s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
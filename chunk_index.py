@@ -0,0 +1,205 @@
+"""Near-duplicate detection for transcript chunks with MinHash and LSH.
+
+Lecture series and streams repeat long stretches (intros, sponsor reads,
+recaps, re-uploads of the same talk) whose text is almost, but not exactly,
+the same, so the content-addressed summary cache misses them. Each chunk gets
+a MinHash signature over its 5-word shingles; signatures are split into bands
+and every band is hashed into a bucket (locality-sensitive hashing), so only
+chunks sharing a bucket are compared. `ChunkIndex` persists the buckets and
+signatures of every summarized chunk in SQLite, which keeps lookups to one
+indexed query however many videos have been seen.
+"""
+import hashlib
+import re
+import time
+
+import numpy as np
+
+import config
+from sqlite_store import SQLiteStore
+
+NUM_PERMUTATIONS = 64
+# Persistent index: 16 bands of 4 rows, so pairs above ~0.5 similarity almost always share a bucket,
+# then the threshold decides
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+SHINGLE_WORDS = 5
+WORD_REGEX = re.compile(r'\w+')
+
+# Fixed seed: signatures are stored, so the hash functions must be the same in every process and run
+_random = np.random.default_rng(20240901)
+_MULTIPLIERS = _random.integers(1, 2 ** 63, NUM_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_OFFSETS = _random.integers(0, 2 ** 63, NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def _shingle_hashes(text):
+    words = WORD_REGEX.findall(text.lower())
+    size = min(SHINGLE_WORDS, len(words)) or 1
+    shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+         for shingle in shingles),
+        dtype=np.uint64, count=len(shingles),
+    )
+
+
+def sketch(text):
+    """MinHash signature of a text (NUM_PERMUTATIONS uint32 minimums of multiply-shift hashes of its
+    shingles) and its number of shingles."""
+    hashes = _shingle_hashes(text)
+    # uint64 arithmetic wraps around, which is what multiply-shift hashing wants
+    permuted = (hashes[None, :] * _MULTIPLIERS[:, None] + _OFFSETS[:, None]) >> np.uint64(32)
+    return permuted.min(axis=1).astype(np.uint32), len(hashes)
+
+
+def minhash(text):
+    return sketch(text)[0]
+
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+    return float(np.count_nonzero(signature == other)) / NUM_PERMUTATIONS
+
+
+def containment(signature, size, other, other_size):
+    """Estimated share of the first shingle set that is contained in the second one."""
+    jaccard = similarity(signature, other)
+    return min(1.0, jaccard * (size + other_size) / ((1 + jaccard) * size)) if size else 0.0
+
+
+def band_buckets(signature, scope="", rows_per_band=ROWS_PER_BAND):
+    """LSH bucket of each band of a signature; `scope` keeps e.g. different models' entries apart."""
+    buckets = []
+    for band in range(NUM_PERMUTATIONS // rows_per_band):
+        rows = signature[band * rows_per_band:(band + 1) * rows_per_band].tobytes()
+        digest = hashlib.blake2b(f"{scope}\0{band}\0".encode("utf-8") + rows, digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, "little", signed=True))
+    return buckets
+
+
+def find_repeats(sketches, threshold=None):
+    """Map the index of each chunk that repeats earlier text of the same video to the earlier chunk's index.
+
+    `sketches` are the (signature, size) pairs of the chunks, in order. A
+    repeated passage rarely lines up with the chunk boundaries of its first
+    occurrence, so a chunk counts as a repeat when at least `threshold` of it
+    is contained in an earlier chunk or in two consecutive earlier chunks (the
+    MinHash of a union is the element-wise minimum of the signatures).
+    """
+    threshold = config.NEAR_DUPLICATE_THRESHOLD if threshold is None else threshold
+    repeats = {}
+    if not threshold:
+        return repeats
+
+    # Narrow bands: a contained chunk's Jaccard similarity to a union twice its size is only about 0.5
+    rows_per_band = 2
+    buckets = {}
+    targets = []  # (signature, size, chunk index) of earlier chunks and consecutive pairs of them
+
+    def index_target(signature, size, index):
+        for bucket in band_buckets(signature, rows_per_band=rows_per_band):
+            buckets.setdefault(bucket, set()).add(len(targets))
+        targets.append((signature, size, index))
+
+    previous = None
+    for index, (signature, size) in enumerate(sketches):
+        candidates = set()
+        for bucket in band_buckets(signature, rows_per_band=rows_per_band):
+            candidates.update(buckets.get(bucket, ()))
+        best = max(((containment(signature, size, *targets[t][:2]), -targets[t][2]) for t in candidates), default=None)
+        if best is not None and best[0] >= threshold:
+            repeats[index] = -best[1]
+            continue
+
+        # Repeats are not indexed themselves, so every repeat points at the first occurrence
+        index_target(signature, size, index)
+        if previous is not None:
+            index_target(np.minimum(previous[0], signature), previous[1] + size, previous[2])
+        previous = (signature, size, index)
+    return repeats
+
+
+class ChunkIndex(SQLiteStore):
+    """Persistent LSH index from chunk signatures to the summary cache keys of the chunks' summaries.
+
+    Holds at most `max_entries` chunks, oldest evicted first; entries whose
+    summary has left the summary cache are removed when a lookup finds them.
+    """
+
+    schema = (
+        """
+        CREATE TABLE IF NOT EXISTS chunk_signatures (
+            key TEXT PRIMARY KEY,
+            scope TEXT NOT NULL,
+            signature BLOB NOT NULL,
+            created_at REAL NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chunk_buckets (
+            bucket INTEGER NOT NULL,
+            key TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_chunk_buckets_bucket ON chunk_buckets (bucket)",
+        "CREATE INDEX IF NOT EXISTS idx_chunk_buckets_key ON chunk_buckets (key)",
+        "CREATE INDEX IF NOT EXISTS idx_chunk_signatures_created ON chunk_signatures (created_at)",
+    )
+
+    def __init__(self, path=None, max_entries=None):
+        self.max_entries = config.SUMMARY_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        super().__init__(path or config.NEAR_DUPLICATE_INDEX_PATH)
+
+    def add(self, key, signature, scope=""):
+        """Index the chunk whose summary is stored under `key`."""
+        buckets = band_buckets(signature, scope)
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM chunk_buckets WHERE key = ?", (key,))
+            conn.execute(
+                "INSERT OR REPLACE INTO chunk_signatures VALUES (?, ?, ?, ?)",
+                (key, scope, signature.tobytes(), time.time()),
+            )
+            conn.executemany("INSERT INTO chunk_buckets VALUES (?, ?)", [(bucket, key) for bucket in buckets])
+            evicted = [row[0] for row in conn.execute(
+                "SELECT key FROM chunk_signatures ORDER BY created_at DESC LIMIT -1 OFFSET ?", (self.max_entries,)
+            )]
+            self._delete(conn, evicted)
+
+    def find(self, signature, scope="", threshold=None):
+        """Return (key, similarity) of the most similar indexed chunk at or above `threshold`, or None."""
+        threshold = config.NEAR_DUPLICATE_THRESHOLD if threshold is None else threshold
+        buckets = band_buckets(signature, scope)
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT key, signature FROM chunk_signatures WHERE scope = ? AND key IN (
+                    SELECT key FROM chunk_buckets WHERE bucket IN ({",".join("?" * len(buckets))})
+                )
+                """,
+                (scope, *buckets),
+            ).fetchall()
+
+        best = None
+        for key, blob in rows:
+            score = similarity(signature, np.frombuffer(blob, dtype=np.uint32))
+            if score >= threshold and (best is None or score > best[1]):
+                best = (key, score)
+        return best
+
+    def contains(self, key):
+        with self._lock, self._connect() as conn:
+            return conn.execute("SELECT 1 FROM chunk_signatures WHERE key = ?", (key,)).fetchone() is not None
+
+    def remove(self, key):
+        with self._lock, self._connect() as conn:
+            self._delete(conn, [key])
+
+    def _delete(self, conn, keys):
+        for key in keys:
+            conn.execute("DELETE FROM chunk_buckets WHERE key = ?", (key,))
+            conn.execute("DELETE FROM chunk_signatures WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM chunk_buckets")
+            conn.execute("DELETE FROM chunk_signatures")
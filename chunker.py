@@ -0,0 +1,129 @@
+import re
+from dataclasses import dataclass
+
+import config
+
+# Segment texts ending in one of these close a sentence
+SENTENCE_END_REGEX = re.compile(r'[.!?]["\')\]]*$')
+# Used to stream a plain string transcript as sentence-sized pieces
+SENTENCE_REGEX = re.compile(r'[^.!?]+(?:[.!?]+["\')\]]*|$)')
+
+
+@dataclass
+class TranscriptChunk:
+    """A packed run of transcript text with the time range it covers (seconds, None if unknown)."""
+    text: str
+    start: float
+    end: float
+    token_count: int
+
+
+@dataclass
+class _Piece:
+    text: str
+    start: float
+    end: float
+    tokens: int
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token for English), good enough for budgeting."""
+    return max(1, (len(text) + 3) // 4)
+
+
+def _iter_pieces(segments, max_tokens, count_tokens):
+    """Normalize segments (dicts with text/start/duration, or a plain string) into pieces within budget."""
+    if isinstance(segments, str):
+        segments = ({"text": match.group(0)} for match in SENTENCE_REGEX.finditer(segments))
+
+    for segment in segments:
+        text = " ".join(segment["text"].split())
+        if not text:
+            continue
+        start = segment.get("start")
+        end = start + segment.get("duration", 0) if start is not None else None
+
+        tokens = count_tokens(text)
+        if tokens <= max_tokens:
+            yield _Piece(text, start, end, tokens)
+            continue
+
+        # A single oversized segment is split on words so no chunk exceeds the budget
+        words = text.split()
+        step = max(1, len(words) * max_tokens // tokens)
+        for i in range(0, len(words), step):
+            part = " ".join(words[i:i + step])
+            yield _Piece(part, start, end, count_tokens(part))
+
+
+def _best_cut(buffer, max_tokens, pause_seconds):
+    """Number of pieces to emit: the last sentence end, else the last pause, in the back half of the budget."""
+    min_fill = max_tokens // 2
+    filled = 0
+    sentence_cut = pause_cut = None
+    for i, piece in enumerate(buffer):
+        filled += piece.tokens
+        if filled < min_fill:
+            continue
+        if SENTENCE_END_REGEX.search(piece.text):
+            sentence_cut = i + 1
+        next_piece = buffer[i + 1] if i + 1 < len(buffer) else None
+        if next_piece and piece.end is not None and next_piece.start is not None \
+                and next_piece.start - piece.end >= pause_seconds:
+            pause_cut = i + 1
+    return sentence_cut or pause_cut or len(buffer)
+
+
+def _make_chunk(pieces):
+    return TranscriptChunk(
+        text=" ".join(piece.text for piece in pieces),
+        start=pieces[0].start,
+        end=pieces[-1].end,
+        token_count=sum(piece.tokens for piece in pieces),
+    )
+
+
+def iter_transcript_chunks(segments, max_tokens=None, overlap_tokens=None, count_tokens=estimate_tokens,
+                           pause_seconds=1.5):
+    """Lazily pack timed transcript segments into chunks of at most `max_tokens` tokens.
+
+    Chunks preferably end on a sentence boundary or a pause in speech, and the
+    last `overlap_tokens` worth of segments of a chunk are repeated at the start
+    of the next one. Only the segments of the chunk being built are held in
+    memory, so long transcripts can be streamed straight from the source.
+    """
+    max_tokens = max_tokens or config.CHUNK_MAX_TOKENS
+    overlap_tokens = config.CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    overlap_tokens = min(overlap_tokens, max_tokens // 2)
+
+    buffer = []
+    buffered_tokens = 0
+    new_pieces = 0  # pieces in the buffer that were not already emitted as overlap
+
+    for piece in _iter_pieces(segments, max_tokens, count_tokens):
+        while buffer and buffered_tokens + piece.tokens > max_tokens:
+            cut = _best_cut(buffer, max_tokens, pause_seconds)
+            emitted, rest = buffer[:cut], buffer[cut:]
+            yield _make_chunk(emitted)
+
+            # Carry the tail of the emitted chunk over, never the whole chunk, so we always make progress
+            carried = []
+            carried_tokens = 0
+            for previous in reversed(emitted[1:]):
+                if carried_tokens + previous.tokens > overlap_tokens:
+                    break
+                carried.insert(0, previous)
+                carried_tokens += previous.tokens
+            if carried_tokens + sum(p.tokens for p in rest) + piece.tokens > max_tokens:
+                carried = []
+
+            buffer = carried + rest
+            buffered_tokens = sum(p.tokens for p in buffer)
+            new_pieces = len(rest)
+
+        buffer.append(piece)
+        buffered_tokens += piece.tokens
+        new_pieces += 1
+
+    if buffer and new_pieces:
+        yield _make_chunk(buffer)
@@ -0,0 +1,113 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file before reading any setting
+load_dotenv()
+
+# Transcript cache settings (shared by all Streamlit sessions and processes)
+TRANSCRIPT_CACHE_PATH = os.getenv("TRANSCRIPT_CACHE_PATH", os.path.join(".cache", "transcripts.sqlite3"))
+TRANSCRIPT_CACHE_TTL = int(os.getenv("TRANSCRIPT_CACHE_TTL", str(30 * 24 * 3600)))  # seconds
+TRANSCRIPT_CACHE_MAX_BYTES = int(os.getenv("TRANSCRIPT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+TRANSCRIPT_LANGUAGE = os.getenv("TRANSCRIPT_LANGUAGE", "en")
+
+# Per-chunk summary cache settings
+SUMMARY_CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH", os.path.join(".cache", "summaries.sqlite3"))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "50000"))
+
+# Transcript preprocessing before chunking: strip non-speech tags and rolling-caption repeats, optionally fillers
+TRANSCRIPT_PREPROCESS = os.getenv("TRANSCRIPT_PREPROCESS", "1").lower() in ("1", "true", "yes")
+TRANSCRIPT_DROP_FILLERS = os.getenv("TRANSCRIPT_DROP_FILLERS", "0").lower() in ("1", "true", "yes")
+
+# Near-duplicate chunks (estimated Jaccard similarity of word 5-grams at or above the threshold, 0 to disable)
+# reuse a summary from the index of summarized chunks, or are skipped when they repeat part of the same video
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+NEAR_DUPLICATE_INDEX_PATH = os.getenv("NEAR_DUPLICATE_INDEX_PATH", os.path.join(".cache", "chunk_index.sqlite3"))
+
+# Chunk summarization settings
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))  # max Gemini calls in flight per video
+# Extra attempts after an empty or blocked chunk response; request failures are retried by the model client
+SUMMARY_CHUNK_RETRIES = int(os.getenv("SUMMARY_CHUNK_RETRIES", "1"))
+
+# Transcript chunking settings (estimated tokens)
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "2000"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "0"))
+
+# Hierarchical reduce settings: chunk summaries are merged in groups until the summary fits the target
+SUMMARY_TARGET_TOKENS = int(os.getenv("SUMMARY_TARGET_TOKENS", "3000"))
+REDUCE_GROUP_SIZE = max(2, int(os.getenv("REDUCE_GROUP_SIZE", "5")))
+REDUCE_MAX_LEVELS = int(os.getenv("REDUCE_MAX_LEVELS", "4"))
+
+# Transcripts of at most this many estimated tokens are summarized in a single call (0 to always chunk)
+SINGLE_SHOT_MAX_TOKENS = int(os.getenv("SINGLE_SHOT_MAX_TOKENS", "30000"))
+
+# Transcript context reuse: the cleaned transcript of each summarized video with at least CONTEXT_CACHE_MIN_TOKENS
+# is uploaded as Gemini cached content for CONTEXT_CACHE_TTL seconds and the quiz calls reference it (0 disables
+# caching); shorter transcripts are not sent to the quiz calls, which would pay for them in full every time
+CONTEXT_REUSE = os.getenv("CONTEXT_REUSE", "1").lower() in ("1", "true", "yes")
+CONTEXT_STORE_PATH = os.getenv("CONTEXT_STORE_PATH", os.path.join(".cache", "contexts.sqlite3"))
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "32768"))  # the API minimum for Gemini 1.5
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", "3600"))  # seconds
+
+# Gemini API key, required by the "gemini", "record" and "auto" backends
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+
+# Model backend settings: "gemini" (live API), "fake" (offline), or "replay"/"record"/"auto" (fixture store)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+# Gemini API host (e.g. a proxy, or the offline stand-in of benchmarks/load_test.py); set, it is spoken to over REST
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT", "")
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gemini-1.5-flash-001")
+QUIZ_MODEL = os.getenv("QUIZ_MODEL", "gemini-1.5-flash-001")
+LLM_FIXTURES_DIR = os.getenv("LLM_FIXTURES_DIR", os.path.join(".cache", "llm_fixtures"))
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0"))  # seconds per call
+FAKE_LLM_FAILURE_RATE = float(os.getenv("FAKE_LLM_FAILURE_RATE", "0"))
+FAKE_LLM_BLOCK_RATE = float(os.getenv("FAKE_LLM_BLOCK_RATE", "0"))
+
+# Quiz generation settings
+QUIZ_SHARDS = int(os.getenv("QUIZ_SHARDS", "1"))  # summary sections whose questions are generated in parallel
+QUIZ_TOP_UP_ATTEMPTS = int(os.getenv("QUIZ_TOP_UP_ATTEMPTS", "2"))  # requests for missing questions after a short quiz
+# "json" requests structured output against a fixed schema (falls back to "text" if the model rejects it)
+QUIZ_OUTPUT_MODE = os.getenv("QUIZ_OUTPUT_MODE", "json").lower()
+
+# Question bank: verified questions kept per video and summary; quizzes are sampled from it, excluding the
+# questions a user has seen, and it is filled in the background up to QUESTION_BANK_TARGET (0 disables it)
+QUESTION_BANK_PATH = os.getenv("QUESTION_BANK_PATH", os.path.join(".cache", "question_bank.sqlite3"))
+QUESTION_BANK_TARGET = int(os.getenv("QUESTION_BANK_TARGET", "40"))
+QUESTION_BANK_BATCH = int(os.getenv("QUESTION_BANK_BATCH", "10"))  # questions requested per fill round
+
+# Show per-rerun timings (imports, client setup, page render) in the app sidebar
+SHOW_TIMINGS = os.getenv("SHOW_TIMINGS", "0").lower() in ("1", "true", "yes")
+
+# Math verification: sympy runs in worker processes, each question gets at most MATH_VERIFY_TIMEOUT seconds
+MATH_VERIFY_WORKERS = int(os.getenv("MATH_VERIFY_WORKERS", "2"))
+MATH_VERIFY_TIMEOUT = float(os.getenv("MATH_VERIFY_TIMEOUT", "5"))
+MATH_WORKER_MEMORY_MB = int(os.getenv("MATH_WORKER_MEMORY_MB", "1024"))
+
+# Rendered downloads (results PDF/CSV/JSON, summary text) kept in memory, by hash of their content
+EXPORT_CACHE_MAX_ENTRIES = int(os.getenv("EXPORT_CACHE_MAX_ENTRIES", "64"))
+
+# Instrumentation: one JSON log line per pipeline stage, and Prometheus metrics on METRICS_PORT (off when unset)
+METRICS_JSON_LOGS = os.getenv("METRICS_JSON_LOGS", "1").lower() in ("1", "true", "yes")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Model client resilience, shared by all sessions of a process: rate limits per model (0 = unlimited),
+# retries with jittered exponential backoff, and a circuit breaker that pauses calls while the API is failing
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))  # seconds
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "60"))  # seconds
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))  # consecutive failures, 0 to disable
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))  # seconds before a trial call
+
+# Identical summary requests are coalesced within a process; set a lock directory to also serialize them
+# across processes (the later process then finds the summaries in the shared caches)
+SINGLE_FLIGHT_LOCK_DIR = os.getenv("SINGLE_FLIGHT_LOCK_DIR", "")
+SINGLE_FLIGHT_LOCK_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_LOCK_TIMEOUT", "600"))  # seconds
+
+# Background summary jobs: a durable SQLite job store and a pool of worker threads per process. Running jobs
+# send a heartbeat; a job whose heartbeat stops (e.g. the server restarted) is queued again and resumed
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", os.path.join(".cache", "jobs.sqlite3"))
+SUMMARY_JOB_WORKERS = int(os.getenv("SUMMARY_JOB_WORKERS", "2"))
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "5"))  # seconds
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "30"))  # seconds without a heartbeat
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", str(7 * 24 * 3600)))  # seconds finished jobs are kept
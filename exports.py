@@ -0,0 +1,142 @@
+"""Render quiz results and summaries into downloadable files, in memory.
+
+Every export is rendered from a plain payload (the graded results dict, or the
+summary text) straight into bytes, so concurrent users never share a file on
+disk. Rendered files are cached by format and a hash of the payload, so reruns
+of the results page reuse them instead of rendering again.
+"""
+import csv
+import hashlib
+import io
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import config
+from instrumentation import count_cache, span
+
+# Text-based stand-ins for the markers shown on the results page; the core PDF fonts are latin-1 only
+PDF_MARKERS = {"✅": "[~]", "❌": ""}
+
+
+def payload_digest(payload):
+    """Stable hash of an export payload (JSON-serializable results or text)."""
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _pdf_text(text):
+    for marker, replacement in PDF_MARKERS.items():
+        text = text.replace(marker, replacement)
+    return text.encode("latin-1", "replace").decode("latin-1")
+
+
+def render_results_pdf(results):
+    """Render the graded results as a PDF document."""
+    # Imported here: fpdf is only needed when a PDF is actually requested
+    from fpdf import FPDF
+
+    # Initialize PDF
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+
+    # Title
+    pdf.set_font("Arial", 'B', 16)
+    pdf.cell(200, 10, txt="Quiz Results", ln=True, align='C')
+
+    # Score summary
+    pdf.ln(10)
+    pdf.set_font("Arial", 'B', 12)
+    pdf.cell(200, 10, txt=f"Total Correct: {results['correct_count']} out of {results['total_questions']}", ln=True)
+    pdf.cell(200, 10, txt=f"Score: {results['score']:.2f}%", ln=True)
+
+    # Feedback for each question
+    pdf.ln(10)
+    pdf.set_font("Arial", size=12)
+    for fb in results["feedback"]:
+        user_answer = fb['user_answer'] if fb['user_answer'] else 'No answer'
+        pdf.multi_cell(0, 10, _pdf_text(f"{fb['question']}\nYour answer: {user_answer}\nResult: {fb['result']}"))
+        options_text = "\n".join(fb['options'])
+        pdf.multi_cell(0, 10, _pdf_text(f"Options:\n{options_text}"))
+        pdf.multi_cell(0, 10, _pdf_text(f"Feedback: {fb['feedback']}\n"))
+        pdf.ln(5)  # Add some space between questions
+
+    # fpdf 1.x returns a latin-1 str for dest="S", fpdf2 returns a bytearray
+    data = pdf.output(dest="S")
+    return data.encode("latin-1") if isinstance(data, str) else bytes(data)
+
+
+def render_results_csv(results):
+    """One row per question: text, the user's answer, the correct answer, outcome and feedback."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["question", "your_answer", "correct_answer", "correct", "feedback"])
+    for fb in results["feedback"]:
+        writer.writerow([fb["question"], fb["user_answer"] or "", fb["correct_answer"] or "", fb["is_correct"],
+                         fb["feedback"]])
+    # BOM so spreadsheet apps detect UTF-8
+    return buffer.getvalue().encode("utf-8-sig")
+
+
+def render_results_json(results):
+    return json.dumps(results, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def render_text(text):
+    return text.encode("utf-8")
+
+
+@dataclass(frozen=True)
+class ExportFormat:
+    """How to render one kind of download, and what to serve it as."""
+    mime: str
+    extension: str
+    render: callable
+
+
+EXPORT_FORMATS = {
+    "pdf": ExportFormat("application/pdf", "pdf", render_results_pdf),
+    "csv": ExportFormat("text/csv", "csv", render_results_csv),
+    "json": ExportFormat("application/json", "json", render_results_json),
+    "txt": ExportFormat("text/plain", "txt", render_text),
+}
+
+
+class ExportCache:
+    """Rendered exports keyed by (format, payload hash), least recently used evicted first."""
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or config.EXPORT_CACHE_MAX_ENTRIES
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, fmt, payload):
+        """Return the bytes of `payload` rendered as `fmt`, rendering it only on the first request."""
+        key = (fmt, payload_digest(payload))
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+        count_cache("export", data is not None)
+        if data is not None:
+            return data
+
+        # Rendered outside the lock; two sessions racing on the same payload just render it twice
+        with span("export_render", format=fmt) as current:
+            data = EXPORT_FORMATS[fmt].render(payload)
+            current.set(bytes=len(data))
+        with self._lock:
+            self._entries[key] = data
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return data
+
+
+_export_cache = ExportCache()
+
+
+def export(fmt, payload):
+    """Render `payload` in the given format ("pdf", "csv", "json" or "txt") using the shared cache."""
+    return _export_cache.get(fmt, payload)
@@ -0,0 +1,287 @@
+"""Lightweight pipeline instrumentation: timed spans, counters and histograms.
+
+Every stage of a request (transcript fetch, chunking, each model call, quiz
+parsing, math verification, export rendering) runs inside a `span`. A span
+observes its duration in a latency histogram and, when METRICS_JSON_LOGS is
+on, writes one JSON line to the "pipeline.metrics" logger with the stage, its
+duration, outcome and any fields (chunk index, token counts...). Fields set on
+a span are inherited by the spans opened inside it on the same thread, so a
+model call made for chunk 3 is logged with `"chunk": 3`.
+
+Metrics are kept in process and rendered in the Prometheus text format by
+`render_metrics`; set METRICS_PORT to serve them on `/metrics`. Recording a
+span costs a couple of dict updates under a lock, cheap enough to stay on.
+"""
+import bisect
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+logger = logging.getLogger("pipeline.metrics")
+
+# Seconds; model calls dominate, so the buckets reach well past a minute
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_current_fields = contextvars.ContextVar("span_fields", default={})
+
+
+class Counter:
+    """Monotonic count per label set."""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+
+    def inc(self, labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(labels)} {value}" for labels, value in sorted(self.values.items())]
+        return lines
+
+
+class Histogram:
+    """Observation counts per bucket, plus sum and count, per label set."""
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, labels, value):
+        counts, total = self.values.get(labels, (None, 0.0))
+        if counts is None:
+            counts = [0] * (len(self.buckets) + 1)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.values[labels] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(labels)} {cumulative}")
+        return lines
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+class MetricsRegistry:
+    """The process-wide metrics behind `span` and the `count_*` functions."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stage_seconds = Histogram("pipeline_stage_seconds", "Duration of each pipeline stage.")
+        self.stage_errors = Counter("pipeline_stage_errors_total", "Pipeline stages that raised an error.")
+        self.llm_calls = Counter("llm_calls_total", "Model calls by model, purpose and outcome (ok, error, blocked).")
+        self.llm_tokens = Counter("llm_tokens_total", "Tokens sent to (in, of which cached: served from cached "
+                                                      "content) and generated by (out) the model.")
+        self.cache_requests = Counter("cache_requests_total", "Cache lookups by cache and result (hit, miss).")
+        self.llm_retries = Counter("llm_retries_total", "Model calls retried, by model and failure (HTTP status).")
+        self.llm_calls_avoided = Counter("llm_calls_avoided_total",
+                                         "Chunk summaries not requested because the chunk was a near duplicate.")
+        self.quiz_responses = Counter("quiz_responses_total",
+                                      "Quiz responses by output mode and parse result (ok, short, failed).")
+        self.quiz_regenerations = Counter("quiz_regenerations_total",
+                                          "Extra quiz requests made because too few questions parsed, by output mode.")
+        self._metrics = (self.stage_seconds, self.stage_errors, self.llm_calls, self.llm_tokens, self.cache_requests,
+                         self.llm_retries, self.llm_calls_avoided, self.quiz_responses, self.quiz_regenerations)
+
+    def observe(self, stage, seconds, error=False):
+        labels = (("stage", stage),)
+        with self._lock:
+            self.stage_seconds.observe(labels, seconds)
+            if error:
+                self.stage_errors.inc(labels)
+
+    def count_llm_call(self, model, purpose, outcome, tokens_in=0, tokens_out=0, tokens_cached=0):
+        with self._lock:
+            self.llm_calls.inc((("model", model), ("outcome", outcome), ("purpose", purpose)))
+            if tokens_in:
+                self.llm_tokens.inc((("direction", "in"), ("model", model)), tokens_in)
+            if tokens_out:
+                self.llm_tokens.inc((("direction", "out"), ("model", model)), tokens_out)
+            if tokens_cached:
+                self.llm_tokens.inc((("direction", "cached"), ("model", model)), tokens_cached)
+
+    def count_retry(self, model, reason):
+        with self._lock:
+            self.llm_retries.inc((("model", model), ("reason", reason)))
+
+    def count_avoided(self, reason, amount):
+        with self._lock:
+            self.llm_calls_avoided.inc((("reason", reason),), amount)
+
+    def count_quiz_response(self, mode, result):
+        with self._lock:
+            self.quiz_responses.inc((("mode", mode), ("result", result)))
+
+    def count_regeneration(self, mode):
+        with self._lock:
+            self.quiz_regenerations.inc((("mode", mode),))
+
+    def count_cache(self, cache, hit):
+        with self._lock:
+            self.cache_requests.inc((("cache", cache), ("result", "hit" if hit else "miss")))
+
+    def render(self):
+        with self._lock:
+            lines = [line for metric in self._metrics for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+class Span:
+    """A running stage; `set` adds fields to its log line (and to the spans nested in it)."""
+
+    __slots__ = ("stage", "fields", "started")
+
+    def __init__(self, stage, fields):
+        self.stage = stage
+        self.fields = fields
+        self.started = time.perf_counter()
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+
+@contextmanager
+def span(stage, **fields):
+    """Time a pipeline stage, record it in the metrics and log it as one JSON line."""
+    current = Span(stage, {**_current_fields.get(), **fields})
+    token = _current_fields.set(current.fields)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current_fields.reset(token)
+        seconds = time.perf_counter() - current.started
+        metrics.observe(stage, seconds, error is not None)
+        if config.METRICS_JSON_LOGS and logger.isEnabledFor(logging.INFO):
+            record = {"stage": stage, "seconds": round(seconds, 4), "ok": error is None, **current.fields}
+            if error is not None:
+                record["error"] = f"{type(error).__name__}: {error}"
+            logger.info(json.dumps(record, default=str))
+
+
+def observe(stage, seconds, **fields):
+    """Record a stage timed by the caller, e.g. work spread over a stream."""
+    metrics.observe(stage, seconds)
+    if config.METRICS_JSON_LOGS and logger.isEnabledFor(logging.INFO):
+        record = {"stage": stage, "seconds": round(seconds, 4), "ok": True, **_current_fields.get(), **fields}
+        logger.info(json.dumps(record, default=str))
+
+
+def usage_tokens(response):
+    """Prompt and output token counts from a response's usage metadata, (0, 0) if it has none."""
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "prompt_token_count", 0) or 0, getattr(usage, "candidates_token_count", 0) or 0
+
+
+def count_llm_call(model, purpose, outcome, response=None):
+    """Count a model call and the tokens reported in `response`; returns (tokens_in, tokens_out)."""
+    tokens_in, tokens_out = usage_tokens(response)
+    usage = getattr(response, "usage_metadata", None)
+    tokens_cached = getattr(usage, "cached_content_token_count", 0) or 0
+    metrics.count_llm_call(model or "unknown", purpose or "other", outcome, tokens_in, tokens_out, tokens_cached)
+    return tokens_in, tokens_out
+
+
+def finish_llm_call(current, outcome, response=None):
+    """Count the model call timed by an "llm_call" span and add its outcome and tokens to the span."""
+    tokens_in, tokens_out = count_llm_call(current.fields.get("model"), current.fields.get("purpose"), outcome,
+                                           response)
+    current.set(outcome=outcome, tokens_in=tokens_in, tokens_out=tokens_out)
+
+
+def count_cache(cache, hit):
+    metrics.count_cache(cache, hit)
+
+
+def count_retry(model, reason):
+    metrics.count_retry(model or "unknown", reason)
+
+
+def count_avoided(reason, amount=1):
+    """Count model calls saved by near-duplicate detection ("repeat" within a video, "reuse" across videos)."""
+    if amount:
+        metrics.count_avoided(reason, amount)
+
+
+def count_quiz_response(mode, requested, parsed):
+    """Count a parsed quiz response: "ok" if every requested question parsed, "short" if some, "failed" if none."""
+    result = "ok" if parsed >= requested else "short" if parsed else "failed"
+    metrics.count_quiz_response(mode, result)
+    return result
+
+
+def count_regeneration(mode):
+    metrics.count_regeneration(mode)
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    return metrics.render()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would flood the application log
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=None):
+    """Serve `/metrics` on a background thread (once per process); no-op unless METRICS_PORT is set."""
+    global _server
+    port = port or config.METRICS_PORT
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer(("", port), _MetricsHandler)
+            except OSError as e:
+                # Another process (e.g. a second Streamlit worker) already serves this port; don't retry
+                logging.getLogger(__name__).warning("Could not serve metrics on port %s: %s", port, e)
+                _server = False
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server or None
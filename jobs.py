@@ -0,0 +1,311 @@
+"""Background summary jobs with a durable SQLite job store.
+
+The app submits a video and gets a job ID back right away; worker threads
+claim queued jobs, run the streaming summary and write progress (chunks
+done/total and the text so far) to the store, so any script run, session or
+process can poll a job by its ID. Running jobs send a heartbeat; when a
+worker's process dies the heartbeat stops and the job is queued again by the
+next runner that notices, which resumes it from the summary cache.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+
+import config
+from reporting import RecordingReporter
+from sqlite_store import SQLiteStore
+from youtube_summarizer import SummaryResult, YouTubeSummarizer
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("queued", "running")
+
+# Seconds between progress writes while a summary streams; each write stores the whole text so far
+PROGRESS_INTERVAL = 0.5
+
+
+@dataclass
+class Job:
+    """A summary job as stored: its status, progress and, once done, the SummaryResult fields."""
+    id: str
+    url: str
+    video_id: str
+    status: str
+    chunks_done: int = 0
+    chunks_total: int = 0
+    partial: str = ""
+    result: dict = None
+    messages: list = field(default_factory=list)
+    error: str = None
+    created_at: float = None
+    updated_at: float = None
+
+    @property
+    def active(self):
+        return self.status in ACTIVE_STATUSES
+
+
+class JobStore(SQLiteStore):
+    """Summary jobs by ID, shared by every session and process using the same file.
+
+    A job is `queued`, then `running` (claimed by one runner, which keeps its
+    heartbeat fresh), then `done` or `failed`. Finished jobs are deleted after
+    `retention` seconds.
+    """
+
+    schema = (
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            key TEXT NOT NULL,
+            url TEXT NOT NULL,
+            video_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            chunks_done INTEGER NOT NULL DEFAULT 0,
+            chunks_total INTEGER NOT NULL DEFAULT 0,
+            partial TEXT NOT NULL DEFAULT '',
+            result TEXT,
+            messages TEXT NOT NULL DEFAULT '[]',
+            error TEXT,
+            owner TEXT,
+            heartbeat REAL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_key ON jobs (key, status)",
+    )
+
+    def __init__(self, path=None, retention=None):
+        self.retention = config.JOB_RETENTION if retention is None else retention
+        super().__init__(path or config.JOB_STORE_PATH)
+
+    def submit(self, key, url, video_id):
+        """Queue a job and return its ID; a queued or running job with the same key is returned instead."""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE key = ? AND status IN (?, ?) ORDER BY created_at LIMIT 1",
+                (key, *ACTIVE_STATUSES),
+            ).fetchone()
+            if row is not None:
+                return row[0]
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, key, url, video_id, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, key, url, video_id, "queued", now, now),
+            )
+        return job_id
+
+    def get(self, job_id):
+        """Return the Job with this ID, or None if it does not exist (or was purged)."""
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, url, video_id, status, chunks_done, chunks_total, partial, result, messages, error, "
+                "created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        (job_id, url, video_id, status, chunks_done, chunks_total, partial, result, messages, error, created_at,
+         updated_at) = row
+        return Job(job_id, url, video_id, status, chunks_done, chunks_total, partial,
+                   json.loads(result) if result else None, json.loads(messages), error, created_at, updated_at)
+
+    def claim(self, owner):
+        """Mark the oldest queued job as running for `owner` and return it, or None if nothing is queued."""
+        while True:
+            with self._lock, self._connect() as conn:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                now = time.time()
+                # Another process may claim the same job between the SELECT and the UPDATE; only one wins
+                claimed = conn.execute(
+                    "UPDATE jobs SET status = 'running', owner = ?, heartbeat = ?, updated_at = ? "
+                    "WHERE id = ? AND status = 'queued'",
+                    (owner, now, now, row[0]),
+                ).rowcount
+            if claimed:
+                return self.get(row[0])
+
+    def progress(self, job_id, chunks_done, chunks_total, partial):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET chunks_done = ?, chunks_total = ?, partial = ?, heartbeat = ?, updated_at = ? "
+                "WHERE id = ?",
+                (chunks_done, chunks_total, partial, now, now, job_id),
+            )
+
+    def heartbeat(self, job_ids, owner):
+        """Tell other runners that these jobs are still being worked on."""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                [(now, job_id, owner) for job_id in job_ids],
+            )
+
+    def finish(self, job_id, status, result=None, messages=(), error=None, partial=None):
+        """Record the outcome of a job: `done` with its result, or `failed` with an error message."""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, messages = ?, error = ?, partial = COALESCE(?, partial), "
+                "owner = NULL, updated_at = ? WHERE id = ?",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 json.dumps(list(messages), ensure_ascii=False), error, partial, now, job_id),
+            )
+
+    def requeue_stale(self, stale_after=None):
+        """Queue running jobs whose heartbeat is older than `stale_after` seconds again; return how many."""
+        stale_after = config.JOB_STALE_AFTER if stale_after is None else stale_after
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL, updated_at = ? "
+                "WHERE status = 'running' AND heartbeat < ?",
+                (now, now - stale_after),
+            ).rowcount
+
+    def purge(self):
+        """Delete finished jobs older than the retention period."""
+        if not self.retention:
+            return
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (time.time() - self.retention,),
+            )
+
+
+def _result_fields(result):
+    return {
+        "summary": result.summary,
+        "levels": result.levels,
+        "failed_chunks": result.failed_chunks,
+        "time_to_first_token": result.time_to_first_token,
+        "total_time": result.total_time,
+        "transcript_tokens": result.transcript_tokens,
+        "cleaned_tokens": result.cleaned_tokens,
+        "calls_avoided": result.calls_avoided,
+        "single_shot": result.single_shot,
+    }
+
+
+class JobRunner:
+    """A pool of worker threads running the summary jobs of a JobStore.
+
+    Runners in several processes can share one store: each job is claimed by
+    exactly one of them. On start, and then every JOB_HEARTBEAT_INTERVAL
+    seconds, a runner also requeues jobs whose runner has stopped sending
+    heartbeats, which is how unfinished jobs survive a server restart.
+    """
+
+    def __init__(self, summarizer, store=None, workers=None, poll_interval=1.0):
+        self.summarizer = summarizer
+        self.store = store or JobStore()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.poll_interval = poll_interval
+        self._running = set()
+        self._running_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+        resumed = self.store.requeue_stale()
+        if resumed:
+            logger.info("Resuming %d unfinished summary job(s)", resumed)
+        self.store.purge()
+
+        workers = max(1, config.SUMMARY_JOB_WORKERS if workers is None else workers)
+        self._threads = [threading.Thread(target=self._work, name=f"summary-job-{i}", daemon=True)
+                         for i in range(workers)]
+        self._threads.append(threading.Thread(target=self._heartbeat, name="summary-job-heartbeat", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, url):
+        """Queue a summary of the video at `url` and return the job ID (an existing job if one is underway)."""
+        video_id = self.summarizer.get_video_id(url)
+        job_id = self.store.submit(repr(self.summarizer.flight_key(video_id)), url, video_id)
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def stop(self):
+        """Stop claiming new jobs; jobs already running finish on their daemon threads."""
+        self._stopped.set()
+        self._wake.set()
+
+    def _work(self):
+        while not self._stopped.is_set():
+            try:
+                job = self.store.claim(self.owner)
+            except Exception:
+                logger.exception("Could not claim a summary job")
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+
+            with self._running_lock:
+                self._running.add(job.id)
+            try:
+                self._run(job)
+            finally:
+                with self._running_lock:
+                    self._running.discard(job.id)
+
+    def _heartbeat(self):
+        while not self._stopped.wait(config.JOB_HEARTBEAT_INTERVAL):
+            try:
+                with self._running_lock:
+                    running = list(self._running)
+                if running:
+                    self.store.heartbeat(running, self.owner)
+                if self.store.requeue_stale():
+                    self._wake.set()
+            except Exception:
+                logger.exception("Could not update the summary job heartbeats")
+
+    def _run(self, job):
+        # A summarizer per job so its warnings are kept with the job; model, caches and flights are shared
+        reporter = RecordingReporter()
+        summarizer = YouTubeSummarizer(
+            transcript_cache=self.summarizer.transcript_cache, summary_cache=self.summarizer.summary_cache,
+            max_concurrency=self.summarizer.max_concurrency, reporter=reporter, model=self.summarizer.model,
+            flights=self.summarizer.flights, chunk_index=self.summarizer.chunk_index,
+            contexts=self.summarizer.contexts,
+        )
+        result = SummaryResult()
+        parts = []
+        last_write = 0.0
+        try:
+            for text in summarizer.stream_summary(job.url, result):
+                parts.append(text)
+                if time.monotonic() - last_write >= PROGRESS_INTERVAL:
+                    self.store.progress(job.id, result.chunks_done, result.chunks_total, "".join(parts))
+                    last_write = time.monotonic()
+        except Exception as e:
+            logger.exception("Summary job %s failed", job.id)
+            self.store.finish(job.id, "failed", messages=reporter.messages, error=str(e), partial="".join(parts))
+            return
+
+        if result.summary:
+            self.store.progress(job.id, result.chunks_done, result.chunks_total, "".join(parts))
+            self.store.finish(job.id, "done", _result_fields(result), reporter.messages)
+        else:
+            self.store.finish(job.id, "failed", messages=reporter.messages,
+                              error="No summary could be generated for this video.")
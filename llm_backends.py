@@ -0,0 +1,306 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import config
+from chunker import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Models bound to cached contents kept per GeminiBackend
+CACHED_MODELS_MAX = 64
+
+
+class LLMResponse:
+    """Minimal stand-in for a Gemini response: `text`, `usage_metadata` and `candidates`."""
+
+    def __init__(self, text, prompt_tokens=0, output_tokens=0, safety_ratings=None, cached_tokens=0):
+        self.text = text
+        # As in Gemini, `prompt_token_count` includes the tokens served from cached content
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=output_tokens,
+            cached_content_token_count=cached_tokens,
+            total_token_count=prompt_tokens + output_tokens,
+        )
+        self.candidates = [SimpleNamespace(safety_ratings=safety_ratings or [])]
+
+
+class LLMBackend(ABC):
+    """Interface shared by all model backends.
+
+    `generate_content(prompt, stream=False, **kwargs)` mirrors
+    `genai.GenerativeModel.generate_content`: it returns a response with a
+    `text` attribute, or an iterator of partial responses when streaming.
+    Backends with context caching accept `cached_content=<name>` as well.
+    """
+
+    model_name = None
+
+    @abstractmethod
+    def generate_content(self, prompt, stream=False, **kwargs):
+        """Return the model's response to `prompt`, or an iterator of partial responses if `stream`."""
+
+    def cache_context(self, text, ttl):
+        """Store `text` as cached content for `ttl` seconds and return its name, or None if not supported."""
+        return None
+
+
+_gemini_lock = threading.Lock()
+_gemini_configured = False
+
+
+def configure_gemini():
+    """Import and configure the Gemini SDK once per process, on first use."""
+    global _gemini_configured
+    import google.generativeai as genai
+
+    with _gemini_lock:
+        if not _gemini_configured:
+            # Check if the API key exists and configure the Gemini API
+            if config.GEMINI_API_KEY:
+                options = {}
+                if config.GEMINI_API_ENDPOINT:
+                    options = {"transport": "rest", "client_options": {"api_endpoint": config.GEMINI_API_ENDPOINT}}
+                genai.configure(api_key=config.GEMINI_API_KEY, **options)
+            else:
+                logger.error("Gemini API key is missing. Please set the GEMINI_API_KEY in your environment variables.")
+            _gemini_configured = True
+    return genai
+
+
+class GeminiBackend(LLMBackend):
+    """The live Gemini API."""
+
+    def __init__(self, model_name):
+        genai = configure_gemini()
+        self.model_name = model_name
+        self._model = genai.GenerativeModel(model_name)
+        # Models bound to cached contents, by name; building one fetches the cached content
+        self._cached_models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, stream=False, cached_content=None, **kwargs):
+        model = self._model if cached_content is None else self._cached_model(cached_content)
+        return model.generate_content(prompt, stream=stream, **kwargs)
+
+    def cache_context(self, text, ttl):
+        genai = configure_gemini()
+        cached = genai.caching.CachedContent.create(model=self.model_name, contents=[text],
+                                                    ttl=datetime.timedelta(seconds=ttl))
+        return cached.name
+
+    def _cached_model(self, name):
+        with self._lock:
+            model = self._cached_models.get(name)
+            if model is not None:
+                self._cached_models.move_to_end(name)
+                return model
+        model = configure_gemini().GenerativeModel.from_cached_content(name)
+        with self._lock:
+            self._cached_models[name] = model
+            while len(self._cached_models) > CACHED_MODELS_MAX:
+                self._cached_models.popitem(last=False)
+        return model
+
+
+def _split_stream(text, pieces=8):
+    """Cut a response into a few pieces to replay it as a stream."""
+    step = max(1, len(text) // pieces)
+    return [text[i:i + step] for i in range(0, len(text), step)] or [""]
+
+
+class FixtureNotFoundError(KeyError):
+    """Raised in replay mode when no recorded response exists for a prompt."""
+
+
+class RecordReplayBackend(LLMBackend):
+    """Serve responses from a fixture directory, recording missing ones from `inner` when allowed.
+
+    Modes: "replay" only serves fixtures, "record" always calls `inner` and
+    stores the result, "auto" replays when possible and records otherwise.
+    Fixtures are JSON files named by a hash of model name, prompt and options.
+    """
+
+    def __init__(self, model_name, fixtures_dir, mode="replay", inner=None):
+        if mode != "replay" and inner is None:
+            raise ValueError(f"Mode {mode!r} needs an inner backend to record from")
+        self.model_name = model_name
+        self.fixtures_dir = fixtures_dir
+        self.mode = mode
+        self.inner = inner
+        os.makedirs(fixtures_dir, exist_ok=True)
+
+    def fixture_path(self, prompt, kwargs):
+        options = json.dumps(kwargs, sort_keys=True, default=str)
+        digest = hashlib.sha256(f"{self.model_name}\0{options}\0{prompt}".encode("utf-8")).hexdigest()
+        return os.path.join(self.fixtures_dir, f"{digest}.json")
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        path = self.fixture_path(prompt, kwargs)
+        if self.mode != "record" and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                fixture = json.load(f)
+        elif self.mode == "replay":
+            raise FixtureNotFoundError(f"No recorded response for this prompt ({os.path.basename(path)})")
+        else:
+            fixture = self._record(path, prompt, kwargs)
+
+        response = LLMResponse(fixture["text"], fixture.get("prompt_tokens", 0), fixture.get("output_tokens", 0))
+        if stream:
+            return iter([LLMResponse(piece) for piece in _split_stream(response.text)])
+        return response
+
+    def _record(self, path, prompt, kwargs):
+        response = self.inner.generate_content(prompt, **kwargs)
+        usage = getattr(response, "usage_metadata", None)
+        fixture = {
+            "model": self.model_name,
+            "prompt": prompt,
+            "text": response.text,
+            "prompt_tokens": getattr(usage, "prompt_token_count", 0),
+            "output_tokens": getattr(usage, "candidates_token_count", 0),
+        }
+        # Write to a temporary file first so a concurrent reader never sees half a fixture
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(fixture, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        return fixture
+
+
+class FakeBackendError(RuntimeError):
+    """Simulated transport failure raised by FakeBackend, with an HTTP status as `code` if it has one."""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+def fake_response(prompt, generation_config=None, **kwargs):
+    """Plausible offline output: a formatted quiz for quiz prompts, a short summary otherwise.
+
+    Quizzes come as a JSON array when structured output is requested in `generation_config`.
+    """
+    match = re.search(r'generate (\d+) multiple-choice questions', prompt)
+    if match:
+        # Questions the prompt lists as already asked are numbered first, so new topics are generated
+        _, _, existing = prompt.partition("already has the following questions")
+        offset = len(re.findall(r'^\s+- ', existing, re.MULTILINE))
+        numbers = range(offset + 1, offset + int(match.group(1)) + 1)
+        if (generation_config or {}).get("response_mime_type") == "application/json":
+            return json.dumps([
+                {"question": f"Which statement about topic {i} is correct?",
+                 "options": [f"Statement {i}{letter}" for letter in "abcd"], "correct_index": 0,
+                 "explanation": f"Statement {i}a is what the video explains."}
+                for i in numbers
+            ])
+        return "\n".join(
+            f"Question {i}: Which statement about topic {i} is correct?\n"
+            f"Options:\n(A) Statement {i}a\n(B) Statement {i}b\n(C) Statement {i}c\n(D) Statement {i}d\n"
+            f"Correct Answer: (A) Statement {i}a\n"
+            f"Explanation: Statement {i}a is what the video explains.\n"
+            for i in numbers
+        )
+    # The text to summarize ends the prompt, or starts it when the transcript is the shared context
+    text, _, _ = prompt.partition("Based on the content in the transcript above")
+    return "Summary: " + " ".join(text.split()[-60:])
+
+
+class FakeBackend(LLMBackend):
+    """Configurable offline model with injectable latency, failures and safety blocks.
+
+    `latency` is seconds per call, either a number or a (min, max) range.
+    `failure_rate` and `block_rate` are probabilities of raising a
+    FakeBackendError or returning an empty (blocked) response. `responder`
+    maps a prompt (and the generate_content options) to the response text.
+    Cached contents are kept in memory and put in front of the prompts that
+    reference them.
+    """
+
+    def __init__(self, model_name="fake", latency=0.0, failure_rate=0.0, block_rate=0.0, responder=fake_response,
+                 seed=None):
+        self.model_name = f"fake:{model_name}"
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.block_rate = block_rate
+        self.responder = responder
+        self.calls = 0
+        self._contexts = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _sleep(self):
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            with self._lock:
+                latency = self._random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+    def cache_context(self, text, ttl):
+        with self._lock:
+            name = f"cachedContents/fake-{uuid.uuid4().hex[:12]}"
+            self._contexts[name] = text
+        return name
+
+    def generate_content(self, prompt, stream=False, cached_content=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+            roll = self._random.random()
+            context = self._contexts.get(cached_content) if cached_content is not None else ""
+        self._sleep()
+
+        if context is None:
+            raise FakeBackendError(f"Cached content {cached_content} not found", code=404)
+        if context:
+            prompt = f"{context}\n\n{prompt}"
+        cached_tokens = estimate_tokens(context) if context else 0
+        if roll < self.failure_rate:
+            raise FakeBackendError("Simulated model failure")
+        if roll < self.failure_rate + self.block_rate:
+            response = LLMResponse("", estimate_tokens(prompt), 0, safety_ratings=["HARM_CATEGORY_FAKE: HIGH"],
+                                   cached_tokens=cached_tokens)
+        else:
+            text = self.responder(prompt, **kwargs)
+            response = LLMResponse(text, estimate_tokens(prompt), estimate_tokens(text), cached_tokens=cached_tokens)
+
+        if stream:
+            return iter([LLMResponse(piece) for piece in _split_stream(response.text)] if response.text else [response])
+        return response
+
+
+def create_backend(model_name, backend=None):
+    """Build the backend configured by LLM_BACKEND (gemini, fake, replay, record or auto) for a model.
+
+    Backends that make calls are wrapped in llm_client.ResilientBackend (shared
+    rate limits, retries, circuit breaker); pure replay is served as is.
+    """
+    # Imported here: llm_client builds on the classes of this module
+    from llm_client import ResilientBackend
+
+    backend = backend or config.LLM_BACKEND
+    if backend == "gemini":
+        return ResilientBackend(GeminiBackend(model_name))
+    if backend == "fake":
+        return ResilientBackend(FakeBackend(
+            model_name,
+            latency=config.FAKE_LLM_LATENCY,
+            failure_rate=config.FAKE_LLM_FAILURE_RATE,
+            block_rate=config.FAKE_LLM_BLOCK_RATE,
+        ))
+    if backend in ("replay", "record", "auto"):
+        # Recording goes through the resilient client; replaying never touches the API
+        inner = ResilientBackend(GeminiBackend(model_name)) if backend != "replay" else None
+        return RecordReplayBackend(model_name, config.LLM_FIXTURES_DIR, mode=backend, inner=inner)
+    raise ValueError(f"Unknown LLM backend {backend!r}")
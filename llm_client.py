@@ -0,0 +1,355 @@
+"""Resilience layer shared by every model backend: rate limiting, retries and a circuit breaker.
+
+`ResilientBackend` wraps any backend with the same `generate_content` call
+shape. All wrappers for one model share a process-wide token-bucket limiter
+(requests and tokens per minute) and circuit breaker, so concurrent sessions
+stay under the quota together instead of each retrying on its own.
+
+Failures come out typed: SafetyBlockedError when the model refused to answer
+(never retried), TransportError for request failures (429s, 5xx and network
+errors are retried with jittered exponential backoff that honors the
+server's retry delay), and CircuitOpenError when the API has been failing and
+calls are rejected without being sent.
+"""
+import itertools
+import random
+import re
+import threading
+import time
+
+import config
+from chunker import estimate_tokens
+from instrumentation import count_retry, observe
+from llm_backends import LLMBackend
+
+# HTTP statuses worth retrying: rate limited, server errors and timeouts
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# Exceptions raised by the Gemini SDK when the prompt or the answer was blocked
+SAFETY_EXCEPTION_NAMES = {"BlockedPromptException", "StopCandidateException"}
+RETRY_DELAY_REGEX = re.compile(r'retry[_ ]delay\s*\{?\s*seconds:\s*(\d+)', re.IGNORECASE)
+
+
+class LLMError(Exception):
+    """Base class of the errors raised by ResilientBackend."""
+
+
+class SafetyBlockedError(LLMError):
+    """The model returned no text because the prompt or the answer was blocked."""
+
+    def __init__(self, message, safety_ratings=None):
+        super().__init__(message)
+        self.safety_ratings = safety_ratings
+
+
+class TransportError(LLMError):
+    """The request failed; `retryable` tells whether trying again can help."""
+
+    def __init__(self, message, retryable=True, retry_after=None, status=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.status = status
+
+
+class CircuitOpenError(LLMError):
+    """Rejected without calling the API, which has been failing; `retry_after` is when it will be tried again."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Refills `per_minute` units evenly over a minute, holding at most a minute's worth.
+
+    `take` may drive the level below zero (a request larger than the bucket, or
+    a usage correction); later callers then wait until it has refilled.
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` can be taken (0 if it can be taken now)."""
+        self._refill(now)
+        needed = min(amount, self.per_minute) - self.level
+        return max(0.0, needed * 60.0 / self.per_minute)
+
+    def take(self, amount):
+        self.level -= amount
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets; a limit of 0 disables that bucket."""
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens):
+        """Block until one request of about `tokens` tokens fits in both buckets; return the seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = max(
+                    self.requests.wait_time(1, now) if self.requests else 0.0,
+                    self.tokens.wait_time(tokens, now) if self.tokens else 0.0,
+                )
+                if delay <= 0:
+                    if self.requests:
+                        self.requests.take(1)
+                    if self.tokens:
+                        self.tokens.take(tokens)
+                    return waited
+            time.sleep(delay)
+            waited += delay
+
+    def settle(self, reserved, used):
+        """Correct the token bucket once the real token count of a request is known."""
+        if self.tokens and used:
+            with self._lock:
+                self.tokens.take(used - reserved)
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive transport failures and rejects calls for `reset_timeout` seconds.
+
+    After that, one trial call is let through (half-open): success closes the
+    circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through now."""
+        if not self.failure_threshold:
+            return
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining <= 0 and not self._trial_running:
+                self._trial_running = True
+                return
+            raise CircuitOpenError(
+                f"The model API is failing; calls are paused for {max(remaining, 0):.0f}s", max(remaining, 0.0)
+            )
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or (self.failure_threshold and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+    def release_trial(self):
+        """Let another trial through if the trial call ended without telling anything about the API."""
+        with self._lock:
+            self._trial_running = False
+
+
+_shared_lock = threading.Lock()
+_shared_limiters = {}
+_shared_breakers = {}
+
+
+def get_rate_limiter(model_name):
+    """The process-wide rate limiter for a model (quotas are per model)."""
+    with _shared_lock:
+        if model_name not in _shared_limiters:
+            _shared_limiters[model_name] = RateLimiter(config.LLM_REQUESTS_PER_MINUTE, config.LLM_TOKENS_PER_MINUTE)
+        return _shared_limiters[model_name]
+
+
+def get_circuit_breaker(model_name):
+    """The process-wide circuit breaker for a model."""
+    with _shared_lock:
+        if model_name not in _shared_breakers:
+            _shared_breakers[model_name] = CircuitBreaker(config.LLM_BREAKER_THRESHOLD, config.LLM_BREAKER_RESET)
+        return _shared_breakers[model_name]
+
+
+def _retry_after(error):
+    """Server-suggested delay in seconds, from a Retry-After header or a RetryInfo detail, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    for detail in getattr(error, "details", None) or ():
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    match = RETRY_DELAY_REGEX.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+def classify_error(error):
+    """Turn an exception from a backend into a SafetyBlockedError or TransportError, or None to re-raise it as is."""
+    if isinstance(error, LLMError):
+        return error
+    if type(error).__name__ in SAFETY_EXCEPTION_NAMES:
+        return SafetyBlockedError(f"The content was blocked by the safety filter: {error}")
+
+    status = getattr(error, "code", None)
+    if isinstance(status, int):
+        return TransportError(f"Model request failed ({status}): {error}", status in RETRYABLE_STATUS_CODES,
+                              _retry_after(error), status)
+    if isinstance(error, (ConnectionError, TimeoutError)) or type(error).__name__ in (
+            "ConnectionError", "Timeout", "ReadTimeout", "FakeBackendError", "TransportError"):
+        return TransportError(f"Model request failed: {error}")
+    return None
+
+
+def _text(response):
+    try:
+        return response.text if response else None
+    except Exception:
+        # `response.text` raises when the candidate was blocked and has no parts
+        return None
+
+
+def check_blocked(response):
+    """Raise SafetyBlockedError if a response carries no text."""
+    if _text(response):
+        return
+
+    message = "No valid response generated. The content may have been blocked by the safety filter."
+    block_reason = getattr(getattr(response, "prompt_feedback", None), "block_reason", None)
+    if block_reason:
+        message += f" Block reason: {block_reason}"
+    candidates = getattr(response, "candidates", None)
+    safety_ratings = getattr(candidates[0], "safety_ratings", None) if candidates else None
+    if safety_ratings:
+        message += f" Safety ratings: {safety_ratings}"
+    raise SafetyBlockedError(message, safety_ratings)
+
+
+class ResilientBackend(LLMBackend):
+    """Wraps a backend with the shared rate limiter, retries with backoff and the circuit breaker."""
+
+    def __init__(self, inner, limiter=None, breaker=None, max_retries=None, backoff_base=None, backoff_max=None,
+                 sleep=time.sleep):
+        self.inner = inner
+        self.model_name = inner.model_name
+        self.limiter = limiter or get_rate_limiter(inner.model_name)
+        self.breaker = breaker or get_circuit_breaker(inner.model_name)
+        self.max_retries = config.LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = config.LLM_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.backoff_max = config.LLM_BACKOFF_MAX if backoff_max is None else backoff_max
+        self._sleep = sleep
+
+    def backoff(self, attempt, retry_after=None):
+        """Full-jitter exponential delay before retry number `attempt`, never shorter than `retry_after`."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        return max(delay, retry_after or 0.0)
+
+    def _start(self, prompt):
+        self.breaker.before_call()
+        reserved = estimate_tokens(prompt if isinstance(prompt, str) else str(prompt))
+        waited = self.limiter.acquire(reserved)
+        if waited:
+            observe("rate_limit_wait", waited, model=self.model_name)
+        return reserved
+
+    def _failed(self, error, attempt):
+        """Classify a failed call; return the delay before retrying, or raise if it should not be retried."""
+        typed = classify_error(error)
+        if typed is None:
+            # Not an API failure (e.g. a bug or a missing fixture): says nothing about the API's health
+            self.breaker.release_trial()
+            raise error
+        if isinstance(typed, SafetyBlockedError):
+            self.breaker.record_success()
+            raise typed from error
+        self.breaker.record_failure()
+        if not typed.retryable or attempt >= self.max_retries:
+            raise typed from error
+        count_retry(self.model_name, typed.status or "transport")
+        return self.backoff(attempt, typed.retry_after)
+
+    def _settle(self, reserved, response):
+        usage = getattr(response, "usage_metadata", None)
+        self.limiter.settle(reserved, getattr(usage, "total_token_count", 0) or 0)
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        if stream:
+            return self._stream(prompt, kwargs)
+
+        for attempt in range(self.max_retries + 1):
+            reserved = self._start(prompt)
+            try:
+                response = self.inner.generate_content(prompt, **kwargs)
+            except Exception as e:
+                self._sleep(self._failed(e, attempt))
+                continue
+            self.breaker.record_success()
+            self._settle(reserved, response)
+            check_blocked(response)
+            return response
+
+    def cache_context(self, text, ttl):
+        # Not retried: without cached content, callers send the text with their prompts
+        return self.inner.cache_context(text, ttl)
+
+    def _stream(self, prompt, kwargs):
+        """Stream a response; failures before the first piece are retried, later ones raise TransportError."""
+        for attempt in range(self.max_retries + 1):
+            reserved = self._start(prompt)
+            try:
+                pieces = iter(self.inner.generate_content(prompt, stream=True, **kwargs))
+                first = next(pieces, None)
+            except Exception as e:
+                self._sleep(self._failed(e, attempt))
+                continue
+            break
+
+        self.breaker.record_success()
+        response = first
+        has_text = False
+        try:
+            if first is not None:
+                for response in itertools.chain([first], pieces):
+                    has_text = has_text or bool(_text(response))
+                    yield response
+        except Exception as e:
+            typed = classify_error(e)
+            if typed is None:
+                raise
+            if isinstance(typed, TransportError):
+                # Part of the answer was already delivered, so the call can't simply be repeated
+                self.breaker.record_failure()
+            raise typed from e
+        self._settle(reserved, response)
+        if not has_text:
+            check_blocked(response)
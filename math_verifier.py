@@ -0,0 +1,456 @@
+"""Verification of math quiz questions with sympy, run in a pool of worker processes.
+
+The parent process only does cheap text work: it recognizes the kind of
+problem in a question (equation or system to solve, derivative, integral,
+expression to evaluate), extracts the expressions and memoizes results by
+their canonical form. Parsing and solving happen in worker processes with a
+per-task timeout, counted from when a worker picks the task up, so a
+pathological expression can neither freeze the session nor crash it; a worker
+that runs over its time is killed with its pool and the tasks queued behind it
+are sent to a fresh one.
+"""
+import itertools
+import multiprocessing
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import config
+from instrumentation import count_cache
+
+UNICODE_MATH = {"²": "^2", "³": "^3", "−": "-", "–": "-", "×": "*", "÷": "/", "·": "*", "√": "sqrt"}
+UNICODE_MATH_REGEX = re.compile("|".join(map(re.escape, UNICODE_MATH)))
+
+FUNCTION_NAMES = ("sqrt", "sin", "cos", "tan", "log", "ln", "exp", "pi")
+MATH_TOKEN = r'(?:\d+(?:\.\d+)?|' + "|".join(FUNCTION_NAMES) + r'|(?<![A-Za-z])[a-z](?![A-Za-z])|[+\-*/^()=.,]|[ \t])'
+MATH_SPAN_REGEX = re.compile(MATH_TOKEN + '+')
+OPERATOR_REGEX = re.compile(r'[+\-*/^=]|\d\s*[a-z(]|\)\s*\(|(?:' + "|".join(FUNCTION_NAMES) + r')\s*\(')
+OPERAND_REGEX = re.compile(r'[\da-z]')
+ASSIGNMENT_SPAN_REGEX = re.compile(r'^[a-z]=[^=]+$')
+EVALUATE_WORDS = ("evaluate", "simplify", "calculate", "compute", "what is", "value of")
+BOUNDS_REGEX = re.compile(r'from\s+(-?[\d.]+)\s+to\s+(-?[\d.]+)', re.IGNORECASE)
+
+# Only these names may reach the sympy parser (which evaluates its input)
+SAFE_EXPRESSION_REGEX = re.compile(r'^(?:' + "|".join(FUNCTION_NAMES) + r'|[a-z](?![a-z])|[\d+\-*/^().,= \t])*$')
+OPTION_PREFIX_REGEX = re.compile(r'^\(?[A-Da-d]\)\s*')
+INTEGRATION_CONSTANT_REGEX = re.compile(r'\s*\+\s*C\b')
+ASSIGNMENT_REGEX = re.compile(r'(?<![A-Za-z])([a-z])\s*=\s*([^,;]+?)(?=\s*(?:,|;|\band\b|\bor\b|$))')
+
+
+@dataclass(frozen=True)
+class MathProblem:
+    """A math problem recognized in a question: its kind and the canonical expressions."""
+    kind: str  # "solve", "derivative", "integral" or "evaluate"
+    expressions: tuple
+    bounds: tuple = None  # (lower, upper) of a definite integral
+
+
+@dataclass
+class VerificationResult:
+    """Outcome of checking one question.
+
+    `status` is "verified" (the declared answer is right), "corrected" (another
+    option is right), "missing" (no option is right), "unsupported" or
+    "timeout". `answer` is the computed answer as text and `option_index`
+    the index of the matching option, if any.
+    """
+    status: str
+    answer: str = None
+    option_index: int = None
+
+
+def normalize_math(text):
+    """Replace unicode math symbols with their ASCII spelling."""
+    return UNICODE_MATH_REGEX.sub(lambda match: UNICODE_MATH[match.group(0)], text)
+
+
+def canonical(expression):
+    """Whitespace-free, `**`-powered form used as memoization key."""
+    return re.sub(r'\s+', '', expression).replace("^", "**")
+
+
+def _math_spans(text):
+    spans = []
+    for match in MATH_SPAN_REGEX.finditer(text):
+        span = match.group(0)
+        # "2x + y = 5, x - y = 1" is a system: each equation is a span of its own
+        parts = span.split(",") if span.count("=") > 1 else [span]
+        for part in parts:
+            part = part.strip(" \t.,")
+            if OPERATOR_REGEX.search(part) and OPERAND_REGEX.search(part):
+                spans.append(part)
+    return spans
+
+
+def extract_problem(question_text):
+    """Recognize the math problem in a question, or return None for non-math questions."""
+    text = normalize_math(question_text)
+    lowered = text.lower()
+    spans = _math_spans(text)
+    if not spans:
+        return None
+
+    equations = [span for span in spans if span.count("=") == 1]
+    expressions = [span for span in spans if "=" not in span]
+    if "derivative" in lowered or "differentiate" in lowered or "d/dx" in lowered:
+        kind = "derivative"
+    elif "integral" in lowered or "integrate" in lowered or "antiderivative" in lowered:
+        kind = "integral"
+    elif equations and (not expressions or "solve" in lowered):
+        kind = "solve"
+    elif expressions and any(word in lowered for word in EVALUATE_WORDS):
+        kind = "evaluate"
+    else:
+        return None
+
+    if kind == "solve":
+        problem_expressions = tuple(canonical(span) for span in equations)
+    elif kind == "evaluate":
+        # "If x = 2, what is 3x + 1?": the assignments are substituted into the expression
+        assignments = tuple(canonical(span) for span in equations if ASSIGNMENT_SPAN_REGEX.match(canonical(span)))
+        problem_expressions = (canonical(max(expressions, key=len)),) + assignments
+    else:
+        # "f(x) = x^2 + 1" -> "x^2 + 1"; the longest span is the expression the question is about
+        problem_expressions = (canonical(max(spans, key=len).split("=")[-1]),)
+    if not all(problem_expressions):
+        return None
+
+    bounds = None
+    if kind == "integral":
+        match = BOUNDS_REGEX.search(text)
+        if match:
+            bounds = (match.group(1), match.group(2))
+    return MathProblem(kind, problem_expressions, bounds)
+
+
+# Seconds between checks on the tasks in flight
+POLL_INTERVAL = 0.02
+
+
+# --- Worker process side -------------------------------------------------------------------------
+
+# Queue on which a worker announces each task it starts (the parent times tasks from then)
+_started = None
+
+
+def _init_worker(started=None):
+    """Cap the memory of a worker so a runaway expression can't take the host down, and load sympy."""
+    global _started
+    _started = started
+    try:
+        import resource
+        limit = config.MATH_WORKER_MEMORY_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        pass
+    import sympy  # noqa: F401  (imported once here rather than on the first question)
+
+
+def _ready(_):
+    return True
+
+
+def _parse(expression):
+    from sympy.parsing.sympy_parser import (
+        convert_xor, implicit_multiplication_application, parse_expr, standard_transformations,
+    )
+
+    if not SAFE_EXPRESSION_REGEX.match(expression):
+        raise ValueError(f"Unsupported expression: {expression!r}")
+    transformations = standard_transformations + (implicit_multiplication_application, convert_xor)
+    return parse_expr(expression.replace("ln", "log"), transformations=transformations)
+
+
+def _variable(expression):
+    import sympy as sp
+    symbols = sorted(expression.free_symbols, key=lambda symbol: symbol.name)
+    return sp.Symbol("x") if sp.Symbol("x") in symbols or not symbols else symbols[0]
+
+
+def _solve(problem):
+    """Return the answer of a problem as a list of candidate values (dicts for equations)."""
+    import sympy as sp
+
+    if problem.kind == "solve":
+        equations = []
+        for expression in problem.expressions:
+            left, right = expression.split("=")
+            equations.append(sp.Eq(_parse(left), _parse(right)))
+        symbols = sorted(set().union(*(eq.free_symbols for eq in equations)), key=lambda symbol: symbol.name)
+        return sp.solve(equations, symbols, dict=True)
+
+    expression = _parse(problem.expressions[0])
+    if problem.kind == "derivative":
+        return [sp.diff(expression, _variable(expression))]
+    if problem.kind == "integral":
+        variable = _variable(expression)
+        if problem.bounds:
+            lower, upper = (sp.nsimplify(bound) for bound in problem.bounds)
+            return [sp.integrate(expression, (variable, lower, upper))]
+        return [sp.integrate(expression, variable)]
+    for assignment in problem.expressions[1:]:
+        name, value = assignment.split("=")
+        expression = expression.subs(sp.Symbol(name), _parse(value))
+    return [sp.simplify(expression)]
+
+
+def _equivalent(a, b):
+    import sympy as sp
+    difference = sp.simplify(a - b)
+    if difference == 0:
+        return True
+    try:
+        return abs(complex(sp.N(difference))) < 1e-9
+    except (TypeError, ValueError):
+        return False
+
+
+def _option_matches(problem, answer, option):
+    """True if the option text is numerically or symbolically equal to the computed answer."""
+    import sympy as sp
+
+    text = normalize_math(OPTION_PREFIX_REGEX.sub("", option)).strip()
+    if problem.kind == "solve":
+        # Options look like "x = 3", "x = 2, y = 1", "3" or "x = 2 or x = -3"
+        assignments = ASSIGNMENT_REGEX.findall(text)
+        if assignments:
+            values = {}
+            for name, value in assignments:
+                values.setdefault(sp.Symbol(name), []).append(_parse(canonical(value)))
+        else:
+            values = {None: [_parse(canonical(part)) for part in re.split(r',|\bor\b', text) if part.strip()]}
+
+        for symbol, option_values in values.items():
+            solutions = [solution[symbol] for solution in answer if symbol in solution] if symbol is not None \
+                else [value for solution in answer for value in solution.values()]
+            if not solutions or len(option_values) > len(solutions):
+                return False
+            if not all(any(_equivalent(value, solution) for solution in solutions) for value in option_values):
+                return False
+        return True
+
+    value = _parse(canonical(INTEGRATION_CONSTANT_REGEX.sub("", text.split("=")[-1])))
+    if problem.kind == "integral" and not problem.bounds:
+        # Antiderivatives are equal up to a constant
+        variable = _variable(answer[0])
+        return _equivalent(sp.diff(value, variable), sp.diff(answer[0], variable))
+    return _equivalent(value, answer[0])
+
+
+def _run_task(task_id, problem, options):
+    """Worker entry point: announce that the task starts, then verify it."""
+    if _started is not None:
+        _started.put(task_id)
+    return _verify_task(problem, options)
+
+
+def _verify_task(problem, options):
+    """Worker task: solve the problem and return (answer text, indices of every matching option).
+
+    Every option is checked, since several can be right ("5/4" and "1.25"): the declared one is
+    then accepted rather than moved to the first equivalent option.
+    """
+    answer = _solve(problem)
+    if not answer:
+        return None, ()
+    if problem.kind == "solve":
+        answer_text = " or ".join(", ".join(f"{k} = {v}" for k, v in solution.items()) for solution in answer)
+    else:
+        answer_text = str(answer[0])
+
+    matches = []
+    for index, option in enumerate(options):
+        try:
+            if _option_matches(problem, answer, option):
+                matches.append(index)
+        except Exception:
+            # Options in prose ("None of the above") can't be parsed; they simply don't match
+            continue
+    return answer_text, tuple(matches)
+
+
+# --- Parent process side -------------------------------------------------------------------------
+
+class MathVerifier:
+    """Checks math questions in a pool of worker processes with per-task timeouts and memoization."""
+
+    def __init__(self, workers=None, timeout=None, memo_size=4096):
+        self.workers = workers or config.MATH_VERIFY_WORKERS
+        self.timeout = config.MATH_VERIFY_TIMEOUT if timeout is None else timeout
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+        self._started = None  # the queue of the current pool's start announcements
+        self._start_times = {}  # task ID -> time.monotonic() when a worker started it
+        self._task_ids = itertools.count()
+        self._drain_lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # "spawn" keeps workers free of the parent's threads (Streamlit, model clients)
+                context = multiprocessing.get_context("spawn")
+                # A SimpleQueue writes in the calling thread: a queue's feeder thread could be starved by
+                # sympy holding the GIL, and the start would never arrive
+                started = context.SimpleQueue()
+                pool = context.Pool(self.workers, initializer=_init_worker, initargs=(started,))
+                # Wait for the workers to start so startup isn't charged to the first question's timeout
+                pool.map(_ready, range(self.workers), chunksize=1)
+                self._pool, self._started = pool, started
+            return self._pool
+
+    def _restart_pool(self, pool):
+        """Kill a pool whose worker is stuck on an expression; the next call starts a fresh one."""
+        with self._lock:
+            if self._pool is pool:
+                self._pool, self._started = None, None
+        pool.terminate()
+
+    def _remember(self, key, result):
+        with self._lock:
+            self._memo[key] = result
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+    def verify(self, questions):
+        """Return a VerificationResult per question (None for questions without math)."""
+        results = [None] * len(questions)
+        pending = {}
+
+        for index, question in enumerate(questions):
+            problem = extract_problem(question.question)
+            if problem is None:
+                continue
+            key = (problem, tuple(question.options))
+            with self._lock:
+                cached = self._memo.get(key)
+            count_cache("math", cached is not None)
+            if cached is not None:
+                results[index] = self._judge(question, cached)
+                continue
+            self._submit(pending, index, key, problem, list(question.options))
+
+        if pending:
+            self._collect(questions, pending, results)
+        return results
+
+    def _submit(self, pending, index, key, problem, options):
+        pool = self._get_pool()
+        task_id = next(self._task_ids)
+        task = pool.apply_async(_run_task, (task_id, problem, options))
+        pending[task_id] = (index, key, problem, options, pool, task)
+
+    def _collect(self, questions, pending, results):
+        """Wait for the tasks in `pending`; each one times out `timeout` seconds after a worker started it.
+
+        After a timeout the pool is restarted and the unfinished tasks are submitted again to the new one.
+        Tasks that never got a worker are given up (unmemoized) once every task could have run in turn.
+        """
+        deadline = time.monotonic() + self.timeout * (len(pending) + 1)
+        while pending:
+            self._drain_started()
+            with self._lock:
+                current = self._pool
+            now = time.monotonic()
+            stuck = None
+            for task_id, (index, key, problem, options, pool, task) in list(pending.items()):
+                with self._lock:
+                    started = self._start_times.get(task_id)
+                if task.ready():
+                    try:
+                        outcome = task.get()
+                    except Exception:
+                        outcome = (None, ())
+                elif pool is not current:
+                    # Its pool was restarted (here or by another session) before it finished: run it again
+                    self._forget_start(task_id)
+                    del pending[task_id]
+                    self._submit(pending, index, key, problem, options)
+                    continue
+                elif started is not None and now - started >= self.timeout:
+                    outcome = "timeout"
+                    stuck = pool
+                elif now >= deadline:
+                    self._forget_start(task_id)
+                    del pending[task_id]
+                    results[index] = VerificationResult("timeout")
+                    continue
+                else:
+                    continue
+                self._forget_start(task_id)
+                del pending[task_id]
+                # Timeouts of tasks that really ran are memoized too so a pathological expression is never retried
+                self._remember(key, outcome)
+                results[index] = self._judge(questions[index], outcome)
+
+            if stuck is not None:
+                self._restart_pool(stuck)
+                deadline = max(deadline, time.monotonic() + self.timeout * (len(pending) + 1))
+            elif pending:
+                time.sleep(POLL_INTERVAL)
+
+    def _drain_started(self):
+        """Record the start time of the tasks the workers of the current pool have announced."""
+        with self._lock:
+            started = self._started
+        # One reader at a time, so a queue found non-empty is never emptied by another thread before get()
+        with self._drain_lock:
+            while started is not None:
+                try:
+                    if started.empty():
+                        break
+                    task_id = started.get()
+                except (OSError, ValueError, EOFError):
+                    break  # the pool was closed meanwhile
+                self._record_start(task_id)
+
+    def _record_start(self, task_id):
+        now = time.monotonic()
+        with self._lock:
+            self._start_times[task_id] = now
+            # Announcements read after their task was collected are long past any timeout by now
+            stale = [key for key, started_at in self._start_times.items() if now - started_at > 10 * self.timeout + 60]
+            for key in stale:
+                del self._start_times[key]
+
+    def _forget_start(self, task_id):
+        with self._lock:
+            self._start_times.pop(task_id, None)
+
+    def _judge(self, question, outcome):
+        if outcome == "timeout":
+            return VerificationResult("timeout")
+        answer, matches = outcome
+        if answer is None:
+            return VerificationResult("unsupported")
+        if not matches:
+            return VerificationResult("missing", answer)
+
+        declared = (question.correct_answer or "").upper()
+        for option_index in matches:
+            if question.options[option_index][1:2].upper() == declared:
+                return VerificationResult("verified", answer, option_index)
+        return VerificationResult("corrected", answer, matches[0])
+
+    def close(self):
+        with self._lock:
+            pool, self._pool, self._started = self._pool, None, None
+        if pool is not None:
+            pool.terminate()
+
+
+_shared_verifier = None
+_shared_lock = threading.Lock()
+
+
+def get_math_verifier():
+    """Process-wide MathVerifier, so all sessions share one worker pool and memo."""
+    global _shared_verifier
+    with _shared_lock:
+        if _shared_verifier is None:
+            _shared_verifier = MathVerifier()
+        return _shared_verifier
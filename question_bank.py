@@ -0,0 +1,178 @@
+"""Persistent bank of verified quiz questions per video and summary.
+
+Questions are keyed by video ID and a hash of the summary they were generated
+from, and deduplicated by a hash of their normalized text. A quiz is drawn by
+random sampling among the questions the user has not seen yet, so once the
+bank of a video is full a new session gets its quiz without calling the
+model. `BankFiller` tops banks up to QUESTION_BANK_TARGET questions in the
+background.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from quiz_parser import Question, normalize_question_text
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+# Rows of the seen-questions table older than this are deleted; by then the session is long gone
+SEEN_RETENTION = 30 * 24 * 3600  # seconds
+
+
+def summary_digest(summary):
+    return hashlib.sha256(summary.encode("utf-8")).hexdigest()[:32]
+
+
+def question_digest(question):
+    return hashlib.sha256(normalize_question_text(question.question).encode("utf-8")).hexdigest()[:32]
+
+
+class QuestionBank(SQLiteStore):
+    """Verified questions by (video ID, summary hash), plus which questions each user has been shown."""
+
+    schema = (
+        """
+        CREATE TABLE IF NOT EXISTS questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            video_id TEXT NOT NULL,
+            summary_hash TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            question TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            UNIQUE (video_id, summary_hash, text_hash)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS seen_questions (
+            user TEXT NOT NULL,
+            question_id INTEGER NOT NULL,
+            seen_at REAL NOT NULL,
+            PRIMARY KEY (user, question_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_seen_questions_seen ON seen_questions (seen_at)",
+    )
+
+    def __init__(self, path=None):
+        super().__init__(path or config.QUESTION_BANK_PATH)
+
+    def add(self, video_id, summary, questions):
+        """Store questions, skipping ones already banked; returns (IDs of all the questions, number added)."""
+        summary_hash = summary_digest(summary)
+        now = time.time()
+        ids = []
+        added = 0
+        with self._lock, self._connect() as conn:
+            for question in questions:
+                text_hash = question_digest(question)
+                added += conn.execute(
+                    "INSERT OR IGNORE INTO questions (video_id, summary_hash, text_hash, question, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (video_id, summary_hash, text_hash, json.dumps(question.to_dict(), ensure_ascii=False), now),
+                ).rowcount
+                ids.append(conn.execute(
+                    "SELECT id FROM questions WHERE video_id = ? AND summary_hash = ? AND text_hash = ?",
+                    (video_id, summary_hash, text_hash),
+                ).fetchone()[0])
+        return ids, added
+
+    def count(self, video_id, summary):
+        with self._lock, self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM questions WHERE video_id = ? AND summary_hash = ?",
+                (video_id, summary_digest(summary)),
+            ).fetchone()[0]
+
+    def questions(self, video_id, summary):
+        """Every banked question for a video and summary, oldest first."""
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT question FROM questions WHERE video_id = ? AND summary_hash = ? ORDER BY id",
+                (video_id, summary_digest(summary)),
+            ).fetchall()
+        return [Question.from_dict(json.loads(row[0])) for row in rows]
+
+    def sample(self, video_id, summary, count, user=None):
+        """Draw up to `count` random questions that `user` has not seen; returns (IDs, questions)."""
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT id, question FROM questions
+                WHERE video_id = ? AND summary_hash = ?
+                  AND id NOT IN (SELECT question_id FROM seen_questions WHERE user = ?)
+                ORDER BY random() LIMIT ?
+                """,
+                (video_id, summary_digest(summary), user or "", count),
+            ).fetchall()
+        return [row[0] for row in rows], [Question.from_dict(json.loads(row[1])) for row in rows]
+
+    def mark_seen(self, user, question_ids):
+        """Remember that `user` was shown these questions, so later samples skip them."""
+        if not user or not question_ids:
+            return
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO seen_questions VALUES (?, ?, ?)",
+                [(user, question_id, now) for question_id in question_ids],
+            )
+            conn.execute("DELETE FROM seen_questions WHERE seen_at < ?", (now - SEEN_RETENTION,))
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM seen_questions")
+            conn.execute("DELETE FROM questions")
+
+
+class BankFiller:
+    """Grows question banks to `target` questions on a background thread, one fill per bank at a time.
+
+    Each round asks the model for up to QUESTION_BANK_BATCH new questions,
+    listing the banked ones so they are not repeated; filling stops early when
+    a round adds nothing new (the summary has run out of material).
+    """
+
+    def __init__(self, bank, quiz_generator, target=None, batch_size=None, max_rounds=None):
+        self.bank = bank
+        self.quiz_generator = quiz_generator
+        self.target = config.QUESTION_BANK_TARGET if target is None else target
+        self.batch_size = batch_size or config.QUESTION_BANK_BATCH
+        self.max_rounds = max_rounds or (self.target // self.batch_size + 3 if self.target else 0)
+        self._filling = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="question-bank")
+
+    def fill(self, video_id, summary):
+        """Schedule a fill of the bank for this video and summary unless it is full or already being filled."""
+        key = (video_id, summary_digest(summary))
+        with self._lock:
+            if not self.target or key in self._filling:
+                return None
+            self._filling.add(key)
+        return self._executor.submit(self._fill, key, video_id, summary)
+
+    def _fill(self, key, video_id, summary):
+        try:
+            for _ in range(self.max_rounds):
+                missing = self.target - self.bank.count(video_id, summary)
+                if missing <= 0:
+                    break
+                existing = self.bank.questions(video_id, summary)
+                context = self.quiz_generator.transcript_context(video_id)
+                questions = self.quiz_generator.generate_quiz(summary, min(missing, self.batch_size),
+                                                              existing=existing, context=context) or []
+                _, added = self.bank.add(video_id, summary, questions)
+                logger.info("question bank %s: +%d questions (%d of %d)", video_id, added,
+                            len(existing) + added, self.target)
+                if not added:
+                    break
+        except Exception:
+            logger.exception("Could not fill the question bank of %s", video_id)
+        finally:
+            with self._lock:
+                self._filling.discard(key)
@@ -1,24 +1,49 @@
+import copy
+import itertools
+import logging
+import queue
 import re
-import google.generativeai as genai
-import streamlit as st
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import config
+from instrumentation import (count_cache, count_llm_call, count_quiz_response, count_regeneration, finish_llm_call,
+                             observe, span)
+from llm_backends import create_backend
+from llm_client import SafetyBlockedError, TransportError
+from math_verifier import get_math_verifier
+from quiz_parser import (QUIZ_RESPONSE_SCHEMA, JsonQuizParser, QuizParser, clean_text, normalize_question_text,
+                         parse_quiz, parse_quiz_json)
+from reporting import LoggingReporter, RecordingReporter
+from transcript_context import TranscriptContexts, context_missing
+
+logger = logging.getLogger(__name__)
+
+EXISTING_QUESTIONS_TEMPLATE = """
+            The learner already has the following questions. Do not repeat them or ask the same thing in other words:
+{questions}
+            """
 
-class QuizGenerator:
-    def __init__(self):
-        self.model = self.initialize_model()
+# Added when the transcript of the video is the context of the call
+TRANSCRIPT_CONTEXT_NOTE = """
+            The transcript of the video is given above: use it for the details, equations and examples the summary
+            leaves out, but keep the questions on the topics of the summary.
+            """
 
-    def initialize_model(self, model_name="gemini-1.5-flash-001"):
-        """Initialize the Gemini model."""
-        try:
-            model = genai.GenerativeModel(model_name)
-            return model
-        except Exception as e:
-            st.error(f"Error initializing the model: {e}")
-            return None
+# Structured output stays off for a model this long after it rejected the response schema (seconds)
+SCHEMA_FALLBACK_SECONDS = 600
 
-    def generate_quiz(self, summary, num_questions=10):
-        """Generate quiz questions based on the summary."""
-        try:
-            quiz_prompt = f"""
+# A 400/404 whose message names the schema or MIME type, rather than any other bad request
+SCHEMA_ERROR_REGEX = re.compile(r"schema|mime", re.IGNORECASE)
+
+# Models that rejected the response schema, with when to try structured output again (time.monotonic())
+_schema_rejections = {}
+_schema_lock = threading.Lock()
+
+# Marks the end of one shard's questions in stream_quiz
+_SHARD_DONE = object()
+
+QUIZ_PROMPT_TEMPLATE = """
             Based on the following summary, generate {num_questions} multiple-choice questions with 4 options each.
             The questions should be relevant to the context of the video, and the type of questions should be generated according to the nature of the content:
             
@@ -55,137 +80,439 @@ class QuizGenerator:
             {summary}
             """
 
-            response = self.model.generate_content(quiz_prompt)
-            generated_quiz_text = response.text
+# Structured output mode: same instructions, the format is enforced by QUIZ_RESPONSE_SCHEMA
+QUIZ_JSON_PROMPT_TEMPLATE = QUIZ_PROMPT_TEMPLATE[:QUIZ_PROMPT_TEMPLATE.index("**Formatting**")] + """**Formatting**:
+            Answer with a JSON array with one object per question, with these fields:
+            - "question": the question text or mathematical expression
+            - "options": exactly 4 answer options, without letters in front
+            - "correct_index": position of the correct option in "options" (0 to 3)
+            - "explanation": how to solve the problem or why the correct answer is the best option
 
-            # Verify the math problems
-            verified_quiz = self.verify_math_answers(generated_quiz_text)
+            Here is the summary of the video content to base the questions on:
+            {summary}
+            """
 
-            return verified_quiz
+class QuizGenerator:
+    def __init__(self, reporter=None, model=None, math_verifier=None, output_mode=None, contexts=None):
+        self.reporter = reporter or LoggingReporter()
+        self.model = model or self.initialize_model(config.QUIZ_MODEL)
+        self.math_verifier = math_verifier or get_math_verifier()
+        # "json" asks for structured output against QUIZ_RESPONSE_SCHEMA, "text" for the text format
+        self.output_mode = output_mode or config.QUIZ_OUTPUT_MODE
+        # Transcripts stored by the summarizer, given to the quiz calls (see transcript_context)
+        if contexts is None and config.CONTEXT_REUSE:
+            contexts = TranscriptContexts()
+        self.contexts = contexts
+
+    def with_reporter(self, reporter):
+        """A generator sharing this one's model, math verifier and transcripts that reports to `reporter`."""
+        generator = copy.copy(self)
+        generator.reporter = reporter
+        return generator
+
+    def initialize_model(self, model_name=config.QUIZ_MODEL):
+        """Initialize the model backend selected by LLM_BACKEND."""
+        try:
+            model = create_backend(model_name)
+            return model
         except Exception as e:
-            st.error(f"Error generating the quiz: {e}")
+            self.reporter.error(f"Error initializing the model: {e}")
             return None
 
-    def verify_math_answers(self, quiz_text):
+    def build_quiz_prompt(self, summary, num_questions, existing=None, mode=None, context=None):
+        """Fill in the quiz prompt for a summary, asking the model not to repeat `existing` questions.
+
+        With a TranscriptContext the prompt refers to the transcript too (and starts with it unless it is cached).
         """
-        This function verifies that the correct answer for math problems is correctly calculated
-        and included in the multiple-choice options.
+        template = QUIZ_JSON_PROMPT_TEMPLATE if (mode or self.current_mode()) == "json" else QUIZ_PROMPT_TEMPLATE
+        prompt = template.format(num_questions=num_questions, summary=summary)
+        if existing:
+            listed = "\n".join(f"            - {question.question}" for question in existing)
+            prompt += EXISTING_QUESTIONS_TEMPLATE.format(questions=listed)
+        if context is not None:
+            prompt = context.prompt(prompt + TRANSCRIPT_CONTEXT_NOTE)
+        return prompt
+
+    def request_options(self, mode, context=None):
+        """Extra generate_content arguments for an output mode and transcript context."""
+        options = context.request_options() if context is not None else {}
+        if mode == "json":
+            options["generation_config"] = {"response_mime_type": "application/json",
+                                            "response_schema": QUIZ_RESPONSE_SCHEMA}
+        return options
+
+    def transcript_context(self, video_id):
+        """The TranscriptContext of a video for the quiz model, or None (no video, no transcript or reuse off)."""
+        if self.contexts is None or not video_id:
+            return None
+        try:
+            return self.contexts.context(video_id, self.model)
+        except Exception as e:
+            # The quiz is then generated from the summary alone
+            logger.warning("Could not load the transcript of %s: %s", video_id, e)
+            return None
+
+    def context_lost(self, context, error):
+        """True if a call failed because the cached transcript it referenced is gone (expired or deleted).
+
+        The cached content is then forgotten and the call is retried without the transcript.
+        """
+        if context is None or not context.cache_name or self.contexts is None or not context_missing(error):
+            return False
+        logger.warning("The cached transcript of %s is gone (%s); continuing with the summary alone",
+                       context.video_id, error)
+        self.contexts.drop_cache(context, self.model)
+        return True
+
+    def new_parser(self, mode):
+        return JsonQuizParser() if mode == "json" else QuizParser()
+
+    def current_mode(self):
+        """The output mode of the next call: `output_mode`, unless the model rejected the schema recently."""
+        if self.output_mode != "json":
+            return self.output_mode
+        with _schema_lock:
+            until = _schema_rejections.get(getattr(self.model, "model_name", None))
+        return "text" if until is not None and time.monotonic() < until else "json"
+
+    def schema_rejected(self, mode, error):
+        """True if a structured request failed with a 400/404; the call is then repeated in text mode.
+
+        Only an error that names the schema or MIME type turns structured output off for the
+        model, for SCHEMA_FALLBACK_SECONDS; other bad requests only affect the call that failed.
         """
-        questions = self.parse_quiz(quiz_text)
-        
+        if mode != "json" or not isinstance(error, TransportError) or error.status not in (400, 404):
+            return False
+        if SCHEMA_ERROR_REGEX.search(str(error)):
+            logger.warning("Structured quiz output was rejected (%s); using the text format for %d seconds",
+                           error, SCHEMA_FALLBACK_SECONDS)
+            with _schema_lock:
+                _schema_rejections[getattr(self.model, "model_name", None)] = (time.monotonic()
+                                                                               + SCHEMA_FALLBACK_SECONDS)
+        else:
+            logger.warning("Structured quiz request failed (%s); retrying it in the text format", error)
+        return True
+
+    def drop_duplicates(self, questions, existing=None):
+        """Yield the questions whose normalized text is not in `existing` or earlier in `questions`."""
+        seen = {normalize_question_text(question.question) for question in existing or ()}
         for question in questions:
-            if "solve" in question["question"].lower():  # Only check for math-related questions
-                # Extract the equation from the question
-                try:
-                    equation = self.extract_equation_from_question(question["question"])
-                    correct_answer = self.solve_equation(equation)
-                    
-                    # Check if the correct answer is in the options
-                    if not any(correct_answer in option for option in question["options"]):
-                        st.warning(f"Correct answer {correct_answer} was not found in options. Adjusting the options.")
-                        # Replace one of the incorrect options with the correct answer
-                        question["options"][-1] = f"(D) x = {correct_answer}"  # Replace last option for now
+            key = normalize_question_text(question.question)
+            if key not in seen:
+                seen.add(key)
+                yield question
+
+    def generate_quiz(self, summary, num_questions=10, existing=None, context=None, mode=None):
+        """Generate quiz questions based on the summary, returning verified Question records.
 
+        Pass the questions the learner already has as `existing` to top up a quiz with new ones only,
+        and the video's TranscriptContext as `context` to let the questions draw on the transcript.
+        """
+        try:
+            mode = mode or self.current_mode()
+            quiz_prompt = self.build_quiz_prompt(summary, num_questions, existing, mode, context)
+            with span("llm_call", model=getattr(self.model, "model_name", None), purpose="quiz", mode=mode) as current:
+                try:
+                    response = self.model.generate_content(quiz_prompt, **self.request_options(mode, context))
+                    text = response.text
+                except SafetyBlockedError:
+                    finish_llm_call(current, "blocked")
+                    raise
                 except Exception as e:
-                    pass
+                    finish_llm_call(current, "error")
+                    if self.context_lost(context, e):
+                        return self.generate_quiz(summary, num_questions, existing, None, mode)
+                    if self.schema_rejected(mode, e):
+                        return self.generate_quiz(summary, num_questions, existing, context, "text")
+                    raise
+                finish_llm_call(current, "ok" if text else "blocked", response)
+            with span("parse_quiz", mode=mode) as current:
+                parsed = parse_quiz_json(text) if mode == "json" else self.parse_quiz(text)
+                current.set(result=count_quiz_response(mode, num_questions, len(parsed)))
+                questions = list(self.drop_duplicates(parsed, existing))[:num_questions]
+                current.set(questions=len(questions))
 
-        # Reformat the quiz back into a text structure (optional)
-        return self.format_quiz(questions)
+            # Verify the math problems
+            return self.verify_math_answers(questions)
+        except Exception as e:
+            self.reporter.error(f"Error generating the quiz: {e}")
+            return None
 
-    def extract_equation_from_question(self, question_text):
-        """Extract the equation from the question text."""
-        # Extracts the mathematical expression from the question
-        match = re.search(r'(\d+x.*=\d+)', question_text)
-        if match:
-            return match.group(1)
-        else:
-            raise ValueError("No valid equation found in the question.")
+    def split_summary(self, summary, shards):
+        """Split the summary into at most `shards` sections of similar length, on paragraph boundaries."""
+        paragraphs = [p for p in summary.split("\n\n") if p.strip()]
+        shards = max(1, min(shards, len(paragraphs)))
+        if shards == 1:
+            return [summary]
+
+        target = sum(len(p) for p in paragraphs) / shards
+        sections = []
+        current = []
+        size = 0
+        for paragraph in paragraphs:
+            current.append(paragraph)
+            size += len(paragraph)
+            if size >= target and len(sections) < shards - 1:
+                sections.append("\n\n".join(current))
+                current = []
+                size = 0
+        if current:
+            sections.append("\n\n".join(current))
+        return sections
+
+    def stream_questions(self, summary, num_questions, existing=None, context=None, mode=None):
+        """Stream one quiz generation and yield each question as soon as it is parsed and verified."""
+        mode = mode or self.current_mode()
+        parser = self.new_parser(mode)
+        prompt = self.build_quiz_prompt(summary, num_questions, existing, mode, context)
+        model_name = getattr(self.model, "model_name", None)
+        # Timed by hand: the time spent in the consumer between questions must not be counted
+        started = time.perf_counter()
+        parse_seconds = 0.0
+        parsed = 0
+        counted = False
+        response = None
+        outcome = "cancelled"  # the consumer stopped reading, e.g. once it had enough questions
+        fallback = None
+        try:
+            for response in self.model.generate_content(prompt, stream=True, **self.request_options(mode, context)):
+                parse_started = time.perf_counter()
+                questions = parser.feed(response.text)
+                parse_seconds += time.perf_counter() - parse_started
+                parsed += len(questions)
+                if parsed >= num_questions and not counted:
+                    # Counted now: the consumer may stop reading once it has all its questions
+                    count_quiz_response(mode, num_questions, parsed)
+                    counted = True
+                for question in questions:
+                    yield from self.verify_math_answers([question])
+            outcome = "ok"
+        except SafetyBlockedError:
+            outcome = "blocked"
+            raise
+        except Exception as e:
+            outcome = "error"
+            # Failures before the first piece are raised before anything was yielded
+            if response is None and self.context_lost(context, e):
+                fallback = (None, mode)
+            elif response is None and self.schema_rejected(mode, e):
+                fallback = (context, "text")
+            else:
+                raise
+        finally:
+            tokens_in, tokens_out = count_llm_call(model_name, "quiz", outcome, response)
+            observe("llm_call", time.perf_counter() - started, model=model_name, purpose="quiz", stream=True,
+                    mode=mode, outcome=outcome, tokens_in=tokens_in, tokens_out=tokens_out)
+        if fallback:
+            yield from self.stream_questions(summary, num_questions, existing, *fallback)
+            return
+
+        parse_started = time.perf_counter()
+        questions = parser.close()
+        parsed += len(questions)
+        if not counted:
+            count_quiz_response(mode, num_questions, parsed)
+        observe("parse_quiz", parse_seconds + time.perf_counter() - parse_started, mode=mode)
+        yield from self.verify_math_answers(questions)
+
+    def stream_quiz(self, summary, num_questions=10, shards=None, existing=None, context=None):
+        """Yield verified questions while the quiz is still being generated.
+
+        With `shards` > 1 the summary is split into sections whose questions are
+        generated in parallel; questions are yielded in the order they arrive.
+        Questions duplicating `existing` ones or each other are skipped. Errors
+        are raised to the caller; if only some shards fail, the others'
+        questions are still delivered. Every call gets the transcript `context`.
+        """
+        sections = self.split_summary(summary, shards or config.QUIZ_SHARDS)
+        if len(sections) == 1:
+            questions = self.stream_questions(summary, num_questions, existing, context)
+            yield from itertools.islice(self.drop_duplicates(questions, existing), num_questions)
+            return
+
+        yield from itertools.islice(
+            self.drop_duplicates(self._stream_shards(sections, num_questions, existing, context), existing),
+            num_questions
+        )
+
+    def _stream_shards(self, sections, num_questions, existing, context=None):
+        """Generate questions for every section in parallel and yield them as they arrive."""
+        # Spread the questions over the sections, e.g. 10 over 3 -> 4, 3, 3
+        counts = [num_questions // len(sections) + (i < num_questions % len(sections)) for i in range(len(sections))]
+        arrived = queue.Queue()
+        errors = []
+        stop = threading.Event()
+
+        def produce(section, count):
+            try:
+                for question in itertools.islice(self.stream_questions(section, count, existing, context), count):
+                    if stop.is_set():
+                        break
+                    arrived.put(question)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                arrived.put(_SHARD_DONE)
+
+        executor = ThreadPoolExecutor(max_workers=len(sections))
+        try:
+            for section, count in zip(sections, counts):
+                executor.submit(produce, section, count)
+
+            remaining = len(sections)
+            while remaining:
+                item = arrived.get()
+                if item is _SHARD_DONE:
+                    remaining -= 1
+                else:
+                    yield item
+        finally:
+            # Stop the shards if the consumer goes away before the end, without waiting for them
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        if errors and len(errors) == len(sections):
+            raise errors[0]
+
+    def verify_math_answers(self, questions):
+        """
+        This function verifies that the correct answer for math problems is correctly calculated
+        and included in the multiple-choice options.
+        """
+        if not questions:
+            return questions
+        try:
+            with span("math_verify", questions=len(questions)):
+                results = self.math_verifier.verify(questions)
+        except Exception as e:
+            # Unverified questions are better than no quiz at all
+            self.reporter.warning(f"Could not verify the math questions: {e}")
+            return questions
+
+        for question, result in zip(questions, results):
+            if result is None or result.status in ("verified", "unsupported"):
+                continue
+            if result.status == "timeout":
+                self.reporter.warning(f"Could not verify the math in \"{question.question}\" in time.")
+            elif result.status == "corrected":
+                # The right answer is among the options but another one was marked correct
+                question.correct_answer = question.options[result.option_index][1:2]
+            else:
+                self.reporter.warning(f"Correct answer {result.answer} was not found in options. Adjusting the options.")
+                # Replace one of the incorrect options with the correct answer
+                question.options[-1] = f"(D) {result.answer}"
+                question.correct_answer = "D"
 
-    def solve_equation(self, equation):
-        """Solve a simple linear equation."""
-        # Parse the equation and solve for x
-        import sympy as sp
-        x = sp.symbols('x')
-        solution = sp.solve(equation, x)
-        return solution[0] if solution else None
+        return questions
 
     def format_quiz(self, questions):
         """Format the list of questions into a readable text format (optional)."""
-        formatted_quiz = ""
+        parts = []
         for i, question in enumerate(questions):
-            formatted_quiz += f"Question {i + 1}: {question['question']}\n"
-            for option in question['options']:
-                formatted_quiz += f"{option}\n"
-            formatted_quiz += f"Correct Answer: {question['correct_answer']}\n"
-            formatted_quiz += f"Explanation: {question['feedback']}\n\n"
-        return formatted_quiz
+            parts.append(f"Question {i + 1}: {question.question}\n")
+            for option in question.options:
+                parts.append(f"{option}\n")
+            parts.append(f"Correct Answer: {question.correct_answer}\n")
+            parts.append(f"Explanation: {question.feedback}\n\n")
+        return "".join(parts)
 
     def clean_text(self, text):
         """Clean and format text by removing unwanted characters."""
-        return re.sub(r'\*\*|\:\n|\n+', '', text).strip()
+        return clean_text(text)
 
     def parse_quiz(self, quiz_text):
-        """Parse quiz text into a list of questions, options, correct answers, and feedback."""
-        questions = []
-        lines = quiz_text.strip().split("\n")
-        current_question = None
-
-        # Regex to capture the question, options, correct answer, and explanation
-        question_regex = re.compile(r'Question \d+:\s*(.*)', re.IGNORECASE)
-        option_regex = re.compile(r'\(([A-Da-d])\)\s*(.*)')
-        correct_answer_regex = re.compile(r'Correct Answer:\s*\(?([A-Da-d])\)?')
-        explanation_regex = re.compile(r'Explanation:\s*(.*)')
-
-        question_lines = []  # Collect lines for a multi-line question
-
-        for line in lines:
-            cleaned_line = self.clean_text(line)
-
-            # Match a new question
-            question_match = question_regex.match(cleaned_line)
-            if question_match:
-                # If there's an existing question, append it
-                if current_question and current_question["options"]:
-                    questions.append(current_question)
-
-                # Start a new question
-                current_question = {"question": "", "options": [], "correct_answer": None, "feedback": ""}
-                question_lines = [question_match.group(1).strip()]
-
-            # Continue collecting lines for the current question until options start
-            elif current_question and cleaned_line and not option_regex.match(cleaned_line) and not correct_answer_regex.match(cleaned_line) and not explanation_regex.match(cleaned_line):
-                question_lines.append(cleaned_line)
-
-            # Match the options
-            elif option_regex.match(cleaned_line) and current_question:
-                current_question["question"] = " ".join(question_lines).replace("Options:", "").strip()  # Remove any trailing "Options" word
-                option_match = option_regex.match(cleaned_line)
-                if option_match:
-                    current_question["options"].append(f"({option_match.group(1)}) {option_match.group(2)}")
-
-            # Match the correct answer
-            correct_answer_match = correct_answer_regex.match(cleaned_line)
-            if correct_answer_match and current_question:
-                current_question["correct_answer"] = correct_answer_match.group(1).strip()
-
-            # Match the explanation
-            explanation_match = explanation_regex.match(cleaned_line)
-            if explanation_match and current_question:
-                current_question["feedback"] = explanation_match.group(1).strip()
-
-        # Append the last question if not already appended
-        if current_question and current_question["options"]:
-            questions.append(current_question)
-
-        # Post-process questions (ensure 4 options, explanation present)
-        for question in questions:
-            # Ensure there are 4 options by appending placeholders if necessary
-            if len(question["options"]) < 4:
-                while len(question["options"]) < 4:
-                    question["options"].append("(N/A) Option not provided")
-
-            # Ensure every question has feedback
-            if not question["feedback"]:
-                question["feedback"] = "No explanation provided."
+        """Parse quiz text into a list of Question records with options, correct answers, and feedback."""
+        return parse_quiz(quiz_text)
+
+
+class QuizStream:
+    """Runs QuizGenerator.stream_quiz on a background thread and collects the questions.
+
+    `questions` grows in place as questions arrive, so the UI can show the first
+    ones while the rest are still being generated. If fewer than `num_questions`
+    could be parsed, only the missing ones are requested (up to
+    QUIZ_TOP_UP_ATTEMPTS times). `done` is set when generation ends, with
+    `error` holding the exception if it failed.
+
+    With a question bank `filler`, the quiz is drawn from the questions of
+    `video_id` that `user` has not seen yet and only the missing ones are
+    generated; those are added to the bank, which is then topped up in the
+    background. Generation calls reference the transcript of `video_id`
+    (QuizGenerator.transcript_context) when it is available.
+
+    The generator's warnings and errors are kept in `messages` as (level,
+    message) pairs for the page to show: the background thread has no
+    Streamlit context to show them itself.
+    """
+
+    def __init__(self, quiz_generator, summary, num_questions=10, shards=None, filler=None, video_id="", user=None):
+        self.num_questions = num_questions
+        self.questions = []
+        self.from_bank = 0
+        self.top_ups = 0
+        self.error = None
+        self.done = threading.Event()
+        reporter = RecordingReporter()
+        self.messages = reporter.messages
+        self._thread = threading.Thread(
+            target=self._run, args=(quiz_generator.with_reporter(reporter), summary, num_questions, shards, filler,
+                                    video_id, user), daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, quiz_generator, summary, num_questions, shards, filler, video_id, user):
+        bank = filler.bank if filler is not None else None
+        seen_ids = []
+        try:
+            banked = []
+            if bank is not None:
+                seen_ids, drawn = bank.sample(video_id, summary, num_questions, user)
+                self.questions.extend(drawn)
+                self.from_bank = len(drawn)
+                count_cache("question_bank", len(drawn) >= num_questions)
+                if len(drawn) < num_questions:
+                    banked = bank.questions(video_id, summary)
+
+            missing = num_questions - len(self.questions)
+            if missing > 0:
+                context = quiz_generator.transcript_context(video_id)
+                for question in quiz_generator.stream_quiz(summary, missing, shards, existing=banked or None,
+                                                           context=context):
+                    self.questions.append(question)
+
+            # Keep what parsed and only ask for the missing questions, never for a full new quiz
+            for _ in range(config.QUIZ_TOP_UP_ATTEMPTS):
+                missing = num_questions - len(self.questions)
+                if missing <= 0:
+                    break
+                self.top_ups += 1
+                count_regeneration(quiz_generator.output_mode)
+                existing = banked + self.questions[self.from_bank:]
+                context = quiz_generator.transcript_context(video_id)
+                for question in quiz_generator.stream_quiz(summary, missing, shards=1, existing=existing,
+                                                           context=context):
+                    self.questions.append(question)
+        except Exception as e:
+            self.error = e
+        finally:
+            if bank is not None:
+                self._save_to_bank(filler, video_id, summary, user, seen_ids)
+            self.done.set()
 
-        return questions
+    def _save_to_bank(self, filler, video_id, summary, user, seen_ids):
+        try:
+            new_ids, _ = filler.bank.add(video_id, summary, self.questions[self.from_bank:])
+            filler.bank.mark_seen(user, seen_ids + new_ids)
+            filler.fill(video_id, summary)
+        except Exception:
+            # The quiz itself is fine; only the bank missed out
+            logger.exception("Could not update the question bank")
+
+    def wait_for(self, count, timeout=None):
+        """Block until at least `count` questions have arrived or generation ended."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(self.questions) < count and not self.done.is_set():
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            self.done.wait(0.1)
+        return len(self.questions) >= count
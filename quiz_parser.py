@@ -0,0 +1,248 @@
+import json
+import re
+
+# One pattern per kind of quiz line, combined so each line is matched exactly once
+LINE_REGEX = re.compile(
+    r'(?i:Question \d+:)\s*(?P<question>.*)'
+    r'|\((?P<letter>[A-Da-d])\)\s*(?P<option>.*)'
+    r'|Correct Answer:\s*\(?(?P<correct>[A-Da-d])\)?'
+    r'|Explanation:\s*(?P<explanation>.*)'
+)
+CLEAN_REGEX = re.compile(r'\*\*|\:\n|\n+')
+NORMALIZE_REGEX = re.compile(r'[^\w]+')
+
+MISSING_OPTION = "(N/A) Option not provided"
+MISSING_EXPLANATION = "No explanation provided."
+
+
+def clean_text(text):
+    """Clean and format text by removing unwanted characters."""
+    return CLEAN_REGEX.sub('', text).strip()
+
+
+def normalize_question_text(text):
+    """Lowercase the question and drop punctuation and spacing, for duplicate detection."""
+    return NORMALIZE_REGEX.sub(" ", text.lower()).strip()
+
+
+class Question:
+    """A parsed multiple-choice question.
+
+    `options` are formatted as "(A) text", `correct_answer` is the option
+    letter and `feedback` the explanation.
+    """
+
+    __slots__ = ("question", "options", "correct_answer", "feedback")
+
+    def __init__(self, question="", options=None, correct_answer=None, feedback=""):
+        self.question = question
+        self.options = options if options is not None else []
+        self.correct_answer = correct_answer
+        self.feedback = feedback
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["question"], list(data["options"]), data.get("correct_answer"), data.get("feedback", ""))
+
+    def __eq__(self, other):
+        return isinstance(other, Question) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"Question({self.question!r}, options={self.options!r}, correct_answer={self.correct_answer!r})"
+
+
+class QuizParser:
+    """Single-pass, incremental parser for the quiz text format the model is asked for.
+
+    Text can be fed in arbitrary pieces as the model streams it; `feed` returns
+    the questions completed so far and `close` flushes the last one. A question
+    is complete once its explanation has been read (with options and a correct
+    answer) or when the next question starts.
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self._current = None
+        self._question_lines = []
+
+    def feed(self, text):
+        """Parse a piece of quiz text and return the list of questions it completed."""
+        completed = []
+        lines = (self._pending + text).split("\n")
+        self._pending = lines.pop()
+        for line in lines:
+            self._parse_line(line, completed)
+        return completed
+
+    def close(self):
+        """Parse any buffered text and return the remaining completed questions."""
+        completed = []
+        if self._pending:
+            self._parse_line(self._pending, completed)
+            self._pending = ""
+        self._finish(completed)
+        return completed
+
+    def _finish(self, completed):
+        question = self._current
+        self._current = None
+        if question is None or not question.options:
+            return
+
+        # Ensure there are 4 options and that every question has feedback
+        while len(question.options) < 4:
+            question.options.append(MISSING_OPTION)
+        if not question.feedback:
+            question.feedback = MISSING_EXPLANATION
+        completed.append(question)
+
+    def _parse_line(self, line, completed):
+        # Lines never contain newlines here, so cleaning is just dropping bold markers
+        line = line.replace("**", "").strip()
+        if not line:
+            return
+
+        match = LINE_REGEX.match(line)
+        current = self._current
+        if match is None:
+            # Continue collecting lines for the current question until options start
+            if current is not None:
+                self._question_lines.append(line)
+            return
+
+        kind = match.lastgroup
+        if kind == "question":
+            self._finish(completed)
+            self._current = Question()
+            self._question_lines = [match.group("question").strip()]
+        elif current is None:
+            return
+        elif kind in ("letter", "option"):
+            # Remove any trailing "Options" word
+            current.question = " ".join(self._question_lines).replace("Options:", "").strip()
+            current.options.append(f"({match.group('letter')}) {match.group('option')}")
+        elif kind == "correct":
+            current.correct_answer = match.group("correct")
+        elif kind == "explanation":
+            current.feedback = match.group("explanation").strip()
+            if current.options and current.correct_answer:
+                self._finish(completed)
+
+
+def parse_quiz(quiz_text):
+    """Parse quiz text into a list of Question records."""
+    parser = QuizParser()
+    return parser.feed(quiz_text) + parser.close()
+
+
+# Structured output: the model is asked for a JSON array of questions matching this schema
+# (Gemini's OpenAPI subset: no min/max items, so the number of options is checked when parsing)
+QUIZ_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "question": {"type": "string"},
+            "options": {"type": "array", "items": {"type": "string"}},
+            "correct_index": {"type": "integer"},
+            "explanation": {"type": "string"},
+        },
+        "required": ["question", "options", "correct_index", "explanation"],
+    },
+}
+OPTION_LETTERS = "ABCD"
+# Letters some answers still put in front of an option ("A) ", "(B) ", "C. ")
+OPTION_PREFIX_REGEX = re.compile(r'^\(?[A-Da-d][).:]\s+')
+
+
+def question_from_json(item):
+    """Validate one question object of a structured quiz response; return a Question or None if invalid."""
+    if not isinstance(item, dict):
+        return None
+    question, options = item.get("question"), item.get("options")
+    correct, explanation = item.get("correct_index"), item.get("explanation")
+    if not isinstance(question, str) or not question.strip():
+        return None
+    if not isinstance(options, list) or len(options) != len(OPTION_LETTERS) \
+            or not all(isinstance(option, str) and option.strip() for option in options):
+        return None
+    if isinstance(correct, bool) or not isinstance(correct, int) or not 0 <= correct < len(OPTION_LETTERS):
+        return None
+    options = [f"({letter}) {OPTION_PREFIX_REGEX.sub('', option.strip())}"
+               for letter, option in zip(OPTION_LETTERS, options)]
+    feedback = explanation.strip() if isinstance(explanation, str) and explanation.strip() else MISSING_EXPLANATION
+    return Question(" ".join(question.split()), options, OPTION_LETTERS[correct], feedback)
+
+
+class JsonQuizParser:
+    """Incremental parser for structured (JSON array) quiz responses, with the same interface as QuizParser.
+
+    Each question object is decoded and validated as soon as its closing brace
+    arrives, so questions still stream. `invalid` counts the objects that did
+    not match the schema. If the response turns out not to be JSON at all
+    (e.g. the model ignored the requested format), `close` parses the whole
+    text with the text parser instead and sets `fell_back`.
+    """
+
+    def __init__(self):
+        self.invalid = 0
+        self.fell_back = False
+        self._text = ""
+        self._scanned = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._object_start = None
+        self._parsed = 0
+
+    def feed(self, text):
+        completed = []
+        self._text += text
+        for i in range(self._scanned, len(self._text)):
+            char = self._text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "[{":
+                self._depth += 1
+                if char == "{" and self._depth == 2:
+                    self._object_start = i
+            elif char in "]}":
+                if char == "}" and self._depth == 2 and self._object_start is not None:
+                    self._complete(self._text[self._object_start:i + 1], completed)
+                    self._object_start = None
+                self._depth -= 1
+        self._scanned = len(self._text)
+        return completed
+
+    def _complete(self, raw, completed):
+        try:
+            question = question_from_json(json.loads(raw))
+        except ValueError:
+            question = None
+        if question is None:
+            self.invalid += 1
+        else:
+            self._parsed += 1
+            completed.append(question)
+
+    def close(self):
+        if self._parsed or self.invalid or not self._text.strip():
+            return []
+        self.fell_back = True
+        return parse_quiz(self._text)
+
+
+def parse_quiz_json(quiz_text):
+    """Parse a structured quiz response into a list of Question records (falling back to the text format)."""
+    parser = JsonQuizParser()
+    return parser.feed(quiz_text) + parser.close()
@@ -0,0 +1,59 @@
+import logging
+from abc import ABC, abstractmethod
+
+
+class Reporter(ABC):
+    """Where the core classes send user-facing errors and warnings.
+
+    YouTubeSummarizer and QuizGenerator never talk to a UI directly; the
+    Streamlit app passes a StreamlitReporter, everything else logs.
+    """
+
+    @abstractmethod
+    def error(self, message):
+        """Report an error to the user."""
+
+    @abstractmethod
+    def warning(self, message):
+        """Report a warning to the user."""
+
+
+class LoggingReporter(Reporter):
+    """Report through the `logging` module (batch CLI, scripts, background workers)."""
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger("youtube_summarizer")
+
+    def error(self, message):
+        self.logger.error(message)
+
+    def warning(self, message):
+        self.logger.warning(message)
+
+
+class StreamlitReporter(Reporter):
+    """Report on the current Streamlit page."""
+
+    def error(self, message):
+        import streamlit as st
+        st.error(message)
+
+    def warning(self, message):
+        import streamlit as st
+        st.warning(message)
+
+
+class RecordingReporter(LoggingReporter):
+    """Log and keep every message, so work done in the background can show them later (summary jobs)."""
+
+    def __init__(self, logger=None):
+        super().__init__(logger)
+        self.messages = []
+
+    def error(self, message):
+        super().error(message)
+        self.messages.append(("error", message))
+
+    def warning(self, message):
+        super().warning(message)
+        self.messages.append(("warning", message))
@@ -0,0 +1,129 @@
+"""Coalesce identical concurrent requests into one job ("single flight").
+
+The first caller for a key becomes the leader and does the work; callers
+arriving with the same key while it runs become followers and receive the
+leader's output: the streamed pieces as they are produced, then the result.
+Optionally, `process_lock` serializes the leaders of several processes on a
+lock file, so the second process runs after the first one and finds its
+results in the shared caches.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process coalescing
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class Flight:
+    """One in-flight job: the pieces it has streamed so far and, once done, its result.
+
+    `abandoned` is set if the leader stopped before finishing (its consumer went
+    away or it failed); followers then have to do the work themselves.
+    """
+
+    def __init__(self):
+        self.pieces = []
+        self.result = None
+        self.done = False
+        self.abandoned = False
+        self._condition = threading.Condition()
+
+    def publish(self, piece):
+        with self._condition:
+            self.pieces.append(piece)
+            self._condition.notify_all()
+
+    def finish(self, result=None, abandoned=False):
+        with self._condition:
+            self.result = result
+            self.abandoned = abandoned
+            self.done = True
+            self._condition.notify_all()
+
+    def follow(self):
+        """Yield every piece published so far and the ones to come, until the flight is done."""
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self.pieces) and not self.done:
+                    self._condition.wait()
+                pieces = self.pieces[index:]
+                done = self.done
+            index += len(pieces)
+            yield from pieces
+            if done and not pieces:
+                return
+
+    def wait(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self.done)
+
+
+class SingleFlight:
+    """Registry of the flights in progress in this process, by key."""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """Return (flight, is_leader) for a key, starting a new flight if none is in progress."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = Flight()
+            return flight, True
+
+    def land(self, key, flight):
+        """Forget a finished flight; callers arriving from now on start a new one."""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+
+@contextmanager
+def process_lock(name, lock_dir=None, timeout=None):
+    """Hold an exclusive lock on `name` across processes while the block runs.
+
+    Uses a lock file in SINGLE_FLIGHT_LOCK_DIR; does nothing when that is unset
+    or on platforms without fcntl. Gives up waiting after `timeout` seconds
+    (SINGLE_FLIGHT_LOCK_TIMEOUT) and runs unlocked rather than failing.
+    Yields True if the lock is held.
+    """
+    lock_dir = config.SINGLE_FLIGHT_LOCK_DIR if lock_dir is None else lock_dir
+    if not lock_dir or fcntl is None:
+        yield False
+        return
+
+    timeout = config.SINGLE_FLIGHT_LOCK_TIMEOUT if timeout is None else timeout
+    os.makedirs(lock_dir, exist_ok=True)
+    path = os.path.join(lock_dir, hashlib.sha256(name.encode("utf-8")).hexdigest()[:32] + ".lock")
+    deadline = time.monotonic() + timeout
+    with open(path, "a") as lock_file:
+        locked = False
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                locked = True
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    logger.warning("Gave up waiting for the lock on %s after %.0fs", name, timeout)
+                    break
+                time.sleep(0.2)
+        try:
+            yield locked
+        finally:
+            if locked:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
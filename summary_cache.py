@@ -0,0 +1,91 @@
+import hashlib
+import threading
+import time
+
+import config
+from sqlite_store import SQLiteStore
+
+
+def summary_cache_key(chunk, prompt_template, model_name):
+    """Content address of a chunk summary: hash of chunk text, prompt template and model name."""
+    digest = hashlib.sha256()
+    for part in (model_name, prompt_template, chunk):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class SummaryCache(SQLiteStore):
+    """Content-addressed store of per-chunk summaries.
+
+    Only chunks whose key is missing go to the model, so re-running a video or
+    resuming a run that failed halfway costs nothing for chunks already done.
+    Once more than `max_entries` summaries are stored, the least recently used
+    ones are evicted.
+    """
+
+    schema = (
+        """
+        CREATE TABLE IF NOT EXISTS chunk_summaries (
+            key TEXT PRIMARY KEY,
+            model_name TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_chunk_summaries_accessed ON chunk_summaries (accessed_at)",
+    )
+
+    def __init__(self, path=None, max_entries=None):
+        self.max_entries = config.SUMMARY_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        super().__init__(path or config.SUMMARY_CACHE_PATH)
+
+    def get(self, key):
+        """Return the cached summary for a key, or None, counting the hit or miss."""
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT summary FROM chunk_summaries WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE chunk_summaries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+
+        with self._stats_lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return row[0] if row else None
+
+    def put(self, key, model_name, summary):
+        """Store a chunk summary and evict the least recently used entries over the limit."""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO chunk_summaries VALUES (?, ?, ?, ?, ?)",
+                (key, model_name, summary, now, now),
+            )
+            conn.execute(
+                """
+                DELETE FROM chunk_summaries WHERE key IN (
+                    SELECT key FROM chunk_summaries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    def stats(self):
+        """Return hit/miss counters so we can check how many Gemini calls the cache saves."""
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self):
+        """Remove every cached summary."""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM chunk_summaries")
@@ -0,0 +1,89 @@
+import json
+import time
+
+import config
+from sqlite_store import SQLiteStore
+
+
+class TranscriptCache(SQLiteStore):
+    """On-disk SQLite store of raw transcript segments keyed by video ID and language.
+
+    Entries expire after `ttl` seconds and the least recently used entries are
+    evicted once the stored payload exceeds `max_bytes`. SQLite handles locking,
+    so the same file can be shared by every Streamlit session and process.
+    """
+
+    schema = (
+        """
+        CREATE TABLE IF NOT EXISTS transcripts (
+            video_id TEXT NOT NULL,
+            language TEXT NOT NULL,
+            segments TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            fetched_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            PRIMARY KEY (video_id, language)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_transcripts_accessed ON transcripts (accessed_at)",
+    )
+
+    def __init__(self, path=None, ttl=None, max_bytes=None):
+        self.ttl = config.TRANSCRIPT_CACHE_TTL if ttl is None else ttl
+        self.max_bytes = config.TRANSCRIPT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        super().__init__(path or config.TRANSCRIPT_CACHE_PATH)
+
+    def get(self, video_id, language):
+        """Return the cached segments for a video, or None if missing or expired."""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT segments, fetched_at FROM transcripts WHERE video_id = ? AND language = ?",
+                (video_id, language),
+            ).fetchone()
+            if row is None:
+                return None
+
+            segments, fetched_at = row
+            if self.ttl and now - fetched_at > self.ttl:
+                conn.execute("DELETE FROM transcripts WHERE video_id = ? AND language = ?", (video_id, language))
+                return None
+
+            conn.execute(
+                "UPDATE transcripts SET accessed_at = ? WHERE video_id = ? AND language = ?",
+                (now, video_id, language),
+            )
+        return json.loads(segments)
+
+    def put(self, video_id, language, segments):
+        """Store the raw timed segments for a video and evict old entries if over budget."""
+        payload = json.dumps(segments, ensure_ascii=False)
+        size = len(payload.encode("utf-8"))
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO transcripts VALUES (?, ?, ?, ?, ?, ?)",
+                (video_id, language, payload, size, now, now),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        """Drop expired entries, then least recently used ones until under the size limit."""
+        if self.ttl:
+            conn.execute("DELETE FROM transcripts WHERE fetched_at < ?", (time.time() - self.ttl,))
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM transcripts").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = conn.execute("SELECT video_id, language, size FROM transcripts ORDER BY accessed_at ASC").fetchall()
+        for video_id, language, size in rows:
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM transcripts WHERE video_id = ? AND language = ?", (video_id, language))
+            total -= size
+
+    def clear(self):
+        """Remove every cached transcript."""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM transcripts")
@@ -0,0 +1,123 @@
+"""Trim a transcript before it is chunked, so fewer tokens go to the model.
+
+Auto-generated captions carry a lot that says nothing about the content:
+non-speech tags such as `[Music]`, `>>` speaker markers, HTML entities, and
+"rolling" captions where each segment repeats the end of the previous one.
+`clean_segments` removes those, collapses phrases repeated back to back and,
+when TRANSCRIPT_DROP_FILLERS is on, drops filler words ("um", "uh"). Segment
+timings are kept, so chunks still end on pauses.
+"""
+import html
+import re
+import unicodedata
+from dataclasses import dataclass
+
+import config
+from chunker import estimate_tokens
+
+# Caption annotations for sounds rather than speech: [Music], [Applause], [ __ ] (censored word), (laughter)...
+NON_SPEECH_REGEX = re.compile(
+    r'\[[^\]]{0,40}\]'
+    r'|\((?:music|applause|laughter|laughs|laughing|inaudible|silence|cheering|cheers|sighs?|coughs?)\)'
+    r'|[♪♫♬]|>>+',
+    re.IGNORECASE,
+)
+FILLER_REGEX = re.compile(r'(?<![\w-])(?:u+m+|u+h+|e+rm+|er|hm+)(?![\w-])[,.]?\s*', re.IGNORECASE)
+WORD_REGEX = re.compile(r'\w+')
+
+# Longest run of words that is checked for repeats: caption overlaps and stutters like "so what we so what we"
+MAX_OVERLAP_WORDS = 30
+MAX_REPEAT_WORDS = 6
+
+
+@dataclass
+class CleanupStats:
+    """Size of a transcript before and after cleaning (estimated tokens and segment count)."""
+    tokens_before: int
+    tokens_after: int
+    segments_before: int
+    segments_after: int
+
+    @property
+    def saved_ratio(self):
+        return 1 - self.tokens_after / self.tokens_before if self.tokens_before else 0.0
+
+
+def normalize_caption(text):
+    """Unescape HTML entities, apply NFKC and collapse whitespace."""
+    return " ".join(unicodedata.normalize("NFKC", html.unescape(text)).split())
+
+
+def _key(word):
+    """Comparison form of a word: case and surrounding punctuation ignored."""
+    return "".join(WORD_REGEX.findall(word.lower()))
+
+
+def _overlap(tail, words):
+    """Number of leading `words` that repeat the end of `tail` (at least two, to ignore chance matches)."""
+    keys = [_key(word) for word in words[:MAX_OVERLAP_WORDS]]
+    for size in range(min(len(tail), len(keys)), 1, -1):
+        if tail[-size:] == keys[:size]:
+            return size
+    return 0
+
+
+def collapse_repeats(words):
+    """Drop phrases of 2 to MAX_REPEAT_WORDS words that are immediately repeated ("I think I think")."""
+    result = []
+    for word in words:
+        result.append(word)
+        for size in range(2, MAX_REPEAT_WORDS + 1):
+            if len(result) < 2 * size:
+                break
+            if [_key(w) for w in result[-size:]] == [_key(w) for w in result[-2 * size:-size]]:
+                del result[-size:]
+                break
+    return result
+
+
+def clean_text(text, drop_fillers=None):
+    """Clean one caption's text: normalization, non-speech tags and, optionally, filler words."""
+    drop_fillers = config.TRANSCRIPT_DROP_FILLERS if drop_fillers is None else drop_fillers
+    text = NON_SPEECH_REGEX.sub(" ", normalize_caption(text))
+    if drop_fillers:
+        text = FILLER_REGEX.sub("", text)
+    return " ".join(text.split())
+
+
+def clean_segments(segments, drop_fillers=None):
+    """Return cleaned copies of timed transcript segments (dicts with text, start and duration).
+
+    Segments left empty are dropped; the time they covered is added to the
+    previous segment.
+    """
+    cleaned = []
+    tail = []  # comparison keys of the last words kept
+    for segment in segments:
+        words = clean_text(segment["text"], drop_fillers).split()
+        words = words[_overlap(tail, words):]
+        words = collapse_repeats(words)
+        if not words:
+            if cleaned and segment.get("start") is not None and cleaned[-1].get("start") is not None:
+                end = segment["start"] + segment.get("duration", 0)
+                cleaned[-1]["duration"] = max(cleaned[-1].get("duration", 0), end - cleaned[-1]["start"])
+            continue
+
+        cleaned.append({**segment, "text": " ".join(words)})
+        tail = (tail + [_key(word) for word in words])[-MAX_OVERLAP_WORDS:]
+    return cleaned
+
+
+def clean_transcript(transcription, drop_fillers=None):
+    """Clean a transcript (timed segments or a plain string); returns (cleaned transcript, CleanupStats)."""
+    if isinstance(transcription, str):
+        before = transcription
+        cleaned = " ".join(collapse_repeats(clean_text(transcription, drop_fillers).split()))
+        after = cleaned
+        segments_before = segments_after = 1
+    else:
+        before = " ".join(segment["text"] for segment in transcription)
+        cleaned = clean_segments(transcription, drop_fillers)
+        after = " ".join(segment["text"] for segment in cleaned)
+        segments_before, segments_after = len(transcription), len(cleaned)
+    return cleaned, CleanupStats(estimate_tokens(before), estimate_tokens(after), segments_before, segments_after)
@@ -0,0 +1,215 @@
+"""Transcript of a video shared as context by the summary and quiz calls about it.
+
+The cleaned transcript of each summarized video that is long enough for Gemini
+context caching (CONTEXT_CACHE_MIN_TOKENS, the model's minimum) is kept in a
+SQLite store, uploaded once as cached content and referenced by name; the
+server bills the cached tokens at a reduced rate.
+
+Shorter transcripts are not given to the quiz calls: sent inline they would
+be billed in full on every call, on top of the summary (the API does no
+implicit prefix caching for these models). A single-shot summary still sends
+its transcript inline, as the one call that needs it anyway.
+"""
+import logging
+import re
+import time
+from dataclasses import dataclass
+
+import config
+from chunker import estimate_tokens
+from instrumentation import count_cache
+from llm_client import TransportError
+from singleflight import SingleFlight
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+# The transcript as it starts the prompt when it is sent inline
+CONTEXT_PREFIX_TEMPLATE = """
+            Transcript of the video:
+            \n\n{transcript}\n\n
+            """
+
+# How the API reports cached content that no longer exists: 404 NOT_FOUND, or a 400/403 naming the cached content
+# ("CachedContent not found (or permission denied)")
+CACHE_GONE_REGEX = re.compile(r"NOT_FOUND|cached[ _]?content", re.IGNORECASE)
+
+# Cached content that expires within this many seconds is not handed out any more (seconds)
+CACHE_EXPIRY_MARGIN = 120
+
+
+def context_missing(error):
+    """True if a call failed because the cached content it referenced is gone (expired or deleted).
+
+    Other bad requests leave the cache alone: it still exists on the server (and is billed).
+    """
+    cause = error if isinstance(error, TransportError) else error.__cause__
+    if not isinstance(cause, TransportError):
+        return False
+    return cause.status == 404 or (cause.status in (400, 403) and bool(CACHE_GONE_REGEX.search(str(cause))))
+
+
+@dataclass
+class TranscriptContext:
+    """The transcript of a video as used by one call: cached on the server (`cache_name`) or sent inline."""
+    video_id: str
+    text: str
+    tokens: int
+    cache_name: str = None
+
+    def prompt(self, task):
+        """The prompt for `task` with this context: the task alone when cached, after the transcript otherwise."""
+        if self.cache_name:
+            return task
+        return CONTEXT_PREFIX_TEMPLATE.format(transcript=self.text) + task
+
+    def request_options(self):
+        """Extra generate_content arguments that attach the cached content."""
+        return {"cached_content": self.cache_name} if self.cache_name else {}
+
+
+class ContextStore(SQLiteStore):
+    """Cleaned transcripts by video ID, and the cached contents made from them by model."""
+
+    schema = (
+        """
+        CREATE TABLE IF NOT EXISTS transcripts (
+            video_id TEXT PRIMARY KEY,
+            text TEXT NOT NULL,
+            tokens INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_transcripts_updated ON transcripts (updated_at)",
+        """
+        CREATE TABLE IF NOT EXISTS cached_contents (
+            video_id TEXT NOT NULL,
+            model TEXT NOT NULL,
+            name TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (video_id, model)
+        )
+        """,
+    )
+
+    def __init__(self, path=None, retention=None):
+        # Transcripts are kept as long as the raw ones in the transcript cache
+        self.retention = config.TRANSCRIPT_CACHE_TTL if retention is None else retention
+        super().__init__(path or config.CONTEXT_STORE_PATH)
+
+    def put(self, video_id, text, tokens):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            changed = conn.execute(
+                "SELECT 1 FROM transcripts WHERE video_id = ? AND text != ?", (video_id, text)
+            ).fetchone()
+            if changed:
+                # Cached contents of the previous text must not be used with the new one
+                conn.execute("DELETE FROM cached_contents WHERE video_id = ?", (video_id,))
+            conn.execute("INSERT OR REPLACE INTO transcripts VALUES (?, ?, ?, ?)", (video_id, text, tokens, now))
+            if self.retention:
+                conn.execute("DELETE FROM transcripts WHERE updated_at < ?", (now - self.retention,))
+            conn.execute("DELETE FROM cached_contents WHERE expires_at < ?", (now,))
+
+    def get(self, video_id):
+        """Return (text, tokens) of a video's transcript, or None."""
+        with self._lock, self._connect() as conn:
+            return conn.execute("SELECT text, tokens FROM transcripts WHERE video_id = ?", (video_id,)).fetchone()
+
+    def cache_name(self, video_id, model):
+        """Name of the cached content of a video's transcript for a model, unless it is about to expire."""
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT name FROM cached_contents WHERE video_id = ? AND model = ? AND expires_at > ?",
+                (video_id, model, time.time() + CACHE_EXPIRY_MARGIN),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_cache(self, video_id, model, name, expires_at):
+        with self._lock, self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO cached_contents VALUES (?, ?, ?, ?)",
+                         (video_id, model, name, expires_at))
+
+    def forget_cache(self, video_id, model, name):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM cached_contents WHERE video_id = ? AND model = ? AND name = ?",
+                         (video_id, model, name))
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM cached_contents")
+            conn.execute("DELETE FROM transcripts")
+
+
+class TranscriptContexts:
+    """Hands out the TranscriptContext of a video for a model, creating its cached content on first use.
+
+    Concurrent requests for the same video and model create the cached
+    content once. If it can't be created, the calls go without it.
+    """
+
+    def __init__(self, store=None, cache_min_tokens=None, cache_ttl=None):
+        self.store = store or ContextStore()
+        self.cache_min_tokens = config.CONTEXT_CACHE_MIN_TOKENS if cache_min_tokens is None else cache_min_tokens
+        self.cache_ttl = config.CONTEXT_CACHE_TTL if cache_ttl is None else cache_ttl
+        self._flights = SingleFlight()
+
+    def cacheable(self, tokens):
+        return bool(self.cache_min_tokens) and tokens >= self.cache_min_tokens
+
+    def remember(self, video_id, text, tokens=None):
+        """Keep the cleaned transcript of a video for the calls that follow; returns whether it can be cached."""
+        tokens = estimate_tokens(text) if tokens is None else tokens
+        if not self.cacheable(tokens):
+            return False
+        self.store.put(video_id, text, tokens)
+        return True
+
+    def context(self, video_id, model):
+        """The cached TranscriptContext of a video for calls to `model`, or None if there is none."""
+        stored = self.store.get(video_id)
+        count_cache("transcript_context", stored is not None)
+        if stored is None:
+            return None
+        text, tokens = stored
+        if not self.cacheable(tokens):
+            return None
+        name = self.cached_content(video_id, model, text)
+        return TranscriptContext(video_id, text, tokens, name) if name else None
+
+    def cached_content(self, video_id, model, text):
+        """Name of the cached content of the transcript for `model`, created on first use; None if unavailable."""
+        model_name = getattr(model, "model_name", None) or "unknown"
+        name = self.store.cache_name(video_id, model_name)
+        count_cache("context_cache", name is not None)
+        if name is not None:
+            return name
+
+        key = (video_id, model_name)
+        flight, leader = self._flights.join(key)
+        if not leader:
+            flight.wait()
+            return flight.result
+        name = None
+        try:
+            # Another process may have created it in the meantime
+            name = self.store.cache_name(video_id, model_name) or self._create(video_id, model, model_name, text)
+        finally:
+            flight.finish(name)
+            self._flights.land(key, flight)
+        return name
+
+    def _create(self, video_id, model, model_name, text):
+        try:
+            name = model.cache_context(text, self.cache_ttl)
+        except Exception as e:
+            logger.warning("Could not cache the transcript of %s for %s: %s", video_id, model_name, e)
+            return None
+        if name:
+            self.store.put_cache(video_id, model_name, name, time.time() + self.cache_ttl)
+        return name
+
+    def drop_cache(self, context, model):
+        """Forget a cached content the server no longer has."""
+        model_name = getattr(model, "model_name", None) or "unknown"
+        self.store.forget_cache(context.video_id, model_name, context.cache_name)
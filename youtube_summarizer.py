@@ -1,141 +1,708 @@
-import re
-import google.generativeai as genai
-from youtube_transcript_api import YouTubeTranscriptApi
-import streamlit as st
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
-from urllib.parse import urlparse
+import hashlib
+import logging
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import config
+from llm_backends import create_backend
+from llm_client import SafetyBlockedError, TransportError
+from reporting import LoggingReporter
+from transcript_cache import TranscriptCache
+from summary_cache import SummaryCache, summary_cache_key
+from chunk_index import ChunkIndex, find_repeats, minhash, sketch
+from chunker import estimate_tokens, iter_transcript_chunks
+from transcript_cleaner import clean_transcript
+from singleflight import SingleFlight, process_lock
+from transcript_context import CONTEXT_PREFIX_TEMPLATE, TranscriptContext, TranscriptContexts, context_missing
+from instrumentation import count_avoided, count_cache, finish_llm_call, observe, span
 
-# Load environment variables from the .env file
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-# Get the API key from the environment variable
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-# Check if the API key exists and configure the Gemini API
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-else:
-    st.error("Gemini API key is missing. Please set the GEMINI_API_KEY in your environment variables.")
+# Enhanced prompt to distinguish between math and conceptual videos
+SUMMARY_PROMPT_TEMPLATE = """
+            Based on the content in the following transcript, summarize appropriately, keeping in mind the type of content:
+            
+            1. **For conceptual content**:
+            - Clearly explain the key concepts and ideas.
+            - Emphasize important points, definitions, and their relationships.
+            - Ensure the summary is structured logically and easy to follow for someone new to the topic.
+
+            2. **For mathematical content**:
+            - Include all the relevant equations and steps used to solve problems.
+            - For each equation, break down the steps and explain the logic behind them.
+            - Provide a clear explanation of how to approach similar problems, focusing on why specific operations are used.
+            - Highlight any formulas or rules that are critical to understanding the solution.
+            
+            3. Make the content realistic with a proper flow and summary.
+
+            Transcript:
+            \n\n{chunk}
+            """
+
+
+# Single-call summary of a whole transcript, which is the context of the call (see transcript_context)
+SINGLE_SHOT_PROMPT_TEMPLATE = SUMMARY_PROMPT_TEMPLATE[:SUMMARY_PROMPT_TEMPLATE.index("Transcript:")].replace(
+    "in the following transcript", "in the transcript above")
+
+
+# Prompt used to merge a group of summaries into one during the hierarchical reduce stage
+REDUCE_PROMPT_TEMPLATE = """
+            The following are consecutive partial summaries of one video. Merge them into a single, shorter summary:
+            
+            - Keep the key concepts, definitions and their relationships.
+            - Keep all relevant equations and the steps used to solve problems.
+            - Remove repetition between the parts and keep the original order of topics.
+
+            Partial summaries:
+            \n\n{chunk}
+            """
+
+
+# Part of the single-flight key: requests made with different prompts must not share a result
+PROMPT_VERSION = hashlib.sha256((SUMMARY_PROMPT_TEMPLATE + REDUCE_PROMPT_TEMPLATE + SINGLE_SHOT_PROMPT_TEMPLATE
+                                 + CONTEXT_PREFIX_TEMPLATE).encode("utf-8")).hexdigest()[:12]
+
+# Summaries in progress in this process, shared by every summarizer so identical requests run once
+SUMMARY_FLIGHTS = SingleFlight()
+
+
+# Marks the end of one chunk's stream of text pieces in stream_summary
+_CHUNK_DONE = object()
+
+
+@dataclass
+class SummaryResult:
+    """Summary of a video plus every level of the hierarchy it was reduced from.
+
+    `levels[0]` holds the per-chunk summaries and `levels[-1]` the top level, whose
+    joined text is `summary` and stays within `SUMMARY_TARGET_TOKENS`.
+    """
+    summary: str = ""
+    levels: list = field(default_factory=list)
+    failed_chunks: int = 0
+    time_to_first_token: float = None  # seconds, only set by stream_summary
+    total_time: float = None  # seconds
+    chunks_total: int = 0  # progress of stream_summary, updated as each chunk's text is complete
+    chunks_done: int = 0
+    transcript_tokens: int = None  # estimated tokens of the transcript before and after preprocessing
+    cleaned_tokens: int = None
+    calls_avoided: int = 0  # chunks not sent to the model because they were near duplicates
+    single_shot: bool = False  # summarized in one call with the whole transcript
+
+
+def list_transcripts(video_id, http_client=None):
+    """The youtube_transcript_api TranscriptList of a video, over `http_client` (a `requests.Session`) if given.
+
+    The library has no public way to pass a session, so the pooled path goes through its private
+    TranscriptListFetcher (present in the pinned 0.6.2); if that is gone or has changed, the public
+    list_transcripts is used instead, with the session's proxies and without its connection pool.
+    """
+    # Imported here: the transcript API is only needed when the transcript cache misses
+    from youtube_transcript_api import YouTubeTranscriptApi
+
+    if http_client is not None:
+        try:
+            from youtube_transcript_api._transcripts import TranscriptListFetcher
+            fetcher = TranscriptListFetcher(http_client)
+        except (ImportError, TypeError):
+            logger.debug("TranscriptListFetcher unavailable; fetching transcripts without the shared session")
+        else:
+            return fetcher.fetch(video_id)
+    return YouTubeTranscriptApi.list_transcripts(video_id, proxies=getattr(http_client, "proxies", None) or None)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut `text` to at most `max_tokens` estimated tokens, at a paragraph or sentence end when one is close."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    cut = text[:max_tokens * 4]
+    for boundary in ("\n\n", ". ", "\n"):
+        end = cut.rfind(boundary)
+        if end >= len(cut) * 0.8:
+            return cut[:end + 1].rstrip()
+    return cut.rstrip()
+
+
+class ResponseError(Exception):
+    """Raised when the model returns no usable text (request error, empty or blocked response)."""
 
 
 class YouTubeSummarizer:
-    def __init__(self):
-        self.model = self.initialize_model()
+    def __init__(self, transcript_cache=None, summary_cache=None, max_concurrency=None, reporter=None, model=None,
+                 flights=None, chunk_index=None, contexts=None):
+        self.reporter = reporter or LoggingReporter()
+        self.model = model or self.initialize_model(config.SUMMARY_MODEL)
+        self.model_name = self.model.model_name if self.model else config.SUMMARY_MODEL
+        self.transcript_cache = transcript_cache or TranscriptCache()
+        self.summary_cache = summary_cache or SummaryCache()
+        self.max_concurrency = max(1, max_concurrency or config.SUMMARY_CONCURRENCY)
+        self.flights = flights or SUMMARY_FLIGHTS
+        if chunk_index is None and config.NEAR_DUPLICATE_THRESHOLD:
+            chunk_index = ChunkIndex()
+        self.chunk_index = chunk_index
+        # Near duplicates may only reuse summaries made by the same model with the same prompts
+        self.index_scope = f"{self.model_name}:{PROMPT_VERSION}"
+        # Transcripts kept for the quiz calls of each video (see transcript_context)
+        if contexts is None and config.CONTEXT_REUSE:
+            contexts = TranscriptContexts()
+        self.contexts = contexts
 
-    def initialize_model(self, model_name="gemini-1.5-flash-001"):
-        """Initialize the Gemini model."""
+    def initialize_model(self, model_name=config.SUMMARY_MODEL):
+        """Initialize the model backend selected by LLM_BACKEND."""
         try:
-            model = genai.GenerativeModel(model_name)
+            model = create_backend(model_name)
             return model
         except Exception as e:
-            st.error(f"Error initializing the model: {e}")
+            self.reporter.error(f"Error initializing the model: {e}")
             return None
 
     def get_video_id(self, url):
-        """Extract the video ID from the YouTube URL."""
-        video_id = url.split("v=")[1]
+        """Extract the video ID from the YouTube URL (watch or youtu.be link, or a bare video ID)."""
+        if "v=" in url:
+            video_id = url.split("v=")[1]
+        elif "youtu.be/" in url:
+            video_id = url.split("youtu.be/")[1].split("?")[0]
+        else:
+            video_id = url.strip()
         if "&" in video_id:
             video_id = video_id.split("&")[0]
 
         return video_id
 
+    def get_transcript_segments(self, video_id, language=None, http_client=None):
+        """Fetch the raw timed transcript segments, serving repeat videos from the local cache.
+
+        Pass a `requests.Session` as `http_client` to reuse its pooled connections across videos.
+        """
+        language = language or config.TRANSCRIPT_LANGUAGE
+        segments = self.transcript_cache.get(video_id, language)
+        count_cache("transcript", segments is not None)
+        if segments is not None:
+            return segments
+
+        try:
+            with span("transcript_fetch", video_id=video_id) as current:
+                segments = list_transcripts(video_id, http_client).find_transcript([language]).fetch()
+                current.set(segments=len(segments))
+        except Exception as e:
+            self.reporter.error(f"Error fetching transcript: {e}")
+            return None
+
+        try:
+            self.transcript_cache.put(video_id, language, segments)
+        except Exception as e:
+            # A broken cache should never stop the summary from being generated
+            self.reporter.warning(f"Could not cache transcript: {e}")
+        return segments
+
     def get_video_transcripts(self, video_id):
         """Fetch the transcript of a YouTube video."""
+        transcript_list = self.get_transcript_segments(video_id)
+        if transcript_list is None:
+            return None
+        transcription = " ".join([transcript['text'] for transcript in transcript_list])
+        return transcription
+
+    def summarize_chunk(self, chunk, prompt_template=SUMMARY_PROMPT_TEMPLATE, on_text=None, index=None,
+                        context=None):
+        """Summarize a single chunk, reusing the cached summary when the same chunk was seen before.
+
+        If `on_text` is given the response is streamed and each piece of text is passed to it.
+        `index` is the position of the chunk, used to tag its metrics. With a TranscriptContext
+        (single-shot summaries) the chunk is the whole transcript and is sent as that context.
+        Raises ResponseError if the model returns no usable text after the configured retries.
+        """
+        purpose = "reduce" if prompt_template is REDUCE_PROMPT_TEMPLATE else "summary"
+        with span("summarize_chunk", chunk=index, purpose=purpose) as current:
+            key = summary_cache_key(chunk, prompt_template, self.model_name)
+            cached = self.summary_cache.get(key)
+            count_cache("summary", cached is not None)
+            current.set(cached=cached is not None)
+            if cached is not None:
+                if on_text:
+                    on_text(cached)
+                return cached
+
+            emitted = []
+
+            def emit(text):
+                emitted.append(text)
+                on_text(text)
+
+            attempts = 1 + config.SUMMARY_CHUNK_RETRIES
+            for attempt in range(attempts):
+                if context is not None:
+                    prompt, options = context.prompt(prompt_template), context.request_options()
+                else:
+                    prompt, options = prompt_template.format(chunk=chunk), {}
+                try:
+                    if on_text:
+                        chunk_summary = self.stream_text(self.model, prompt, emit, **options)
+                    else:
+                        chunk_summary = self.generate_text(self.model, prompt, **options)
+                    break
+                except ResponseError as e:
+                    # Text already shown to the user can't be taken back, so a broken stream is not retried
+                    if attempt == attempts - 1 or emitted:
+                        raise
+                    if context is not None and context.cache_name and context_missing(e):
+                        # The cached transcript expired early: send it with the prompt instead
+                        if self.contexts is not None:
+                            self.contexts.drop_cache(context, self.model)
+                        context = TranscriptContext(context.video_id, context.text, context.tokens)
+                    elif isinstance(e.__cause__, TransportError):
+                        # Already retried by the model client (LLM_MAX_RETRIES)
+                        raise
+
+            # Only successful summaries are cached so a failed chunk is retried on the next run
+            self.summary_cache.put(key, self.model_name, chunk_summary)
+            if self.chunk_index is not None and purpose == "summary":
+                self.chunk_index.add(key, minhash(chunk), self.index_scope)
+            return chunk_summary
+
+    def deduplicate_chunks(self, chunks, prompt_template=SUMMARY_PROMPT_TEMPLATE):
+        """Find the chunks of a video that need no model call; returns a dict of index to summary.
+
+        A chunk that nearly repeats an earlier chunk of the same video (a recap,
+        a second sponsor read) maps to None and is skipped. A chunk that nearly
+        duplicates one summarized before, in any video, maps to that summary.
+        """
+        known = {}
+        if self.chunk_index is None or not chunks:
+            return known
+
+        with span("deduplicate", chunks=len(chunks)) as current:
+            sketches = [sketch(chunk) for chunk in chunks]
+            repeats = find_repeats(sketches)
+            reused = 0
+            for index, (chunk, (signature, _)) in enumerate(zip(chunks, sketches)):
+                if index in repeats:
+                    known[index] = None
+                    continue
+                key = summary_cache_key(chunk, prompt_template, self.model_name)
+                if self.chunk_index.contains(key):
+                    continue  # summarized before: an exact summary cache hit
+                match = self.chunk_index.find(signature, self.index_scope)
+                if match is None:
+                    continue
+                summary = self.summary_cache.get(match[0])
+                if summary is None:
+                    self.chunk_index.remove(match[0])  # evicted from the summary cache
+                    continue
+                # Stored under this chunk's key too, so the next run is an exact hit
+                self.summary_cache.put(key, self.model_name, summary)
+                self.chunk_index.add(key, signature, self.index_scope)
+                known[index] = summary
+                reused += 1
+            current.set(repeats=len(repeats), reused=reused)
+
+        count_avoided("repeat", len(repeats))
+        count_avoided("reuse", reused)
+        return known
+
+    def summarize_chunks(self, chunks, prompt_template=SUMMARY_PROMPT_TEMPLATE, known=None, context=None):
+        """Summarize chunks in parallel with at most `max_concurrency` requests in flight.
+
+        Returns the summaries in the original chunk order (None for chunks that failed)
+        and a dict mapping the index of each failed chunk to its error. Chunks in
+        `known` (index to summary, see deduplicate_chunks) are not sent to the model.
+        """
+        known = known or {}
+        summaries = [known.get(index) for index in range(len(chunks))]
+        failures = {}
+        pending = [index for index in range(len(chunks)) if index not in known]
+        if not pending:
+            return summaries, failures
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(pending))) as executor:
+            futures = {index: executor.submit(self.summarize_chunk, chunks[index], prompt_template, None, index,
+                                              context)
+                       for index in pending}
+            for index, future in futures.items():
+                try:
+                    summaries[index] = future.result()
+                except Exception as e:
+                    failures[index] = e
+        return summaries, failures
+
+    def reduce_summaries(self, summaries):
+        """Summarize groups of summaries, then groups of those, until the result fits SUMMARY_TARGET_TOKENS.
+
+        Returns the list of levels produced above `summaries` (empty if they already fit). If the
+        levels run out or stop shrinking first, a last level is forced within the budget (bound_summary).
+        """
+        levels = []
+        current = summaries
+        for _ in range(config.REDUCE_MAX_LEVELS):
+            if estimate_tokens("\n\n".join(current)) <= config.SUMMARY_TARGET_TOKENS:
+                break
+
+            groups = ["\n\n".join(current[i:i + config.REDUCE_GROUP_SIZE])
+                      for i in range(0, len(current), config.REDUCE_GROUP_SIZE)]
+            merged, failures = self.summarize_chunks(groups, REDUCE_PROMPT_TEMPLATE)
+            for index in failures:
+                self.reporter.warning(f"Could not condense summary group {index + 1} of {len(groups)}; keeping it as is.")
+                merged[index] = groups[index]
+
+            levels.append(merged)
+            # Stop when a round no longer shrinks the summary, e.g. when every group failed
+            if estimate_tokens("\n\n".join(merged)) >= estimate_tokens("\n\n".join(current)):
+                break
+            current = merged
+
+        top = levels[-1] if levels else summaries
+        if estimate_tokens("\n\n".join(top)) > config.SUMMARY_TARGET_TOKENS:
+            levels.append(self.bound_summary(top))
+        return levels
+
+    def bound_summary(self, summaries):
+        """Merge summaries in a single reduce call and cut the result to SUMMARY_TARGET_TOKENS if still over.
+
+        The final summary is the quiz prompt's input, so it must stay within the budget whatever the model does.
+        """
+        text = "\n\n".join(summaries)
         try:
-            transcript_list = YouTubeTranscriptApi.get_transcript(video_id)
-            transcription = " ".join([transcript['text'] for transcript in transcript_list])
-            return transcription
+            merged = self.summarize_chunk(text, REDUCE_PROMPT_TEMPLATE)
         except Exception as e:
-            st.error(f"Error fetching transcript: {e}")
-            return None
+            logger.warning("Could not merge the summary into one (%s); cutting it to size", e)
+            merged = text
+        if estimate_tokens(merged) > config.SUMMARY_TARGET_TOKENS:
+            self.reporter.warning("The summary was too long and has been shortened.")
+            merged = truncate_to_tokens(merged, config.SUMMARY_TARGET_TOKENS)
+        return [merged]
+
+    def summarize_transcript(self, transcription, video_id=None):
+        """Summarize the transcription chunk by chunk, then reduce the chunk summaries to a bounded size.
 
-    def chunk_text(self, text, max_length):
-        """Split the text into chunks of a specified length."""
-        words = text.split()
-        chunks = []
-        for i in range(0, len(words), max_length):
-            chunk = " ".join(words[i:i + max_length])
-            chunks.append(chunk)
+        `transcription` is either the list of timed transcript segments or a plain string.
+        A short transcript is summarized in a single call instead (see plan_summary).
+        """
+        started = time.perf_counter()
+        result = SummaryResult()
+        transcription = self.preprocess_transcript(transcription, result)
+        transcription_chunks, prompt_template, context = self.plan_summary(transcription, video_id)
+        result.single_shot = prompt_template is SINGLE_SHOT_PROMPT_TEMPLATE
+        known = self.deduplicate_chunks(transcription_chunks, prompt_template)
+        result.calls_avoided = len(known)
+        summaries, failures = self.summarize_chunks(transcription_chunks, prompt_template, known, context)
+
+        self._finish_result(result, summaries, failures, started)
+        return result
+
+    def flight_key(self, video_id, language=None):
+        """Requests with the same key produce the same summary and are coalesced."""
+        return (video_id, language or config.TRANSCRIPT_LANGUAGE, self.model_name, PROMPT_VERSION)
+
+    def stream_summary(self, url, result=None):
+        """Yield the chunk summaries of a YouTube video piece by piece as the model streams them.
+
+        Chunks are still summarized concurrently, but their text is yielded in
+        chunk order. Once the generator is exhausted, `result` (a SummaryResult)
+        holds the reduced summary, its levels and the time-to-first-token and
+        total time of the run. Concurrent requests for the same video share
+        one run: the later ones replay its text as it is produced.
+        """
+        result = result if result is not None else SummaryResult()
+        video_id = self.get_video_id(url)
+        key = self.flight_key(video_id)
+        flight, leader = self.flights.join(key)
+        count_cache("single_flight", not leader)
+
+        if not leader:
+            started = time.perf_counter()
+            shown = 0
+            for text in flight.follow():
+                if result.time_to_first_token is None:
+                    result.time_to_first_token = time.perf_counter() - started
+                shown += len(text)
+                yield text
+            if not flight.abandoned:
+                self._follow_result(flight.result, result, started)
+                return
+
+            # The run we followed was cut short; do it ourselves (its finished chunks are cached by
+            # now) and only yield what goes beyond the text already shown
+            first_token = result.time_to_first_token
+            for text in self._stream_video(video_id, result):
+                if shown >= len(text):
+                    shown -= len(text)
+                    continue
+                yield text[shown:]
+                shown = 0
+            result.time_to_first_token = first_token
+            return
+
+        completed = False
+        try:
+            with process_lock(repr(key)):
+                for text in self._stream_video(video_id, result):
+                    flight.publish(text)
+                    yield text
+            completed = True
+        finally:
+            flight.finish(result if completed else None, abandoned=not completed)
+            self.flights.land(key, flight)
+
+    def _stream_video(self, video_id, result):
+        """The work behind stream_summary, without coalescing."""
+        started = time.perf_counter()
+        transcription = self.get_transcript_segments(video_id)
+        if not transcription:
+            return
+
+        transcription = self.preprocess_transcript(transcription, result)
+        transcription_chunks, prompt_template, context = self.plan_summary(transcription, video_id)
+        result.single_shot = prompt_template is SINGLE_SHOT_PROMPT_TEMPLATE
+        result.chunks_total = len(transcription_chunks)
+        known = self.deduplicate_chunks(transcription_chunks, prompt_template)
+        result.calls_avoided = len(known)
+        pieces = [queue.Queue() for _ in transcription_chunks]
+        summaries = [known.get(index) for index in range(len(transcription_chunks))]
+        failures = {}
+        for index, summary in known.items():
+            if summary:
+                pieces[index].put(summary)
+            pieces[index].put(_CHUNK_DONE)
+        pending = [index for index in range(len(transcription_chunks)) if index not in known]
+
+        def work(index):
+            try:
+                summaries[index] = self.summarize_chunk(transcription_chunks[index], prompt_template,
+                                                       on_text=pieces[index].put, index=index, context=context)
+            except Exception as e:
+                failures[index] = e
+            finally:
+                pieces[index].put(_CHUNK_DONE)
+
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(pending))))
+        try:
+            for index in pending:
+                executor.submit(work, index)
+
+            for index, chunk_pieces in enumerate(pieces):
+                for text in iter(chunk_pieces.get, _CHUNK_DONE):
+                    if result.time_to_first_token is None:
+                        result.time_to_first_token = time.perf_counter() - started
+                    yield text
+                result.chunks_done = index + 1
+                if summaries[index]:
+                    yield "\n\n"
+        finally:
+            # Stop queued chunks if the consumer goes away before the end
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        self._finish_result(result, summaries, failures, started)
+
+    def _follow_result(self, shared, result, started):
+        """Fill in `result` from the result of a run this request was coalesced into."""
+        if shared is None or not shared.summary:
+            self.reporter.error("No summary could be generated for this video.")
+            return
+        # Copies, so sessions sharing a run never share mutable state
+        result.summary = shared.summary
+        result.levels = [list(level) for level in shared.levels]
+        result.failed_chunks = shared.failed_chunks
+        result.chunks_total = result.chunks_done = shared.chunks_total
+        result.transcript_tokens, result.cleaned_tokens = shared.transcript_tokens, shared.cleaned_tokens
+        result.calls_avoided = shared.calls_avoided
+        result.single_shot = shared.single_shot
+        result.total_time = time.perf_counter() - started
+        if result.failed_chunks:
+            self.reporter.warning(f"{result.failed_chunks} part(s) of the video could not be summarized and were skipped.")
+
+    def preprocess_transcript(self, transcription, result=None):
+        """Strip what costs tokens without carrying content (see transcript_cleaner) unless TRANSCRIPT_PREPROCESS is off.
+
+        The estimated token counts before and after are logged and stored in `result`.
+        """
+        if not config.TRANSCRIPT_PREPROCESS:
+            return transcription
+        with span("preprocess") as current:
+            cleaned, stats = clean_transcript(transcription)
+            current.set(tokens_before=stats.tokens_before, tokens_after=stats.tokens_after,
+                        segments_before=stats.segments_before, segments_after=stats.segments_after)
+        logger.info("transcript preprocessing: %d -> %d tokens (-%.0f%%), %d -> %d segments",
+                    stats.tokens_before, stats.tokens_after, stats.saved_ratio * 100, stats.segments_before,
+                    stats.segments_after)
+        if result is not None:
+            result.transcript_tokens, result.cleaned_tokens = stats.tokens_before, stats.tokens_after
+        return cleaned
+
+    def plan_summary(self, transcription, video_id=None):
+        """Split the transcription for summarization; returns (chunks, prompt template, TranscriptContext or None).
+
+        A transcript of at most SINGLE_SHOT_MAX_TOKENS is summarized in a single call with the
+        transcript as the context of the call, cached on the server when it is long enough.
+        With a `video_id` the transcript is also kept for the quiz calls of the video.
+        """
+        if isinstance(transcription, str):
+            text = transcription
+        else:
+            text = " ".join(segment["text"] for segment in transcription)
+        tokens = estimate_tokens(text)
+        stored = False
+        if video_id and self.contexts is not None:
+            try:
+                stored = self.contexts.remember(video_id, text, tokens)
+            except Exception as e:
+                # The quiz is then generated from the summary alone
+                logger.warning("Could not store the transcript of %s: %s", video_id, e)
+
+        if not config.SINGLE_SHOT_MAX_TOKENS or tokens > config.SINGLE_SHOT_MAX_TOKENS:
+            return self.chunk_transcript(transcription), SUMMARY_PROMPT_TEMPLATE, None
+        context = self.contexts.context(video_id, self.model) if stored else None
+        return [text], SINGLE_SHOT_PROMPT_TEMPLATE, context or TranscriptContext(video_id, text, tokens)
+
+    def chunk_transcript(self, transcription):
+        """Return the text of each chunk of the transcription."""
+        with span("chunking") as current:
+            chunks = [chunk.text for chunk in iter_transcript_chunks(transcription)]
+            current.set(chunks=len(chunks))
         return chunks
 
+    def _finish_result(self, result, summaries, failures, started):
+        """Report failed chunks, run the reduce stage and fill in `result`."""
+        # Failures are reported from the calling thread, where the UI context lives
+        for index, error in sorted(failures.items()):
+            self.reporter.warning(f"Part {index + 1} of {len(summaries)} could not be summarized and was skipped: {error}")
+
+        result.failed_chunks = len(failures)
+        chunk_summaries = [chunk_summary for chunk_summary in summaries if chunk_summary]
+        if chunk_summaries:
+            with span("reduce", summaries=len(chunk_summaries)):
+                result.levels = [chunk_summaries] + self.reduce_summaries(chunk_summaries)
+            result.summary = "\n\n".join(result.levels[-1])
+
+        result.total_time = time.perf_counter() - started
+        observe("summary_total", result.total_time, chunks=len(summaries), failed_chunks=result.failed_chunks,
+                transcript_tokens=result.transcript_tokens, cleaned_tokens=result.cleaned_tokens,
+                calls_avoided=result.calls_avoided, single_shot=result.single_shot)
+        logger.info(
+            "summary run: chunks=%d single_shot=%s failed=%d near_duplicates=%d levels=%d time_to_first_token=%s "
+            "total_time=%.2fs",
+            len(summaries), result.single_shot, result.failed_chunks, result.calls_avoided, len(result.levels),
+            f"{result.time_to_first_token:.2f}s" if result.time_to_first_token is not None else "n/a",
+            result.total_time,
+        )
+
     def get_chunked_summary(self, transcription):
         """Summarize the transcription in chunks using the model, emphasizing equations, key points, and clear steps."""
-        max_chunk_size = 500
-        transcription_chunks = self.chunk_text(transcription, max_chunk_size)
-        final_summary = ""
+        return self.summarize_transcript(transcription).summary
 
-        # Enhanced prompt to distinguish between math and conceptual videos
-        for chunk in transcription_chunks:
-            prompt = f"""
-            Based on the content in the following transcript, summarize appropriately, keeping in mind the type of content:
-            
-            1. **For conceptual content**:
-            - Clearly explain the key concepts and ideas.
-            - Emphasize important points, definitions, and their relationships.
-            - Ensure the summary is structured logically and easy to follow for someone new to the topic.
+    def generate_text(self, model, prompt, **options):
+        """Generate response text from the model, raising ResponseError if it is empty or blocked.
 
-            2. **For mathematical content**:
-            - Include all the relevant equations and steps used to solve problems.
-            - For each equation, break down the steps and explain the logic behind them.
-            - Provide a clear explanation of how to approach similar problems, focusing on why specific operations are used.
-            - Highlight any formulas or rules that are critical to understanding the solution.
-            
-            3. Make the content realistic with a proper flow and summary.
+        `options` are passed on to generate_content (e.g. `cached_content`).
+        """
+        with span("llm_call", model=getattr(model, "model_name", None)) as current:
+            try:
+                response = model.generate_content(prompt, **options)
+            except SafetyBlockedError as e:
+                finish_llm_call(current, "blocked")
+                raise ResponseError(str(e)) from e
+            except Exception as e:
+                finish_llm_call(current, "error")
+                raise ResponseError(f"Error generating response: {e}") from e
 
-            Transcript:
-            \n\n{chunk}
-            """
-            chunk_summary = self.get_response(self.model, prompt)
-            final_summary += chunk_summary + "\n\n"
+            try:
+                text = response.text if response else None
+            except Exception:
+                # `response.text` raises when the candidate was blocked and has no parts
+                text = None
+
+            # Check if there are any valid responses
+            if not text:
+                finish_llm_call(current, "blocked", response)
+                message = "No valid response generated. The content may have been blocked by the safety filter."
+
+                # Check safety ratings if available
+                candidates = getattr(response, 'candidates', None)
+                if candidates and getattr(candidates[0], 'safety_ratings', None):
+                    message += f" Safety ratings: {candidates[0].safety_ratings}"
+                raise ResponseError(message)
 
-        return final_summary
+            finish_llm_call(current, "ok", response)
+            return text
 
+    def stream_text(self, model, prompt, on_text, **options):
+        """Stream response text from the model into `on_text`, returning the full text.
 
+        Raises ResponseError like generate_text if the stream fails or yields no text.
+        """
+        parts = []
+        response = None
+        with span("llm_call", model=getattr(model, "model_name", None), stream=True) as current:
+            try:
+                for response in model.generate_content(prompt, stream=True, **options):
+                    try:
+                        text = response.text
+                    except Exception:
+                        # `response.text` raises when the candidate was blocked and has no parts
+                        text = None
+                    if text:
+                        if not parts:
+                            current.set(first_token_seconds=round(time.perf_counter() - current.started, 4))
+                        parts.append(text)
+                        on_text(text)
+            except SafetyBlockedError as e:
+                finish_llm_call(current, "blocked", response)
+                raise ResponseError(str(e)) from e
+            except Exception as e:
+                finish_llm_call(current, "error", response)
+                raise ResponseError(f"Error generating response: {e}") from e
 
+            # The last streamed response carries the usage metadata of the whole call
+            if not parts:
+                finish_llm_call(current, "blocked", response)
+                raise ResponseError("No valid response generated. The content may have been blocked by the safety filter.")
+            finish_llm_call(current, "ok", response)
+            return "".join(parts)
 
     def get_response(self, model, prompt):
         """Generate response from the model with safety and empty response checks."""
         try:
-            response = model.generate_content(prompt)
-            
-            # Check if there are any valid responses
-            if not response or not hasattr(response, 'text') or not response.text:
-                st.error("No valid response generated. The content may have been blocked by the safety filter.")
-                
-                # Check safety ratings if available
-                if hasattr(response, 'candidate') and hasattr(response.candidate, 'safety_ratings'):
-                    safety_info = response.candidate.safety_ratings
-                    st.warning(f"Response was blocked due to safety ratings: {safety_info}")
-                return ""
-            
-            # Return the response text if valid
-            return response.text
-        except Exception as e:
-            st.error(f"Error generating response: {e}")
+            return self.generate_text(model, prompt)
+        except ResponseError as e:
+            self.reporter.error(str(e))
             return ""
 
+    def summarize(self, url):
+        """Fetch transcription and return the SummaryResult for the YouTube video, or None.
 
-    def generate_summary(self, url):
-        """Fetch transcription and generate summary for the YouTube video."""
+        Concurrent calls for the same video share one run.
+        """
         video_id = self.get_video_id(url)
-        transcription = self.get_video_transcripts(video_id)
-        if transcription:
-            summary = self.get_chunked_summary(transcription)
-            return summary
-        else:
-            return None
+        key = self.flight_key(video_id)
+        flight, leader = self.flights.join(key)
+        count_cache("single_flight", not leader)
 
+        if not leader:
+            started = time.perf_counter()
+            flight.wait()
+            if not flight.abandoned:
+                if flight.result is None:
+                    return None
+                result = SummaryResult()
+                self._follow_result(flight.result, result, started)
+                return result
 
-# Function to display the UI and download button
-def summary_page(summarizer):
-    """Displays the YouTube summary page."""
-    st.title("YouTube Video Summarizer")
-    youtube_url = st.text_input("Enter YouTube Video URL", key="youtube_url")
+        result = None
+        completed = False
+        try:
+            with process_lock(repr(key)):
+                transcription = self.get_transcript_segments(video_id)
+                if transcription:
+                    result = self.summarize_transcript(transcription, video_id)
+            completed = True
+            return result
+        finally:
+            if leader:
+                flight.finish(result, abandoned=not completed)
+                self.flights.land(key, flight)
 
-    if youtube_url:
-        summary = summarizer.generate_summary(youtube_url)
-        if summary:
-            st.subheader("Video Summary:")
-            st.write(summary)
+    def generate_summary(self, url):
+        """Fetch transcription and generate summary for the YouTube video."""
+        result = self.summarize(url)
+        return result.summary if result else None